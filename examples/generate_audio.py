@@ -1,21 +1,16 @@
 from voco.core import AudioRouter
+from voco.utils.audio_utils import encode_stream
 import voco_kokoro
-import torch
-from scipy.io import wavfile
 
 # Load model
 router = AudioRouter()
 router.load("kokoro", alias="tts", device="cpu", lang_code="a")
 
-# Generate audio
+# Generate audio, writing each chunk as soon as it is ready
 text = "Hello world! This is VOCO with Kokoro TTS."
-audio_chunks = []
-for result in router.infer("tts", text=text, voice="af_heart", speed=1.0):
-    if result.audio is not None:
-        audio_chunks.append(result.audio)
+chunks = router.infer("tts", text=text, voice="af_heart", speed=1.0)
 
-# Save
-audio = torch.cat(audio_chunks, dim=-1)
-audio_np = audio.squeeze().cpu().numpy()
-wavfile.write("output.wav", 24000, audio_np)
-print(f"Saved output.wav ({audio.shape[-1] / 24000:.2f}s)")
+with open("output.wav", "wb") as f:
+    for data in encode_stream(chunks, format="wav"):
+        f.write(data)
+print("Saved output.wav")
@@ -1,4 +1,5 @@
 from typing import Any, Generator
+from voco.core.audio import AudioChunk, ChunkStream
 from voco.core.base_model import BaseAudioModel
 
 
@@ -7,8 +8,8 @@ class FishSpeechDriver(BaseAudioModel):
 
     def __init__(
         self,
-        device: str = "cuda",
-        dtype: str = "bfloat16",
+        device: str = "cpu",
+        dtype: str = "auto",
         **kwargs: Any
     ) -> None:
         super().__init__(device=device, dtype=dtype, **kwargs)
@@ -16,7 +17,12 @@ class FishSpeechDriver(BaseAudioModel):
         self.llama = None
         self.llama_decode = None
         self._checkpoint_path = kwargs.get("checkpoint_path", "checkpoints/fish-speech-1.5")
-        self._compile = kwargs.get("compile", True)
+        self._compile = kwargs.get("compile", "auto")
+        self._num_threads = kwargs.get("num_threads")
+        self._reference_cache_dir = kwargs.get("reference_cache_dir", "~/.voco/references")
+        self._persist_references = kwargs.get("persist_references", False)
+        self._voices = kwargs.get("voices", {})
+        self._vocoder_batch_size = kwargs.get("vocoder_batch_size", 8)
 
     def load(self) -> None:
         from .pipeline import FishSpeechPipeline
@@ -25,26 +31,47 @@ class FishSpeechDriver(BaseAudioModel):
             checkpoint_path=self._checkpoint_path,
             device=self.device,
             dtype=self.dtype,
-            compile=self._compile
+            compile=self._compile,
+            num_threads=self._num_threads,
+            reference_cache_dir=self._reference_cache_dir,
+            persist_references=self._persist_references,
+            vocoder_batch_size=self._vocoder_batch_size,
         )
+        for name, voice in self._voices.items():
+            self.register_voice(name, voice["audio"], voice.get("text", "reference audio"))
         self._loaded = True
 
+    def register_voice(
+        self,
+        name: str,
+        reference_audio: str | bytes,
+        reference_text: str = "reference audio",
+    ) -> None:
+        self.pipeline.register_voice(name, reference_audio, reference_text)
+
+    def warmup(self, voices: Any = None) -> None:
+        # {"name": {"audio": ..., "text": ...}}, encoded once and then served by name
+        for name, voice in (voices or {}).items():
+            self.register_voice(name, voice["audio"], voice.get("text", "reference audio"))
+
     def generate(
         self,
         text: str,
-        reference_audio: str,
+        reference_audio: str | None = None,
         reference_text: str = "reference audio",
         temperature: float = 0.7,
         top_p: float = 0.7,
         repetition_penalty: float = 1.1,
         max_new_tokens: int = 1000,
         chunk_length: int = 150,
+        voice: str | None = None,
         **kwargs: Any
-    ) -> Generator[Any, None, None]:
+    ) -> Generator[AudioChunk, None, None]:
         if not self._loaded or self.pipeline is None:
             raise RuntimeError("Model not loaded. Call load() first.")
 
-        for result in self.pipeline(
+        stream = ChunkStream(self.pipeline.sample_rate)
+        for audio in self.pipeline(
             text=text,
             reference_audio=reference_audio,
             reference_text=reference_text,
@@ -53,13 +80,15 @@ class FishSpeechDriver(BaseAudioModel):
             repetition_penalty=repetition_penalty,
             max_new_tokens=max_new_tokens,
             chunk_length=chunk_length,
+            voice=voice,
             **kwargs
         ):
-            yield result
+            yield stream.chunk(audio)
 
     def unload(self) -> None:
         if self.pipeline is not None:
             import torch
+            self.pipeline.vocoder.close()
             del self.pipeline
             self.pipeline = None
             if torch.cuda.is_available():
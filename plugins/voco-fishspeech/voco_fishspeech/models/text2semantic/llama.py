@@ -15,6 +15,7 @@ from torch.nn import functional as F
 from torch.nn.attention import SDPBackend, sdpa_kernel
 from torch.utils.checkpoint import checkpoint
 from transformers import AutoTokenizer
+from voco.core.weights import get_weight_store
 
 from ...tokenizer import SEMANTIC_TOKENS, FishTokenizer
 
@@ -23,6 +24,9 @@ from .lora import LoraConfig, setup_lora
 # Simple logger instead of RankedLogger
 log = logger
 
+# SDPA accepts fewer KV heads than query heads from torch 2.5
+SDPA_SUPPORTS_GQA = tuple(int(v) for v in torch.__version__.split(".")[:2]) >= (2, 5)
+
 
 def find_multiple(n: int, k: int) -> int:
     if n % k == 0:
@@ -364,6 +368,26 @@ class BaseTransformer(nn.Module):
             if module.padding_idx is not None:
                 module.weight.data[module.padding_idx].zero_()
 
+    @staticmethod
+    def normalize_checkpoint(weights: dict) -> dict:
+        if "state_dict" in weights:
+            logger.warning(
+                "Using a TextToSemantic LightningModule checkpoint, "
+                "please make sure it is a full model, not a LoRA model."
+            )
+            weights = weights["state_dict"]
+
+        if next(iter(weights.keys())).startswith("model."):
+            logger.info(
+                f"Remove prefix 'model.' created by TextToSemantic LightningModule from keys"
+            )
+            new_weights = OrderedDict()
+            for k, v in weights.items():
+                new_weights[k.replace("model.", "")] = v
+            weights = new_weights
+
+        return weights
+
     @staticmethod
     def from_pretrained(
         path: str,
@@ -372,6 +396,7 @@ class BaseTransformer(nn.Module):
         lora_config: LoraConfig | None = None,
         rope_base: int | None = None,
         is_agent: bool = False,
+        precision: torch.dtype | None = None,
     ) -> "BaseTransformer":
         config = BaseModelArgs.from_pretrained(str(path))
         if max_length is not None:
@@ -406,44 +431,29 @@ class BaseTransformer(nn.Module):
 
             if "int8" in str(Path(path)):
                 logger.info("Using int8 weight-only quantization!")
-                from tools.llama.quantize import WeightOnlyInt8QuantHandler
+                from ...tools.llama.quantize import WeightOnlyInt8QuantHandler
 
                 simple_quantizer = WeightOnlyInt8QuantHandler(model)
                 model = simple_quantizer.convert_for_runtime()
 
             if "int4" in str(Path(path)):
                 logger.info("Using int4 quantization!")
-                path_comps = path.name.split("-")
+                path_comps = Path(path).name.split("-")
                 assert path_comps[-2].startswith("g")
                 groupsize = int(path_comps[-2][1:])
-                from tools.llama.quantize import WeightOnlyInt4QuantHandler
+                from ...tools.llama.quantize import WeightOnlyInt4QuantHandler
 
                 simple_quantizer = WeightOnlyInt4QuantHandler(model, groupsize)
                 model = simple_quantizer.convert_for_runtime()
 
-            weights = torch.load(
+            # Converted once to the target dtype so moving the model does not copy it again
+            weights = get_weight_store().load(
                 Path(path) / "model.pth",
-                map_location="cpu",
-                mmap=True,
-                weights_only=True,
+                name=f"fishspeech:{Path(path).name}",
+                dtype=str(precision).replace("torch.", "") if precision else None,
+                transform=BaseTransformer.normalize_checkpoint,
             )
 
-            if "state_dict" in weights:
-                logger.warning(
-                    "Using a TextToSemantic LightningModule checkpoint, "
-                    "please make sure it is a full model, not a LoRA model."
-                )
-                weights = weights["state_dict"]
-
-            if next(iter(weights.keys())).startswith("model."):
-                logger.info(
-                    f"Remove prefix 'model.' created by TextToSemantic LightningModule from keys"
-                )
-                new_weights = OrderedDict()
-                for k, v in weights.items():
-                    new_weights[k.replace("model.", "")] = v
-                weights = new_weights
-
             # Verify the name and shape of parameters since strict=False in load_state_dict.
             for k, v in model.named_parameters():
                 if k not in weights:
@@ -567,6 +577,13 @@ class DualARTransformer(BaseTransformer):
             ),
             persistent=False,
         )
+        # Positions of the fast transformer, sliced per codebook during decoding
+        # so that no position tensor is allocated per generated token
+        self.register_buffer(
+            "fast_input_pos",
+            torch.arange(config.num_codebooks, dtype=torch.long),
+            persistent=False,
+        )
         self.apply(self._init_weights)
 
     def setup_caches(
@@ -683,9 +700,9 @@ class DualARTransformer(BaseTransformer):
         self,
         x: Tensor,
         input_pos: Optional[Tensor] = None,
-        vq_masks: Optional[Tensor] = None,
+        return_all: bool = False,
     ) -> TransformerForwardResult:
-        x = super().forward_generate(x, input_pos, vq_masks)
+        x = super().forward_generate(x, input_pos, return_all)
         x.hidden_states = self.fast_project_in(x.hidden_states)
         return x
 
@@ -758,8 +775,18 @@ class Attention(nn.Module):
         if self.kv_cache is not None:
             k, v = self.kv_cache.update(input_pos, k, v)
 
-        k = k.repeat_interleave(self.n_head // self.n_local_heads, dim=1)
-        v = v.repeat_interleave(self.n_head // self.n_local_heads, dim=1)
+        n_rep = self.n_head // self.n_local_heads
+        gqa_kwargs = {}
+        if n_rep > 1 and mask is not None and mask.size(1) == 1:
+            # Fold the query heads sharing a KV head into the sequence axis, so each group
+            # reads its K/V once instead of attending over repeated copies
+            q = q.reshape(bsz, self.n_local_heads, n_rep * seqlen, self.head_dim)
+            mask = mask.repeat(1, 1, n_rep, 1)
+        elif n_rep > 1 and mask is None and self.use_sdpa and SDPA_SUPPORTS_GQA:
+            gqa_kwargs["enable_gqa"] = True
+        elif n_rep > 1:
+            k = k.repeat_interleave(n_rep, dim=1)
+            v = v.repeat_interleave(n_rep, dim=1)
 
         if self.use_sdpa:
             if mask is None:
@@ -771,6 +798,7 @@ class Attention(nn.Module):
                         dropout_p=self.dropout if self.training else 0.0,
                         is_causal=True,
                         # No third party attn_mask here to use flash_attention
+                        **gqa_kwargs,
                     )
             else:
                 y = F.scaled_dot_product_attention(
@@ -789,6 +817,7 @@ class Attention(nn.Module):
                 dropout_p=self.dropout if self.training else 0.0,
             )
 
+        y = y.reshape(bsz, self.n_head, seqlen, self.head_dim)
         y = y.transpose(1, 2).contiguous().view(bsz, seqlen, self.dim)
 
         return self.wo(y)
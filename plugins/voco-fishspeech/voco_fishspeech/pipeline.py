@@ -1,3 +1,6 @@
+import hashlib
+import io
+from collections import deque
 from pathlib import Path
 from typing import Generator, Optional
 import torch
@@ -6,10 +9,14 @@ import numpy as np
 import scipy.io.wavfile
 from loguru import logger
 from huggingface_hub import snapshot_download
+from voco.core.references import ReferenceStore
+from voco.utils.audio_utils import resample
 
 # Import from internal modules
 from .tools.vqgan.inference import load_model as vqgan_load_model
 from .tools.llama.generate import load_model as llama_load_model, generate_long
+from .utils.cpu import configure_cpu_threads, resolve_compile, resolve_dtype
+from .vocoder import VocoderService
 
 
 class FishSpeechPipeline:
@@ -18,27 +25,43 @@ class FishSpeechPipeline:
     def __init__(
         self,
         checkpoint_path: str = "checkpoints/fish-speech-1.5",
-        device: str = "cuda",
-        dtype: str = "bfloat16",
-        compile: bool = True,
-        hf_repo_id: str = "fishaudio/fish-speech-1.5"
+        device: str = "cpu",
+        dtype: str = "auto",
+        compile: bool | str = "auto",
+        num_threads: Optional[int] = None,
+        hf_repo_id: str = "fishaudio/fish-speech-1.5",
+        reference_cache_dir: str = "~/.voco/references",
+        persist_references: bool = False,
+        vocoder_batch_size: int = 8,
     ):
         self.checkpoint_path = checkpoint_path
         self.device = device
-        self.compile = compile
+        self.compile = resolve_compile(compile, device)
         self.hf_repo_id = hf_repo_id
 
-        # Convert dtype string to torch dtype
-        if dtype == "bfloat16":
-            self.dtype = torch.bfloat16
-        elif dtype == "float16":
-            self.dtype = torch.float16
-        else:
-            self.dtype = torch.float32
+        # Convert dtype string to torch dtype, "auto" picks what the host runs fastest
+        self.dtype = resolve_dtype(dtype, device)
+
+        if device == "cpu":
+            configure_cpu_threads(num_threads)
 
         self.vqgan = None
         self.llama = None
         self.llama_decode = None
+        self.vocoder = None
+        self.vocoder_batch_size = vocoder_batch_size
+
+        # Encoded reference prompts, keyed by audio content hash and reference text. VQ indices
+        # only mean something to the codebook that produced them, so each checkpoint gets its own
+        # folder
+        checkpoint = Path(checkpoint_path).expanduser().resolve()
+        checkpoint_id = hashlib.sha256(str(checkpoint).encode()).hexdigest()[:12]
+        self.references = ReferenceStore(
+            f"fishspeech/{checkpoint.name}-{checkpoint_id}",
+            cache_dir=reference_cache_dir,
+            persist=persist_references,
+            loader=lambda codes: torch.from_numpy(codes).to(self.device),
+        )
 
         # Auto-download if checkpoint doesn't exist
         self._ensure_checkpoint_exists()
@@ -85,6 +108,10 @@ class FishSpeechPipeline:
             checkpoint_path=vqgan_checkpoint,
             device=self.device,
         )
+        self.sample_rate = self.vqgan.spec_transform.sample_rate
+        self.vocoder = VocoderService(
+            self.vqgan, device=self.device, max_batch_size=self.vocoder_batch_size
+        )
         logger.info("VQGAN model loaded")
 
         logger.info("Loading Fish Speech LLAMA model...")
@@ -103,10 +130,41 @@ class FishSpeechPipeline:
             )
         logger.info("LLAMA model loaded")
 
+    @torch.no_grad()
+    def encode_reference(self, reference_audio: str | bytes) -> torch.Tensor:
+        """Encode reference audio (a path or file bytes) to VQ tokens"""
+        if isinstance(reference_audio, bytes):
+            reference_audio = io.BytesIO(reference_audio)
+
+        audio, sr = torchaudio.load(reference_audio)
+        if audio.shape[0] > 1:
+            audio = audio.mean(0, keepdim=True)
+
+        if sr != self.sample_rate:
+            audio = torch.from_numpy(resample(audio[0].numpy(), sr, self.sample_rate))[None]
+
+        audio = audio.to(self.device)
+        audio_lengths = torch.tensor([audio.shape[-1]], device=self.device, dtype=torch.long)
+
+        indices_tuple = self.vqgan.encode(audio[None], audio_lengths)
+        return indices_tuple[0][0]
+
+    def register_voice(
+        self,
+        name: str,
+        reference_audio: str | bytes,
+        reference_text: str = "reference audio",
+    ) -> None:
+        """Encode a reference once and make it available as `voice=name`"""
+        self.references.register_voice(
+            name, reference_audio, reference_text, self.encode_reference
+        )
+        logger.info(f"Registered voice '{name}'")
+
     def __call__(
         self,
         text: str,
-        reference_audio: str,
+        reference_audio: Optional[str] = None,
         reference_text: str = "reference audio",
         temperature: float = 0.7,
         top_p: float = 0.7,
@@ -115,6 +173,8 @@ class FishSpeechPipeline:
         chunk_length: int = 150,
         num_samples: int = 1,
         iterative_prompt: bool = False,
+        num_draft_frames: int = 0,
+        voice: Optional[str] = None,
         **kwargs
     ) -> Generator[np.ndarray, None, None]:
         """
@@ -131,28 +191,26 @@ class FishSpeechPipeline:
             chunk_length: Text chunk length for generation
             num_samples: Number of samples to generate
             iterative_prompt: Whether to use iterative prompting
+            num_draft_frames: Frames drafted per step for speculative decoding (0 disables it)
+            voice: Name of a voice added with register_voice, used instead of reference_audio
 
         Yields:
             Generated audio as numpy arrays
         """
-        # Load and process reference audio
-        if isinstance(reference_audio, str):
-            reference_audio = [reference_audio]
-
-        audio, sr = torchaudio.load(reference_audio[0])
-        if audio.shape[0] > 1:
-            audio = audio.mean(0, keepdim=True)
-
-        desired_sr = self.vqgan.spec_transform.sample_rate
-        if sr != desired_sr:
-            audio = torchaudio.functional.resample(audio, sr, desired_sr)
-
-        audio = audio.to(self.device)
-        audio_lengths = torch.tensor([audio.shape[-1]], device=self.device, dtype=torch.long)
+        # Reference tokens are only encoded the first time a reference is seen
+        if voice is not None:
+            prompt = self.references.get_voice(voice)
+        elif reference_audio is not None:
+            if isinstance(reference_audio, list):
+                reference_audio = reference_audio[0]
+            prompt = self.references.get_or_encode(
+                reference_audio, reference_text, self.encode_reference
+            )
+        else:
+            raise ValueError("Either reference_audio or voice must be provided")
 
-        # Encode reference audio to tokens
-        indices_tuple = self.vqgan.encode(audio[None], audio_lengths)
-        reference_tokens = indices_tuple[0][0]
+        reference_tokens = prompt.codes
+        reference_text = prompt.text
 
         # Generate speech codes
         with torch.no_grad():
@@ -171,41 +229,26 @@ class FishSpeechPipeline:
                 compile=self.compile,
                 iterative_prompt=iterative_prompt,
                 chunk_length=chunk_length,
+                num_draft_frames=num_draft_frames,
             )
 
+            # Segments are vocoded on the service thread while the next one is generated
             codes = []
+            pending = deque()
             for response in generator:
                 if response.action == "sample":
-                    codes.append(response.codes.detach().cpu().numpy())
+                    codes.append(response.codes)
                 elif response.action == "next":
                     if codes:
-                        # Concatenate all codes
-                        all_codes = np.concatenate(codes, axis=1)
-                        all_codes_torch = torch.from_numpy(all_codes).long().to(self.device).unsqueeze(0)
-                        feature_lengths = torch.tensor([all_codes_torch.shape[-1]], device=self.device)
-
-                        # Decode to audio
-                        with torch.no_grad():
-                            fake_audio, _ = self.vqgan.decode(
-                                indices=all_codes_torch,
-                                feature_lengths=feature_lengths
-                            )
-
-                        audio_np = fake_audio[0, 0].float().detach().cpu().numpy()
-                        yield audio_np
+                        pending.append(self.vocoder.submit(torch.cat(codes, dim=1)))
                         codes = []
 
+                    while pending and pending[0].done():
+                        yield pending.popleft().result().float().cpu().numpy()
+
             # Handle any remaining codes
             if codes:
-                all_codes = np.concatenate(codes, axis=1)
-                all_codes_torch = torch.from_numpy(all_codes).long().to(self.device).unsqueeze(0)
-                feature_lengths = torch.tensor([all_codes_torch.shape[-1]], device=self.device)
-
-                with torch.no_grad():
-                    fake_audio, _ = self.vqgan.decode(
-                        indices=all_codes_torch,
-                        feature_lengths=feature_lengths
-                    )
-
-                audio_np = fake_audio[0, 0].float().detach().cpu().numpy()
-                yield audio_np
+                pending.append(self.vocoder.submit(torch.cat(codes, dim=1)))
+
+            while pending:
+                yield pending.popleft().result().float().cpu().numpy()
@@ -0,0 +1,209 @@
+import time
+from pathlib import Path
+
+import click
+import torch
+from loguru import logger
+
+from .generate import (
+    decode_n_tokens,
+    decode_one_token_ar,
+    encode_tokens,
+    load_model,
+)
+
+
+def decode_one_token_ar_reset_cache(model, **kwargs) -> torch.Tensor:
+    """Baseline that zeroes every fast KV cache before each frame, as decoding used to."""
+    for layer in model.fast_layers:
+        layer.attention.kv_cache.k_cache.fill_(0)
+        layer.attention.kv_cache.v_cache.fill_(0)
+
+    return decode_one_token_ar(model=model, **kwargs)
+
+
+def benchmark_decode(
+    model,
+    decode_one_token,
+    prompt: torch.Tensor,
+    num_tokens: int,
+    seed: int = 42,
+    **sampling_kwargs,
+) -> float:
+    """Decode `num_tokens` frames after `prompt` and return the achieved tokens/sec."""
+    semantic_ids = [
+        model.tokenizer.get_token_id(f"<|semantic:{i}|>") for i in range(1024)
+    ]
+    codebook_dim = 1 + model.config.num_codebooks
+    T = prompt.size(1)
+
+    torch.manual_seed(seed)
+    with torch.inference_mode():
+        next_token = decode_one_token_ar(
+            model,
+            x=prompt.view(1, codebook_dim, -1),
+            input_pos=torch.arange(0, T, device=prompt.device),
+            semantic_ids=semantic_ids,
+            **sampling_kwargs,
+        )
+
+        input_pos = torch.tensor([T], device=prompt.device, dtype=torch.int)
+        t0 = time.perf_counter()
+        tokens = decode_n_tokens(
+            model,
+            next_token.view(1, codebook_dim, -1),
+            input_pos,
+            num_tokens,
+            decode_one_token=decode_one_token,
+            semantic_ids=semantic_ids,
+            **sampling_kwargs,
+        )
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        elapsed = time.perf_counter() - t0
+
+    return tokens.size(1) / elapsed
+
+
+@click.group()
+def cli() -> None:
+    pass
+
+
+@cli.command()
+@click.option(
+    "--checkpoint-path",
+    type=click.Path(path_type=Path, exists=True),
+    default="checkpoints/fish-speech-1.5",
+)
+@click.option("--device", type=str, default="cpu")
+@click.option("--half/--no-half", default=False)
+@click.option("--text", type=str, default="Benchmarking the fast codebook decoder.")
+@click.option("--num-tokens", type=int, default=128)
+@click.option("--repeats", type=int, default=3)
+@click.option("--seed", type=int, default=42)
+def decode(
+    checkpoint_path: Path,
+    device: str,
+    half: bool,
+    text: str,
+    num_tokens: int,
+    repeats: int,
+    seed: int,
+) -> None:
+    """Compare decode tokens/sec with and without the per-frame fast cache reset."""
+    precision = torch.half if half else torch.float32
+    model, _ = load_model(checkpoint_path, device, precision, compile=False)
+    with torch.device(device):
+        model.setup_caches(
+            max_batch_size=1,
+            max_seq_len=model.config.max_seq_len,
+            dtype=next(model.parameters()).dtype,
+        )
+
+    prompt = encode_tokens(
+        model.tokenizer,
+        string=text,
+        device=device,
+        num_codebooks=model.config.num_codebooks,
+    )
+    sampling_kwargs = dict(
+        temperature=torch.tensor(0.7, device=device, dtype=torch.float),
+        top_p=torch.tensor(0.7, device=device, dtype=torch.float),
+        repetition_penalty=torch.tensor(1.2, device=device, dtype=torch.float),
+    )
+
+    variants = {
+        "reset-cache (before)": decode_one_token_ar_reset_cache,
+        "no-reset (after)": decode_one_token_ar,
+    }
+    results = {}
+    for name, fn in variants.items():
+        # The first run warms up allocator and kernel caches
+        benchmark_decode(model, fn, prompt, min(num_tokens, 8), seed, **sampling_kwargs)
+        runs = [
+            benchmark_decode(model, fn, prompt, num_tokens, seed, **sampling_kwargs)
+            for _ in range(repeats)
+        ]
+        results[name] = max(runs)
+        logger.info(f"{name}: {results[name]:.02f} tokens/sec (best of {repeats})")
+
+    before, after = results.values()
+    logger.info(f"Speedup: {after / before:.02f}x")
+
+
+@cli.command()
+@click.option(
+    "--checkpoint-path",
+    type=click.Path(path_type=Path, exists=True),
+    default="checkpoints/fish-speech-1.5",
+)
+@click.option(
+    "--reference-audio", type=click.Path(path_type=Path, exists=True), required=True
+)
+@click.option("--reference-text", type=str, default="reference audio")
+@click.option("--device", type=str, default="cpu")
+@click.option("--dtype", type=str, default="auto")
+@click.option("--compile", type=str, default="auto")
+@click.option("--num-threads", type=int, default=None)
+@click.option(
+    "--text",
+    type=str,
+    default="The quick brown fox jumps over the lazy dog. It was a bright cold day in April.",
+)
+@click.option("--repeats", type=int, default=3)
+@click.option("--seed", type=int, default=42)
+def rtf(
+    checkpoint_path: Path,
+    reference_audio: Path,
+    reference_text: str,
+    device: str,
+    dtype: str,
+    compile: str,
+    num_threads: int | None,
+    text: str,
+    repeats: int,
+    seed: int,
+) -> None:
+    """Measure the real-time factor (synthesis time / audio duration) of the full pipeline."""
+    from ...pipeline import FishSpeechPipeline
+
+    pipeline = FishSpeechPipeline(
+        checkpoint_path=str(checkpoint_path),
+        device=device,
+        dtype=dtype,
+        compile=compile if compile == "auto" else compile.lower() in ("1", "true", "yes"),
+        num_threads=num_threads,
+    )
+    sample_rate = pipeline.vqgan.spec_transform.sample_rate
+    logger.info(
+        f"Profile: device={device}, dtype={pipeline.dtype}, compile={pipeline.compile}, "
+        f"threads={torch.get_num_threads()}"
+    )
+
+    # The first run encodes the reference and warms up kernels
+    for _ in pipeline(text, reference_audio=str(reference_audio), reference_text=reference_text):
+        pass
+
+    for i in range(repeats):
+        torch.manual_seed(seed)
+        t0 = time.perf_counter()
+        first_chunk = None
+        num_samples = 0
+        for audio in pipeline(
+            text, reference_audio=str(reference_audio), reference_text=reference_text
+        ):
+            if first_chunk is None:
+                first_chunk = time.perf_counter() - t0
+            num_samples += audio.shape[-1]
+        elapsed = time.perf_counter() - t0
+
+        duration = num_samples / sample_rate
+        logger.info(
+            f"Run {i}: {duration:.02f}s of audio in {elapsed:.02f}s, "
+            f"RTF {elapsed / max(duration, 1e-6):.03f}, first chunk after {first_chunk:.02f}s"
+        )
+
+
+if __name__ == "__main__":
+    cli()
@@ -16,6 +16,7 @@ import torch._inductor.config
 from loguru import logger
 from tqdm import tqdm
 from transformers import AutoTokenizer
+from voco.core import instrumentation
 
 from ...conversation import (
     CODEBOOK_PAD_TOKEN_ID,
@@ -61,26 +62,34 @@ def logits_to_probs(
     top_p: torch.Tensor = 1.0,
     repetition_penalty: torch.Tensor = 1.0,
 ) -> torch.Tensor:
+    # logits: [..., vocab], previous_tokens: [..., window]
+    # Leading dims are independent rows (e.g. codebooks), handled in one pass
+
     # Apply repetition penalty
     if previous_tokens is not None:
         previous_tokens = previous_tokens.long()
-        score = torch.gather(logits, dim=0, index=previous_tokens)
+        score = torch.gather(logits, dim=-1, index=previous_tokens)
         score = torch.where(
             score < 0, score * repetition_penalty, score / repetition_penalty
         )
-        logits.scatter_(dim=0, index=previous_tokens, src=score)
+        logits.scatter_(dim=-1, index=previous_tokens, src=score)
 
     # Apply top-p sampling
     sorted_logits, sorted_indices = torch.sort(logits, descending=True)
     cum_probs = torch.cumsum(torch.nn.functional.softmax(sorted_logits, dim=-1), dim=-1)
     sorted_indices_to_remove = cum_probs > top_p
-    sorted_indices_to_remove[0] = False  # keep at least one option
+    sorted_indices_to_remove[..., 0] = False  # keep at least one option
     indices_to_remove = sorted_indices_to_remove.scatter(
-        dim=0, index=sorted_indices, src=sorted_indices_to_remove
+        dim=-1, index=sorted_indices, src=sorted_indices_to_remove
     )
     logits = logits.masked_fill(indices_to_remove, -float("Inf"))
 
-    logits = logits / max(temperature, 1e-5)
+    # Python max() on a tensor would sync and break the compiled graph
+    if isinstance(temperature, torch.Tensor):
+        temperature = temperature.clamp(min=1e-5)
+    else:
+        temperature = max(temperature, 1e-5)
+    logits = logits / temperature
 
     probs = torch.nn.functional.softmax(logits, dim=-1)
     return probs
@@ -175,16 +184,13 @@ def decode_one_token_ar_agent(
         )[0]
     ]
 
-    # Cleanup the cache
-    for layer in model.fast_layers:
-        layer.attention.kv_cache.k_cache.fill_(0)
-        layer.attention.kv_cache.v_cache.fill_(0)
+    # No need to clear the fast cache: see decode_one_token_ar
+    fast_input_pos = model.fast_input_pos
 
     for codebook_idx in range(model.config.num_codebooks):
-        input_pos = torch.tensor(
-            [codebook_idx], device=hidden_states.device, dtype=torch.long
+        logits = model.forward_generate_fast(
+            hidden_states, fast_input_pos[codebook_idx : codebook_idx + 1]
         )
-        logits = model.forward_generate_fast(hidden_states, input_pos)
         a = sample_agent(
             logits,
             previous_tokens=(
@@ -275,23 +281,21 @@ def decode_one_token_ar(
 
     hidden_states = x.hidden_states
 
-    # Cleanup the cache
-    for layer in model.fast_layers:
-        layer.attention.kv_cache.k_cache.fill_(0)
-        layer.attention.kv_cache.v_cache.fill_(0)
+    # The fast KV cache only holds num_codebooks positions, and each position is
+    # written before the causal mask lets a later codebook attend to it, so the
+    # entries left over from the previous frame are never read and need no reset.
+    fast_input_pos = model.fast_input_pos
 
-    input_pos = torch.tensor([0], device=hidden_states.device, dtype=torch.long)
-    model.forward_generate_fast(hidden_states, input_pos)
+    model.forward_generate_fast(hidden_states, fast_input_pos[:1])
     a = codebooks[0] - model.tokenizer.semantic_begin_id
     a[a < 0] = 0
     hidden_states = model.fast_embeddings(a)
     codebooks.append(a)
 
     for codebook_idx in range(1, model.config.num_codebooks):
-        input_pos = torch.tensor(
-            [codebook_idx], device=hidden_states.device, dtype=torch.long
+        logits = model.forward_generate_fast(
+            hidden_states, fast_input_pos[codebook_idx : codebook_idx + 1]
         )
-        logits = model.forward_generate_fast(hidden_states, input_pos)
         a = sample(
             logits,
             previous_tokens=(
@@ -318,6 +322,7 @@ def decode_one_token_naive(
     model: NaiveTransformer,
     x: torch.Tensor,
     input_pos: torch.Tensor,
+    semantic_ids: list = None,
     previous_tokens: torch.Tensor = None,
     **sampling_kwargs,
 ) -> torch.Tensor:
@@ -328,26 +333,21 @@ def decode_one_token_naive(
     sampling_kwargs_main["top_p"] = 0.1
     sampling_kwargs_main["repetition_penalty"] = 1.0
 
-    codebooks = [
-        sample(
-            x.logits,
-            previous_tokens=None,  # Disable repetition penalty for the token codebook
-            **sampling_kwargs_main,
-        )[0]
-    ]
-
-    for i in range(model.config.num_codebooks):
-        codebooks.append(
-            sample(
-                x.codebook_logits[:, :, i],
-                previous_tokens=(
-                    previous_tokens[i + 1] if previous_tokens is not None else None
-                ),
-                **sampling_kwargs,
-            )[0]
-        )
+    main_token = sample(
+        x.token_logits,
+        previous_tokens=None,  # Disable repetition penalty for the token codebook
+        **sampling_kwargs_main,
+    )[0]
+
+    # All codebooks share the same sampling settings, so penalise and sample
+    # them together as one [num_codebooks, codebook_size] batch
+    codebooks = sample(
+        x.codebook_logits,
+        previous_tokens=previous_tokens[1:] if previous_tokens is not None else None,
+        **sampling_kwargs,
+    )[0]
 
-    return torch.stack(codebooks, dim=0)
+    return torch.cat([main_token.view(1, 1), codebooks], dim=0)
 
 
 def decode_n_tokens(
@@ -359,20 +359,23 @@ def decode_n_tokens(
     decode_one_token=decode_one_token_naive,
     **sampling_kwargs,
 ):
+    codebook_dim = model.config.num_codebooks + 1
     previous_tokens = torch.zeros(
-        (model.config.num_codebooks + 1, model.config.max_seq_len),
+        (codebook_dim, num_new_tokens),
         dtype=torch.int,
         device=cur_token.device,
     )
 
-    for i in tqdm(range(num_new_tokens)):
-        # We need to get windowed repeat penalty
-        win_size = 16
-        if i < win_size:
-            window = previous_tokens[:, :win_size]
-        else:
-            window = previous_tokens[:, i - win_size : i]
+    # We need to get windowed repeat penalty. The penalty only depends on which
+    # tokens are in the window, not their order, so the last win_size frames are
+    # kept in a fixed-shape ring buffer instead of slicing a new window per step.
+    win_size = 16
+    window = torch.zeros(
+        (codebook_dim, win_size), dtype=torch.int, device=cur_token.device
+    )
 
+    for i in tqdm(range(num_new_tokens)):
+        step_start = time.perf_counter()
         with (
             torch.backends.cuda.sdp_kernel(
                 enable_flash=False, enable_mem_efficient=False, enable_math=True
@@ -390,17 +393,230 @@ def decode_n_tokens(
             )
 
         input_pos += 1
-        cur_token = next_token.view(1, model.config.num_codebooks + 1, -1)
-        previous_tokens[:, i : i + 1] = next_token.view(
-            model.config.num_codebooks + 1, -1
-        )
-
-        if cur_token[0, 0, -1] == model.tokenizer.get_token_id(IM_END_TOKEN):
+        cur_token = next_token.view(1, codebook_dim, -1)
+        previous_tokens[:, i : i + 1] = next_token.view(codebook_dim, -1)
+        window[:, i % win_size] = next_token.view(codebook_dim)
+
+        # Reading the token waits for the step, so the time below covers its compute
+        finished = bool(cur_token[0, 0, -1] == model.tokenizer.get_token_id(IM_END_TOKEN))
+        instrumentation.record("decode_token", time.perf_counter() - step_start)
+        if finished:
             break
 
     return previous_tokens[:, : i + 1]
 
 
+class NGramDraft:
+    """
+    Cheap draft model for speculative decoding.
+
+    Remembers every frame seen so far (reference codes and generated frames) and,
+    when the semantic tokens of the last `n` frames occurred before, proposes the
+    frames that followed that earlier occurrence.
+    """
+
+    def __init__(self, n: int = 2) -> None:
+        self.n = n
+        self.frames: list[tuple[int, ...]] = []
+        self.table: dict[tuple[int, ...], int] = {}
+
+    def extend(self, frames: torch.Tensor) -> None:
+        # frames: [num_codebooks + 1, seq_len]
+        for frame in frames.t().tolist():
+            self.append(tuple(frame))
+
+    def append(self, frame: tuple[int, ...]) -> None:
+        self.frames.append(frame)
+        if len(self.frames) > self.n:
+            key = tuple(f[0] for f in self.frames[-self.n - 1 : -1])
+            self.table[key] = len(self.frames) - 1
+
+    def propose(self, max_frames: int) -> list[tuple[int, ...]]:
+        if max_frames <= 0 or len(self.frames) < self.n:
+            return []
+
+        start = self.table.get(tuple(f[0] for f in self.frames[-self.n :]))
+        if start is None:
+            return []
+
+        return self.frames[start : start + max_frames]
+
+
+def speculative_sample(
+    logits: torch.Tensor,
+    draft_token: Optional[int],
+    previous_tokens: Optional[torch.Tensor] = None,
+    **sampling_kwargs,
+) -> Tuple[torch.Tensor, bool]:
+    # The draft is a point mass, so accepting it with probability p(draft) and
+    # otherwise sampling from p with the draft removed leaves the output
+    # distribution exactly p.
+    probs = logits_to_probs(
+        logits=logits[0, -1], previous_tokens=previous_tokens, **sampling_kwargs
+    )
+
+    if draft_token is not None:
+        if torch.rand((), device=probs.device) < probs[draft_token]:
+            return (
+                torch.tensor([draft_token], device=probs.device, dtype=torch.int),
+                True,
+            )
+
+        probs = probs.clone()
+        probs[draft_token] = 0
+        probs = probs / probs.sum()
+
+    return multinomial_sample_one_no_sync(probs), False
+
+
+def verify_one_token_ar(
+    model: DualARTransformer,
+    logits: torch.Tensor,
+    hidden_states: torch.Tensor,
+    draft: Optional[tuple[int, ...]],
+    previous_tokens: torch.Tensor = None,
+    **sampling_kwargs,
+) -> Tuple[torch.Tensor, bool]:
+    """
+    Same as decode_one_token_ar, but starting from precomputed slow transformer
+    outputs and checking every sampled codebook against a drafted frame.
+    Returns the frame and whether it matches the draft.
+    """
+
+    accepted = draft is not None
+
+    def pick(logits, idx, window):
+        nonlocal accepted
+        token, ok = speculative_sample(
+            logits,
+            draft[idx] if accepted else None,
+            previous_tokens=window,
+            **sampling_kwargs,
+        )
+        accepted = accepted and ok
+        return token
+
+    codebooks = [
+        pick(
+            logits,
+            0,
+            previous_tokens[0] if previous_tokens is not None else None,
+        )
+    ]
+
+    fast_input_pos = model.fast_input_pos
+
+    model.forward_generate_fast(hidden_states, fast_input_pos[:1])
+    a = codebooks[0] - model.tokenizer.semantic_begin_id
+    a[a < 0] = 0
+    hidden_states = model.fast_embeddings(a)
+    codebooks.append(a)
+
+    for codebook_idx in range(1, model.config.num_codebooks):
+        logits = model.forward_generate_fast(
+            hidden_states, fast_input_pos[codebook_idx : codebook_idx + 1]
+        )
+        a = pick(
+            logits,
+            codebook_idx + 1,
+            previous_tokens[codebook_idx + 1] if previous_tokens is not None else None,
+        )
+        hidden_states = model.fast_embeddings(a)
+        codebooks.append(a)
+
+    return torch.stack(codebooks, dim=0), accepted
+
+
+def decode_n_tokens_speculative(
+    model: DualARTransformer,
+    cur_token: torch.Tensor,
+    input_pos: torch.Tensor,
+    num_new_tokens: int,
+    draft: NGramDraft,
+    num_draft_frames: int = 4,
+    **sampling_kwargs,
+):
+    """
+    Speculative version of decode_n_tokens for the DualARTransformer.
+
+    Each step feeds the current frame plus up to `num_draft_frames` drafted frames
+    through the slow transformer in a single forward pass, then walks the drafts
+    in order, keeping them while they pass verification. Every step yields at
+    least one frame, and the sampling distribution is the same as decode_n_tokens.
+    """
+
+    codebook_dim = model.config.num_codebooks + 1
+    previous_tokens = torch.zeros(
+        (codebook_dim, num_new_tokens),
+        dtype=torch.int,
+        device=cur_token.device,
+    )
+    im_end_id = model.tokenizer.get_token_id(IM_END_TOKEN)
+
+    # Same ring buffer window as decode_n_tokens
+    win_size = 16
+    window = torch.zeros(
+        (codebook_dim, win_size), dtype=torch.int, device=cur_token.device
+    )
+
+    draft.append(tuple(cur_token.view(codebook_dim).tolist()))
+    num_proposed = num_accepted = 0
+    finished = False
+    i = 0
+
+    while i < num_new_tokens and not finished:
+        step_start, step_first = time.perf_counter(), i
+        proposals = draft.propose(min(num_draft_frames, num_new_tokens - i - 1))
+        num_proposed += len(proposals)
+
+        x = cur_token.view(1, codebook_dim, 1)
+        if proposals:
+            drafted = torch.tensor(
+                proposals, device=cur_token.device, dtype=cur_token.dtype
+            )
+            x = torch.cat([x, drafted.t()[None]], dim=2)
+
+        positions = input_pos + torch.arange(x.size(2), device=input_pos.device)
+        result = model.forward_generate(x, positions, return_all=True)
+
+        for j in range(x.size(2)):
+            next_token, accepted = verify_one_token_ar(
+                model,
+                logits=result.logits[:, j : j + 1],
+                hidden_states=result.hidden_states[:, j : j + 1],
+                draft=proposals[j] if j < len(proposals) else None,
+                previous_tokens=window,
+                **sampling_kwargs,
+            )
+
+            previous_tokens[:, i : i + 1] = next_token
+            window[:, i % win_size] = next_token.view(codebook_dim)
+            cur_token = next_token
+            draft.append(tuple(next_token.view(codebook_dim).tolist()))
+            i += 1
+
+            if next_token[0, -1] == im_end_id:
+                finished = True
+
+            if not accepted or finished:
+                break
+
+            num_accepted += 1
+
+        input_pos = input_pos + (j + 1)
+        # One forward pass yields several frames; each is reported at its share of the step
+        step_frames = i - step_first
+        frame_time = (time.perf_counter() - step_start) / step_frames
+        for _ in range(step_frames):
+            instrumentation.record("decode_token", frame_time)
+
+    logger.info(
+        f"Speculative decoding accepted {num_accepted}/{num_proposed} drafted frames"
+    )
+
+    return previous_tokens[:, :i]
+
+
 @torch.no_grad()
 @torch.inference_mode()
 def generate(
@@ -409,10 +625,13 @@ def generate(
     prompt: torch.Tensor,
     max_new_tokens: int,
     decode_one_token=decode_one_token_naive,
+    num_draft_frames: int = 0,
     **sampling_kwargs,
 ) -> torch.Tensor:
     """
     Takes a conditioning sequence (prompt) as input and continues to generate as many tokens as requested.
+    With num_draft_frames > 0, a DualARTransformer decodes speculatively with an
+    n-gram draft built from the VQ frames in the prompt.
     """
 
     # create an empty tensor of the expected final shape and fill in the current tokens
@@ -450,25 +669,44 @@ def generate(
         else decode_one_token_ar
     )
 
-    next_token = prefill_decode(
-        model,
-        prompt.view(1, codebook_dim, -1),
-        input_pos,
-        semantic_ids=semantic_ids,
-        **sampling_kwargs,
-    )
+    with instrumentation.span("prefill"):
+        next_token = prefill_decode(
+            model,
+            prompt.view(1, codebook_dim, -1),
+            input_pos,
+            semantic_ids=semantic_ids,
+            **sampling_kwargs,
+        )
     seq[:, T : T + 1] = next_token
 
     input_pos = torch.tensor([T], device=device, dtype=torch.int)
-    x = decode_n_tokens(
-        model,
-        next_token.view(1, codebook_dim, -1),
-        input_pos,
-        max_new_tokens - 1,
-        decode_one_token=decode_one_token,
-        semantic_ids=semantic_ids,
-        **sampling_kwargs,
-    )
+    if num_draft_frames > 0 and isinstance(model, DualARTransformer):
+        draft = NGramDraft()
+        is_semantic = (prompt[0] >= model.tokenizer.semantic_begin_id) & (
+            prompt[0] <= model.tokenizer.semantic_end_id
+        )
+        draft.extend(prompt[:, is_semantic])
+
+        x = decode_n_tokens_speculative(
+            model,
+            next_token.view(1, codebook_dim, -1),
+            input_pos,
+            max_new_tokens - 1,
+            draft=draft,
+            num_draft_frames=num_draft_frames,
+            **sampling_kwargs,
+        )
+    else:
+        x = decode_n_tokens(
+            model,
+            next_token.view(1, codebook_dim, -1),
+            input_pos,
+            max_new_tokens - 1,
+            decode_one_token=decode_one_token,
+            semantic_ids=semantic_ids,
+            **sampling_kwargs,
+        )
+    instrumentation.count("tokens", x.size(1) + 1)
     # x = torch.cat(generated_tokens, dim=1)
     seq = seq[:, : T + 1 + x.size(1)]
     seq[:, T + 1 :] = x
@@ -676,7 +914,7 @@ def encode_tokens(
 
 def load_model(checkpoint_path, device, precision, compile=False, is_agent=False):
     model: Union[NaiveTransformer, DualARTransformer] = BaseTransformer.from_pretrained(
-        checkpoint_path, load_weights=True, is_agent=is_agent
+        checkpoint_path, load_weights=True, is_agent=is_agent, precision=precision
     )
 
     model = model.to(device=device, dtype=precision)
@@ -695,11 +933,13 @@ def load_model(checkpoint_path, device, precision, compile=False, is_agent=False
 
     if compile:
         logger.info("Compiling function...")
+        # CUDA graphs only exist on GPU; on CPU inductor still fuses the sampling ops
+        on_cuda = str(device).startswith("cuda")
         decode_one_token = torch.compile(
             decode_one_token,
             fullgraph=True,
-            backend="inductor" if torch.cuda.is_available() else "aot_eager",
-            mode="reduce-overhead" if torch.cuda.is_available() else None,
+            backend="inductor",
+            mode="reduce-overhead" if on_cuda else None,
         )
 
     return model.eval(), decode_one_token
@@ -729,6 +969,7 @@ def generate_long(
     chunk_length: int = 150,
     prompt_text: Optional[str | list[str]] = None,
     prompt_tokens: Optional[torch.Tensor | list[torch.Tensor]] = None,
+    num_draft_frames: int = 0,
 ):
     assert 0 < top_p <= 1, "top_p must be in (0, 1]"
     assert 0 < repetition_penalty < 2, "repetition_penalty must be in (0, 2)"
@@ -748,46 +989,48 @@ def generate_long(
     im_end_id = tokenizer.get_token_id("<|im_end|>")
 
     encoded = []
-    texts = split_text(text, chunk_length) if iterative_prompt else [text]
-    encoded_prompts = [
-        Conversation(
-            messages=[
-                Message(
-                    role="system",
-                    parts=[TextPart(text="Speak out the provided text.")],
-                    cal_loss=False,
+    # Text cleanup, splitting and tokenization
+    with instrumentation.span("text"):
+        texts = split_text(text, chunk_length) if iterative_prompt else [text]
+        encoded_prompts = [
+            Conversation(
+                messages=[
+                    Message(
+                        role="system",
+                        parts=[TextPart(text="Speak out the provided text.")],
+                        cal_loss=False,
+                    )
+                ]
+            )
+            .encode_for_inference(
+                tokenizer=tokenizer,
+                num_codebooks=model.config.num_codebooks,
+            )
+            .to(device)
+        ]
+
+        if use_prompt:
+            for idx, (t, c) in enumerate(zip(prompt_text, prompt_tokens)):
+                encoded_prompts.append(
+                    encode_tokens(
+                        tokenizer,
+                        string=t,
+                        device=device,
+                        prompt_tokens=c,
+                        num_codebooks=model.config.num_codebooks,
+                    )
                 )
-            ]
-        )
-        .encode_for_inference(
-            tokenizer=tokenizer,
-            num_codebooks=model.config.num_codebooks,
-        )
-        .to(device)
-    ]
 
-    if use_prompt:
-        for idx, (t, c) in enumerate(zip(prompt_text, prompt_tokens)):
-            encoded_prompts.append(
+        for idx, text in enumerate(texts):
+            encoded.append(
                 encode_tokens(
                     tokenizer,
-                    string=t,
+                    string=text,
                     device=device,
-                    prompt_tokens=c,
                     num_codebooks=model.config.num_codebooks,
                 )
             )
-
-    for idx, text in enumerate(texts):
-        encoded.append(
-            encode_tokens(
-                tokenizer,
-                string=text,
-                device=device,
-                num_codebooks=model.config.num_codebooks,
-            )
-        )
-        logger.info(f"Encoded text: {text}")
+            logger.info(f"Encoded text: {text}")
 
     # Move temperature, top_p, repetition_penalty to device
     # This is important so that changing params doesn't trigger recompile
@@ -844,6 +1087,7 @@ def generate_long(
                 prompt=cat_encoded,
                 max_new_tokens=max_new_tokens,
                 decode_one_token=decode_one_token,
+                num_draft_frames=num_draft_frames,
                 temperature=temperature,
                 top_p=top_p,
                 repetition_penalty=repetition_penalty,
@@ -0,0 +1,344 @@
+import datetime
+import shutil
+import time
+from pathlib import Path
+
+import click
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from loguru import logger
+
+from ...models.text2semantic.llama import Attention, BaseTransformer, FeedForward
+
+# Only the projections inside attention and feed-forward blocks are quantized;
+# embeddings, norms and the output heads stay in full precision
+QUANTIZED_PARENTS = (Attention, FeedForward)
+
+
+def find_quantizable_linears(module: nn.Module, groupsize: int | None = None):
+    for parent_name, parent in module.named_modules():
+        if not isinstance(parent, QUANTIZED_PARENTS):
+            continue
+
+        for name, child in parent.named_children():
+            if not isinstance(child, nn.Linear):
+                continue
+            if groupsize is not None and child.in_features % groupsize != 0:
+                logger.warning(
+                    f"Skipping {parent_name}.{name}: in_features={child.in_features} "
+                    f"is not a multiple of groupsize={groupsize}"
+                )
+                continue
+
+            yield f"{parent_name}.{name}", parent, name, child
+
+
+##### Quantization primitives ######
+
+
+def dynamically_quantize_per_channel(x: torch.Tensor, quant_min: int, quant_max: int):
+    # Symmetric per output channel quantization, weight is (out_features, in_features)
+    eps = torch.finfo(torch.float32).eps
+    x = x.float()
+    max_abs = x.abs().amax(dim=1)
+    scales = (max_abs / ((quant_max - quant_min) / 2)).clamp(min=eps)
+
+    quant = torch.clamp(torch.round(x / scales[:, None]), quant_min, quant_max)
+    return quant.to(torch.int8), scales
+
+
+def get_group_qparams(w: torch.Tensor, n_bit: int = 4, groupsize: int = 128):
+    assert w.dim() == 2 and w.shape[-1] % groupsize == 0
+
+    to_quant = w.float().reshape(-1, groupsize)
+    max_val = to_quant.amax(dim=1, keepdim=True)
+    min_val = to_quant.amin(dim=1, keepdim=True)
+    max_int = 2**n_bit - 1
+    scales = (max_val - min_val).clamp(min=1e-6) / max_int
+    zeros = min_val + scales * (2 ** (n_bit - 1))
+
+    return scales.reshape(w.shape[0], -1), zeros.reshape(w.shape[0], -1)
+
+
+def pack_scales_and_zeros(scales: torch.Tensor, zeros: torch.Tensor) -> torch.Tensor:
+    # (out_features, n_groups) x 2 -> (n_groups, out_features, 2)
+    return torch.stack([scales, zeros], dim=-1).transpose(0, 1).contiguous()
+
+
+def unpack_scales_and_zeros(scales_and_zeros: torch.Tensor):
+    scales, zeros = scales_and_zeros.transpose(0, 1).unbind(-1)
+    return scales, zeros
+
+
+def group_quantize_tensor(w: torch.Tensor, n_bit: int = 4, groupsize: int = 128):
+    scales, zeros = get_group_qparams(w, n_bit, groupsize)
+
+    to_quant = w.float().reshape(-1, groupsize)
+    min_val = zeros.reshape(-1, 1) - scales.reshape(-1, 1) * (2 ** (n_bit - 1))
+    w_int = (to_quant - min_val).div(scales.reshape(-1, 1)).round().clamp(0, 2**n_bit - 1)
+    w_int = w_int.to(torch.uint8).reshape(w.shape)
+
+    return w_int, pack_scales_and_zeros(scales, zeros)
+
+
+def pack_int4(w_int: torch.Tensor) -> torch.Tensor:
+    # Two 4-bit values per byte along in_features, low nibble first
+    return w_int[:, ::2] | (w_int[:, 1::2] << 4)
+
+
+def unpack_int4(w_packed: torch.Tensor) -> torch.Tensor:
+    w_int = torch.stack([w_packed & 0x0F, w_packed >> 4], dim=-1)
+    return w_int.reshape(w_packed.shape[0], -1)
+
+
+def linear_forward_int8(x: torch.Tensor, weight: torch.Tensor, scales: torch.Tensor):
+    if x.device.type == "cpu" and hasattr(torch.ops.aten, "_weight_int8pack_mm"):
+        # Fused CPU kernel, reads the int8 weights directly instead of a dequantized copy
+        out = torch.ops.aten._weight_int8pack_mm(
+            x.reshape(-1, x.shape[-1]).contiguous(), weight, scales.to(x.dtype)
+        )
+        return out.reshape(*x.shape[:-1], weight.shape[0])
+
+    return F.linear(x, weight.to(dtype=x.dtype)) * scales.to(x.dtype)
+
+
+def linear_forward_int4(
+    x: torch.Tensor,
+    weight: torch.Tensor,
+    scales_and_zeros: torch.Tensor,
+    groupsize: int,
+    weight_cpu_pack: torch.Tensor | None = None,
+):
+    out_features = weight.shape[0]
+    if x.device.type == "cpu" and weight_cpu_pack is not None and weight_cpu_pack.numel():
+        out = torch.ops.aten._weight_int4pack_mm_for_cpu(
+            x.reshape(-1, x.shape[-1]).contiguous(),
+            weight_cpu_pack,
+            groupsize,
+            scales_and_zeros.to(x.dtype),
+        )
+        return out.reshape(*x.shape[:-1], out_features)
+
+    # Portable path, dequantizes the whole weight before the matmul
+    scales, zeros = unpack_scales_and_zeros(scales_and_zeros.to(x.dtype))
+
+    w = unpack_int4(weight).reshape(out_features, -1, groupsize).to(x.dtype)
+    w = (w - 8) * scales[..., None] + zeros[..., None]
+
+    return F.linear(x, w.reshape(out_features, -1))
+
+
+##### Weight-only int8 per-channel quantized code ######
+
+
+class WeightOnlyInt8Linear(nn.Module):
+    __constants__ = ["in_features", "out_features"]
+
+    def __init__(
+        self,
+        in_features: int,
+        out_features: int,
+        bias: bool = False,
+        device=None,
+        dtype=None,
+    ) -> None:
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.register_buffer(
+            "weight", torch.empty((out_features, in_features), dtype=torch.int8)
+        )
+        self.register_buffer("scales", torch.ones(out_features, dtype=torch.bfloat16))
+        self.bias = nn.Parameter(torch.zeros(out_features)) if bias else None
+
+    def forward(self, input: torch.Tensor) -> torch.Tensor:
+        out = linear_forward_int8(input, self.weight, self.scales)
+        if self.bias is not None:
+            out = out + self.bias
+        return out
+
+
+class WeightOnlyInt8QuantHandler:
+    def __init__(self, mod: nn.Module):
+        self.mod = mod
+
+    @torch.no_grad()
+    def create_quantized_state_dict(self) -> dict:
+        cur_state_dict = self.mod.state_dict()
+        for fqn, _, _, child in find_quantizable_linears(self.mod):
+            int8_weight, scales = dynamically_quantize_per_channel(child.weight, -128, 127)
+            cur_state_dict[f"{fqn}.weight"] = int8_weight
+            cur_state_dict[f"{fqn}.scales"] = scales.to(child.weight.dtype)
+
+        return cur_state_dict
+
+    def convert_for_runtime(self) -> nn.Module:
+        for _, parent, name, child in list(find_quantizable_linears(self.mod)):
+            setattr(
+                parent,
+                name,
+                WeightOnlyInt8Linear(
+                    child.in_features, child.out_features, bias=child.bias is not None
+                ),
+            )
+
+        return self.mod
+
+
+##### Weight-only int4 per-group quantized code ######
+
+
+class WeightOnlyInt4Linear(nn.Module):
+    __constants__ = ["in_features", "out_features"]
+
+    def __init__(
+        self,
+        in_features: int,
+        out_features: int,
+        bias: bool = False,
+        device=None,
+        dtype=None,
+        groupsize: int = 128,
+    ) -> None:
+        super().__init__()
+        assert in_features % groupsize == 0, "in_features must be a multiple of groupsize"
+
+        self.in_features = in_features
+        self.out_features = out_features
+        self.groupsize = groupsize
+        self.register_buffer(
+            "weight", torch.empty((out_features, in_features // 2), dtype=torch.uint8)
+        )
+        self.register_buffer(
+            "scales_and_zeros",
+            torch.empty((in_features // groupsize, out_features, 2), dtype=torch.bfloat16),
+        )
+        # Weights repacked for the fused CPU kernel once the checkpoint is loaded
+        self.register_buffer(
+            "weight_cpu_pack", torch.empty(0, dtype=torch.uint8), persistent=False
+        )
+        self.bias = nn.Parameter(torch.zeros(out_features)) if bias else None
+        self.register_load_state_dict_post_hook(self._pack_for_cpu)
+
+    @staticmethod
+    def _pack_for_cpu(module: "WeightOnlyInt4Linear", incompatible_keys) -> None:
+        if module.weight.device.type != "cpu" or not hasattr(
+            torch.ops.aten, "_convert_weight_to_int4pack_for_cpu"
+        ):
+            return
+
+        try:
+            module.weight_cpu_pack = torch.ops.aten._convert_weight_to_int4pack_for_cpu(
+                unpack_int4(module.weight).to(torch.int32), 2
+            )
+        except RuntimeError as e:
+            logger.warning(f"Falling back to dequantized int4 matmul: {e}")
+
+    def forward(self, input: torch.Tensor) -> torch.Tensor:
+        out = linear_forward_int4(
+            input,
+            self.weight,
+            self.scales_and_zeros,
+            self.groupsize,
+            self.weight_cpu_pack,
+        )
+        if self.bias is not None:
+            out = out + self.bias
+        return out
+
+
+class WeightOnlyInt4QuantHandler:
+    def __init__(self, mod: nn.Module, groupsize: int = 128):
+        assert groupsize in [32, 64, 128, 256]
+        self.mod = mod
+        self.groupsize = groupsize
+
+    @torch.no_grad()
+    def create_quantized_state_dict(self) -> dict:
+        cur_state_dict = self.mod.state_dict()
+        for fqn, _, _, child in find_quantizable_linears(self.mod, self.groupsize):
+            w_int, scales_and_zeros = group_quantize_tensor(
+                child.weight, n_bit=4, groupsize=self.groupsize
+            )
+            cur_state_dict[f"{fqn}.weight"] = pack_int4(w_int)
+            cur_state_dict[f"{fqn}.scales_and_zeros"] = scales_and_zeros.to(
+                child.weight.dtype
+            )
+
+        return cur_state_dict
+
+    def convert_for_runtime(self) -> nn.Module:
+        for _, parent, name, child in list(
+            find_quantizable_linears(self.mod, self.groupsize)
+        ):
+            setattr(
+                parent,
+                name,
+                WeightOnlyInt4Linear(
+                    child.in_features,
+                    child.out_features,
+                    bias=child.bias is not None,
+                    groupsize=self.groupsize,
+                ),
+            )
+
+        return self.mod
+
+
+def generate_folder_name():
+    return datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+
+
+@click.command()
+@click.option(
+    "--checkpoint-path",
+    type=click.Path(path_type=Path, exists=True),
+    default="checkpoints/fish-speech-1.5",
+)
+@click.option(
+    "--mode", type=click.Choice(["int8", "int4"]), default="int8", help="Quantization mode"
+)
+@click.option("--groupsize", type=int, default=128, help="Group size for int4 quantization")
+@click.option("--timestamp", type=str, default="None", help="When to do quantization")
+def quantize(checkpoint_path: Path, mode: str, groupsize: int, timestamp: str) -> None:
+    device = "cpu"
+    precision = torch.bfloat16
+
+    logger.info("Loading model ...")
+    t0 = time.time()
+
+    model = BaseTransformer.from_pretrained(path=checkpoint_path, load_weights=True)
+    model = model.to(dtype=precision, device=device)
+
+    if mode == "int8":
+        logger.info("Quantizing model weights for int8 weight-only symmetric per-channel")
+        quant_handler = WeightOnlyInt8QuantHandler(model)
+        quantized_state_dict = quant_handler.create_quantized_state_dict()
+        now = timestamp if timestamp != "None" else generate_folder_name()
+        dst_name = f"{checkpoint_path.name}-int8-{now}"
+    else:
+        logger.info(f"Quantizing model weights for int4 weight-only, groupsize={groupsize}")
+        quant_handler = WeightOnlyInt4QuantHandler(model, groupsize)
+        quantized_state_dict = quant_handler.create_quantized_state_dict()
+        now = timestamp if timestamp != "None" else generate_folder_name()
+        dst_name = f"{checkpoint_path.name}-int4-g{groupsize}-{now}"
+
+    # The runtime picks the handler from this folder name, see BaseTransformer.from_pretrained
+    dst_path = checkpoint_path.parent / dst_name
+    shutil.copytree(
+        str(checkpoint_path.resolve()),
+        str(dst_path.resolve()),
+        ignore=shutil.ignore_patterns("model.pth"),
+    )
+
+    quantize_path = dst_path / "model.pth"
+    logger.info(f"Writing quantized weights to {quantize_path}")
+    torch.save(quantized_state_dict, quantize_path)
+
+    size_mb = quantize_path.stat().st_size / 1024**2
+    logger.info(f"Quantization complete took {time.time() - t0:.02f} seconds ({size_mb:.1f} MB)")
+
+
+if __name__ == "__main__":
+    quantize()
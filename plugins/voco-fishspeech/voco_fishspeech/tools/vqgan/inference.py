@@ -10,6 +10,7 @@ from hydra import compose, initialize
 from hydra.utils import instantiate
 from loguru import logger
 from omegaconf import OmegaConf
+from voco.core.weights import get_weight_store
 
 # Define audio extensions inline
 AUDIO_EXTENSIONS = [".wav", ".flac", ".mp3", ".ogg", ".m4a"]
@@ -18,6 +19,20 @@ AUDIO_EXTENSIONS = [".wav", ".flac", ".mp3", ".ogg", ".m4a"]
 OmegaConf.register_new_resolver("eval", eval)
 
 
+def extract_generator_weights(state_dict):
+    if "state_dict" in state_dict:
+        state_dict = state_dict["state_dict"]
+
+    if any("generator" in k for k in state_dict):
+        state_dict = {
+            k.replace("generator.", ""): v
+            for k, v in state_dict.items()
+            if "generator." in k
+        }
+
+    return state_dict
+
+
 def load_model(config_name, checkpoint_path, device="cuda"):
     hydra.core.global_hydra.GlobalHydra.instance().clear()
 
@@ -36,18 +51,9 @@ def load_model(config_name, checkpoint_path, device="cuda"):
             cfg = compose(config_name=config_name)
 
     model = instantiate(cfg)
-    state_dict = torch.load(
-        checkpoint_path, map_location=device, mmap=True, weights_only=True
+    state_dict = get_weight_store().load(
+        checkpoint_path, name="fishspeech:vqgan", transform=extract_generator_weights
     )
-    if "state_dict" in state_dict:
-        state_dict = state_dict["state_dict"]
-
-    if any("generator" in k for k in state_dict):
-        state_dict = {
-            k.replace("generator.", ""): v
-            for k, v in state_dict.items()
-            if "generator." in k
-        }
 
     result = model.load_state_dict(state_dict, strict=False, assign=True)
     model.eval()
@@ -0,0 +1,87 @@
+import os
+import platform
+from functools import lru_cache
+
+import torch
+from loguru import logger
+
+
+@lru_cache(maxsize=None)
+def _cpu_flags() -> frozenset[str]:
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key.strip() in ("flags", "Features"):
+                    return frozenset(value.split())
+    except OSError:
+        pass
+
+    return frozenset()
+
+
+def cpu_supports_bf16() -> bool:
+    # Without native bf16 instructions the matmuls are emulated and slower than fp32
+    flags = _cpu_flags()
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "bf16" in flags
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def physical_core_count() -> int:
+    cores = set()
+    physical_id = None
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                key = key.strip()
+                if key == "physical id":
+                    physical_id = value.strip()
+                elif key == "core id":
+                    cores.add((physical_id, value.strip()))
+    except OSError:
+        pass
+
+    count = len(cores) or os.cpu_count() or 1
+    if hasattr(os, "sched_getaffinity"):
+        count = min(count, len(os.sched_getaffinity(0)))
+
+    return max(count, 1)
+
+
+def configure_cpu_threads(num_threads: int | None = None) -> int:
+    """Use one intra-op thread per physical core unless the user already chose"""
+    if num_threads is None:
+        if os.environ.get("OMP_NUM_THREADS"):
+            return torch.get_num_threads()
+        # Hyper-threads share the FPUs, extra threads only add sync overhead
+        num_threads = physical_core_count()
+
+    torch.set_num_threads(num_threads)
+    logger.info(f"Using {num_threads} CPU threads")
+    return num_threads
+
+
+def resolve_dtype(dtype: str, device: str) -> torch.dtype:
+    if dtype == "auto":
+        if device.startswith("cuda"):
+            dtype = "bfloat16" if torch.cuda.is_bf16_supported() else "float16"
+        elif device == "cpu":
+            dtype = "bfloat16" if cpu_supports_bf16() else "float32"
+        else:
+            dtype = "float32"
+        logger.info(f"Selected {dtype} for {device}")
+
+    if dtype == "bfloat16":
+        return torch.bfloat16
+    elif dtype == "float16":
+        return torch.float16
+    return torch.float32
+
+
+def resolve_compile(compile: bool | str, device: str) -> bool:
+    # On CPU decoding is bound by weight bandwidth, so compiling buys little for its start-up cost
+    if compile == "auto":
+        return device.startswith("cuda")
+    return bool(compile)
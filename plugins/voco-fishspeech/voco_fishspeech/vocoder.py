@@ -0,0 +1,138 @@
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+
+import torch
+from loguru import logger
+from voco.core import instrumentation
+
+
+@dataclass
+class DecodeRequest:
+    codes: torch.Tensor
+    future: Future
+    tags: dict = field(default_factory=dict)
+
+
+def _restart_after_fork(ref: weakref.ref) -> None:
+    service = ref()
+    if service is not None and not service._closed:
+        service._start()
+
+
+class VocoderService:
+    """Decodes VQ code sequences to audio, batching requests that arrive together"""
+
+    def __init__(
+        self,
+        model,
+        device: str = "cuda",
+        max_batch_size: int = 8,
+        max_wait: float = 0.005,
+    ):
+        self.model = model
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.num_batches = 0
+        self.num_sequences = 0
+
+        self._closed = False
+        self._start()
+
+        # Threads do not survive fork, so a forked worker process needs its own
+        if hasattr(os, "register_at_fork"):
+            ref = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: _restart_after_fork(ref))
+
+    def _start(self):
+        self._queue: queue.Queue[DecodeRequest | None] = queue.Queue()
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def submit(self, codes: torch.Tensor) -> Future:
+        """Queue codes of shape (num_codebooks, T), resolving to 1-D audio"""
+        future = Future()
+        # Tags of the submitting request, since the batch is decoded on the service thread
+        tags = instrumentation.current_tags() if instrumentation.enabled() else {}
+        self._queue.put(DecodeRequest(codes=codes, future=future, tags=tags))
+        return future
+
+    def decode(self, codes: torch.Tensor) -> torch.Tensor:
+        return self.submit(codes).result()
+
+    def close(self) -> None:
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    @torch.no_grad()
+    def decode_batch(self, codes: list[torch.Tensor]) -> list[torch.Tensor]:
+        """Pad sequences to a common length, decode them together and trim each output"""
+        lengths = [c.shape[-1] for c in codes]
+        indices = torch.zeros(
+            (len(codes), codes[0].shape[0], max(lengths)),
+            dtype=torch.long,
+            device=self.device,
+        )
+        for i, c in enumerate(codes):
+            indices[i, :, : lengths[i]] = c
+
+        # The decoder masks everything past feature_lengths, and its convolutions
+        # are causal, so padding does not change the valid part of each output
+        feature_lengths = torch.tensor(lengths, device=self.device)
+        audio, audio_lengths = self.model.decode(
+            indices=indices, feature_lengths=feature_lengths
+        )
+
+        return [audio[i, 0, : audio_lengths[i]] for i in range(len(codes))]
+
+    def _collect(self, first: DecodeRequest) -> tuple[list[DecodeRequest], bool]:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=max(timeout, 0))
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+
+        return batch, False
+
+    def _worker(self) -> None:
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            batch, stop = self._collect(item)
+            batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            start = time.perf_counter()
+            try:
+                outputs = self.decode_batch([r.codes for r in batch])
+            except Exception as e:
+                logger.error(f"Vocoder batch of {len(batch)} failed: {e}")
+                for r in batch:
+                    r.future.set_exception(e)
+                continue
+
+            elapsed = time.perf_counter() - start
+            for r in batch:
+                instrumentation.record("vocoder", elapsed, batch_size=len(batch), **r.tags)
+
+            self.num_batches += 1
+            self.num_sequences += len(batch)
+            for r, audio in zip(batch, outputs):
+                r.future.set_result(audio)
@@ -1,6 +1,9 @@
 from typing import Any, Generator
+from voco.core.audio import AudioChunk, ChunkStream
 from voco.core.base_model import BaseAudioModel
 
+SAMPLE_RATE = 24000
+
 
 class KokoroDriver(BaseAudioModel):
     '''kokoro wrapper'''
@@ -25,18 +28,26 @@ class KokoroDriver(BaseAudioModel):
         )
         self._loaded = True
 
+    def warmup(self, voices: Any = None) -> None:
+        # Download and cache voice packs so the first request does not hit the hub
+        for voice in voices or []:
+            self.pipeline.load_voice(voice)
+
     def generate(
         self,
         text: str,
         voice: str = "af_heart",
         speed: float = 1.0,
         **kwargs: Any
-    ) -> Generator[Any, None, None]:
+    ) -> Generator[AudioChunk, None, None]:
         if not self._loaded or self.pipeline is None:
             raise RuntimeError("Model not loaded. Call load() first.")
 
+        stream = ChunkStream(SAMPLE_RATE)
         for result in self.pipeline(text=text, voice=voice, speed=speed, **kwargs):
-            yield result
+            if result.audio is None:
+                continue
+            yield stream.chunk(result.audio, text=result.graphemes, phonemes=result.phonemes)
 
     def unload(self) -> None:
         if self.pipeline is not None:
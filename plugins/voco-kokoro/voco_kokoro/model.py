@@ -5,6 +5,8 @@ from huggingface_hub import hf_hub_download
 from loguru import logger
 from transformers import AlbertConfig
 from typing import Dict, Optional, Union
+from voco.core import instrumentation
+from voco.core.weights import get_weight_store
 import json
 import torch
 
@@ -65,14 +67,16 @@ class KModel(torch.nn.Module):
         )
         if not model:
             model = hf_hub_download(repo_id=repo_id, filename=KModel.MODEL_NAMES[repo_id])
-        for key, state_dict in torch.load(model, map_location='cpu', weights_only=True).items():
+        # Weights are memory-mapped from a converted copy and assigned without copying
+        weights = get_weight_store().load(model, name=f"kokoro:{repo_id}")
+        for key, state_dict in weights.items():
             assert hasattr(self, key), key
             try:
-                getattr(self, key).load_state_dict(state_dict)
+                getattr(self, key).load_state_dict(state_dict, assign=True)
             except:
                 logger.debug(f"Did not load {key} from state_dict")
                 state_dict = {k[7:]: v for k, v in state_dict.items()}
-                getattr(self, key).load_state_dict(state_dict, strict=False)
+                getattr(self, key).load_state_dict(state_dict, strict=False, assign=True)
 
     @property
     def device(self):
@@ -97,25 +101,27 @@ class KModel(torch.nn.Module):
             dtype=torch.long
         )
 
-        text_mask = torch.arange(input_lengths.max()).unsqueeze(0).expand(input_lengths.shape[0], -1).type_as(input_lengths)
-        text_mask = torch.gt(text_mask+1, input_lengths.unsqueeze(1)).to(self.device)
-        bert_dur = self.bert(input_ids, attention_mask=(~text_mask).int())
-        d_en = self.bert_encoder(bert_dur).transpose(-1, -2)
-        s = ref_s[:, 128:]
-        d = self.predictor.text_encoder(d_en, s, input_lengths, text_mask)
-        x, _ = self.predictor.lstm(d)
-        duration = self.predictor.duration_proj(x)
-        duration = torch.sigmoid(duration).sum(axis=-1) / speed
-        pred_dur = torch.round(duration).clamp(min=1).long().squeeze()
-        indices = torch.repeat_interleave(torch.arange(input_ids.shape[1], device=self.device), pred_dur)
-        pred_aln_trg = torch.zeros((input_ids.shape[1], indices.shape[0]), device=self.device)
-        pred_aln_trg[indices, torch.arange(indices.shape[0])] = 1
-        pred_aln_trg = pred_aln_trg.unsqueeze(0).to(self.device)
-        en = d.transpose(-1, -2) @ pred_aln_trg
-        F0_pred, N_pred = self.predictor.F0Ntrain(en, s)
-        t_en = self.text_encoder(input_ids, input_lengths, text_mask)
-        asr = t_en @ pred_aln_trg
-        audio = self.decoder(asr, F0_pred, N_pred, ref_s[:, :128]).squeeze()
+        with instrumentation.span("acoustic"):
+            text_mask = torch.arange(input_lengths.max()).unsqueeze(0).expand(input_lengths.shape[0], -1).type_as(input_lengths)
+            text_mask = torch.gt(text_mask+1, input_lengths.unsqueeze(1)).to(self.device)
+            bert_dur = self.bert(input_ids, attention_mask=(~text_mask).int())
+            d_en = self.bert_encoder(bert_dur).transpose(-1, -2)
+            s = ref_s[:, 128:]
+            d = self.predictor.text_encoder(d_en, s, input_lengths, text_mask)
+            x, _ = self.predictor.lstm(d)
+            duration = self.predictor.duration_proj(x)
+            duration = torch.sigmoid(duration).sum(axis=-1) / speed
+            pred_dur = torch.round(duration).clamp(min=1).long().squeeze()
+            indices = torch.repeat_interleave(torch.arange(input_ids.shape[1], device=self.device), pred_dur)
+            pred_aln_trg = torch.zeros((input_ids.shape[1], indices.shape[0]), device=self.device)
+            pred_aln_trg[indices, torch.arange(indices.shape[0])] = 1
+            pred_aln_trg = pred_aln_trg.unsqueeze(0).to(self.device)
+            en = d.transpose(-1, -2) @ pred_aln_trg
+            F0_pred, N_pred = self.predictor.F0Ntrain(en, s)
+            t_en = self.text_encoder(input_ids, input_lengths, text_mask)
+            asr = t_en @ pred_aln_trg
+        with instrumentation.span("vocoder"):
+            audio = self.decoder(asr, F0_pred, N_pred, ref_s[:, :128]).squeeze()
         return audio, pred_dur
 
     def forward(
@@ -4,6 +4,7 @@ from huggingface_hub import hf_hub_download
 from loguru import logger
 from misaki import en, espeak
 from typing import Callable, Generator, List, Optional, Tuple, Union
+from voco.core import instrumentation
 import re
 import torch
 import os
@@ -383,7 +384,8 @@ class KPipeline:
             # English processing (unchanged)
             if self.lang_code in 'ab':
                 logger.debug(f"Processing English text: {graphemes[:50]}{'...' if len(graphemes) > 50 else ''}")
-                _, tokens = self.g2p(graphemes)
+                with instrumentation.span("text"):
+                    _, tokens = self.g2p(graphemes)
                 for gs, ps, tks in self.en_tokenize(tokens):
                     if not ps:
                         continue
@@ -431,7 +433,8 @@ class KPipeline:
                     if not chunk.strip():
                         continue
                         
-                    ps, _ = self.g2p(chunk)
+                    with instrumentation.span("text"):
+                        ps, _ = self.g2p(chunk)
                     if not ps:
                         continue
                     elif len(ps) > 510:
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+neutts = pytest.importorskip("voco_neutts.neutts")
+
+HOP = 480
+STRIDE = 25 * HOP
+FRAME = 27 * HOP
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+@pytest.mark.parametrize("num_frames", [1, 2, 7, 30])
+def test_incremental_matches_linear_overlap_add(dtype, num_frames):
+    rng = np.random.default_rng(num_frames)
+    frames = [rng.standard_normal(FRAME).astype(dtype) for _ in range(num_frames - 1)]
+    # The last frame of a stream is usually shorter or longer than the others
+    frames.append(rng.standard_normal(int(rng.integers(2 * HOP, 60 * HOP))).astype(dtype))
+
+    overlap_add = neutts._OverlapAdd(STRIDE)
+    chunks = [overlap_add.add(frame) for frame in frames[:-1]]
+    chunks.append(overlap_add.add(frames[-1], final=True))
+
+    expected = neutts._linear_overlap_add(frames, STRIDE)
+    result = np.concatenate(chunks)
+    assert result.dtype == expected.dtype
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_each_chunk_ends_where_the_next_frame_starts():
+    rng = np.random.default_rng(0)
+    overlap_add = neutts._OverlapAdd(STRIDE)
+    for _ in range(5):
+        assert len(overlap_add.add(rng.standard_normal(FRAME).astype(np.float32))) == STRIDE
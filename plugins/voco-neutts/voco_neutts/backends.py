@@ -0,0 +1,60 @@
+import importlib.util
+from typing import Any, Optional
+
+TORCH_BACKBONE = "neuphonic/neutts-air"
+GGUF_BACKBONE = "neuphonic/neutts-air-q4-gguf"
+TORCH_CODEC = "neuphonic/neucodec"
+ONNX_CODEC = "neuphonic/neucodec-onnx-decoder"
+
+
+def probe_runtimes() -> dict[str, bool]:
+    """Which optional inference runtimes are importable, without importing them"""
+    runtimes = {
+        "llama_cpp": importlib.util.find_spec("llama_cpp") is not None,
+        "onnxruntime": importlib.util.find_spec("onnxruntime") is not None,
+    }
+    # The ONNX decoder ships with neucodec >= 0.0.4
+    onnx_decoder = False
+    if runtimes["onnxruntime"]:
+        try:
+            import neucodec
+
+            onnx_decoder = hasattr(neucodec, "NeuCodecOnnxDecoder")
+        except ImportError:
+            pass
+    runtimes["neucodec_onnx"] = onnx_decoder
+    return runtimes
+
+
+def select_backend(
+    device: str,
+    backend: str = "auto",
+    backbone_repo: Optional[str] = None,
+    codec_repo: Optional[str] = None,
+    gguf_repo: str = GGUF_BACKBONE,
+) -> dict[str, Any]:
+    """Pick backbone and codec repos for a device.
+
+    backend="auto" uses a GGUF backbone and the ONNX decoder on CPU when their runtimes
+    are installed; backend="torch" always uses the full torch models. Repos passed
+    explicitly are kept as given.
+    """
+    if backend not in ("auto", "torch"):
+        raise ValueError(f"Invalid backend '{backend}'. Must be 'auto' or 'torch'.")
+
+    runtimes = probe_runtimes()
+    fast_cpu = backend == "auto" and device == "cpu"
+
+    if backbone_repo is None:
+        backbone_repo = gguf_repo if fast_cpu and runtimes["llama_cpp"] else TORCH_BACKBONE
+    if codec_repo is None:
+        codec_repo = ONNX_CODEC if fast_cpu and runtimes["neucodec_onnx"] else TORCH_CODEC
+
+    return {
+        "backbone_repo": backbone_repo,
+        "backbone_runtime": "llama_cpp" if backbone_repo.endswith("gguf") else "torch",
+        "codec_repo": codec_repo,
+        "codec_runtime": "onnxruntime" if codec_repo == ONNX_CODEC else "torch",
+        "backend": backend,
+        "runtimes": runtimes,
+    }
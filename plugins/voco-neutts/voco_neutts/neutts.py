@@ -1,14 +1,20 @@
-from typing import Generator
+from typing import Generator, Iterable
 from pathlib import Path
+import copy
+import queue
+import time
 import librosa
 import numpy as np
 import torch
-import re
 import perth
 from neucodec import NeuCodec, DistillNeuCodec
-from phonemizer.backend import EspeakBackend
-from transformers import AutoTokenizer, AutoModelForCausalLM, TextIteratorStreamer
-from threading import Thread
+from transformers import AutoTokenizer, AutoModelForCausalLM, StoppingCriteria, StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
+from threading import Event, Lock, Thread
+from voco.core import instrumentation
+from voco.core.weights import get_weight_store
+from voco.utils.audio_utils import resample
+from .phonemes import get_phonemizer
 
 
 def _linear_overlap_add(frames: list[np.ndarray], stride: int) -> np.ndarray:
@@ -38,6 +44,243 @@ def _linear_overlap_add(frames: list[np.ndarray], stride: int) -> np.ndarray:
     return out / sum_weight
 
 
+class _OverlapAdd:
+    """Streaming form of _linear_overlap_add.
+
+    Only the tail that later frames can still overlap is kept, so each frame costs
+    O(frame length). The samples produced match _linear_overlap_add exactly.
+    """
+
+    def __init__(self, stride: int):
+        self.stride = stride
+        self._dtype = None
+        self._weights: dict[int, np.ndarray] = {}
+        self._out = None
+        self._sum_weight = None
+        # Absolute sample index of the first pending sample, the next frame and the furthest end
+        self._start = 0
+        self._offset = 0
+        self._end = 0
+
+    def _frame_weight(self, frame_length: int) -> np.ndarray:
+        weight = self._weights.get(frame_length)
+        if weight is None:
+            t = np.linspace(0, 1, frame_length + 2, dtype=self._dtype)[1:-1]
+            weight = self._weights[frame_length] = np.abs(0.5 - (t - 0.5))
+        return weight
+
+    def add(self, frame: np.ndarray, final: bool = False) -> np.ndarray:
+        if self._dtype is None:
+            self._dtype = frame.dtype
+            self._out = np.zeros(0, dtype=self._dtype)
+            self._sum_weight = np.zeros(0, dtype=self._dtype)
+
+        frame_length = frame.shape[-1]
+        self._end = max(self._end, self._offset + frame_length)
+        size = self._end - self._start
+        if size > len(self._sum_weight):
+            pad = size - len(self._sum_weight)
+            self._out = np.concatenate([self._out, np.zeros(pad, dtype=self._dtype)])
+            self._sum_weight = np.concatenate([self._sum_weight, np.zeros(pad, dtype=self._dtype)])
+
+        weight = self._frame_weight(frame_length)
+        pos = self._offset - self._start
+        self._out[pos : pos + frame_length] += weight * frame
+        self._sum_weight[pos : pos + frame_length] += weight
+        self._offset += self.stride
+
+        # Everything before the next frame's start is final
+        ready = size if final else min(self._offset - self._start, size)
+        assert self._sum_weight[:ready].min(initial=1) > 0
+        result = self._out[:ready] / self._sum_weight[:ready]
+        self._out = self._out[ready:]
+        self._sum_weight = self._sum_weight[ready:]
+        self._start += ready
+        return result
+
+
+class _StepTimer(BaseStreamer):
+    """Reports the prompt prefill and each later sampling step as instrumentation stages"""
+
+    def __init__(self):
+        self._last = None
+        self.steps = 0
+
+    def put(self, value):
+        # generate() passes the prompt first, so the next call ends the prefill
+        now = time.perf_counter()
+        if self._last is not None:
+            instrumentation.record("decode_token" if self.steps else "prefill", now - self._last)
+            self.steps += 1
+        self._last = now
+
+    def resume(self):
+        # Leaves out time the consumer spends between tokens of a synchronous generator
+        self._last = time.perf_counter()
+
+    def end(self):
+        if self.steps:
+            instrumentation.count("tokens", self.steps)
+
+
+class _SpeechTokenStreamer(_StepTimer):
+    """Hands token ids from the generate() thread to the decoding loop as they are sampled"""
+
+    def __init__(self):
+        super().__init__()
+        self.queue = queue.Queue()
+        self.cancelled = False
+
+    def put(self, value):
+        prompt = self._last is None
+        super().put(value)
+        if prompt:
+            return
+        for token_id in value.reshape(-1).tolist():
+            self.queue.put(token_id)
+
+    def end(self):
+        super().end()
+        self.queue.put(None)
+
+    def __iter__(self):
+        while (item := self.queue.get()) is not None:
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+
+class _CancelGeneration(StoppingCriteria):
+    def __init__(self, is_cancelled):
+        self.is_cancelled = is_cancelled
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.is_cancelled()
+
+
+class _WatermarkStage:
+    """Watermarks the final, non-overlapping output off the decoding thread.
+
+    on: each chunk is watermarked on a worker thread while later chunks are decoded
+    deferred: the whole utterance is watermarked in one call once decoding finishes
+    off: audio passes through untouched
+    """
+
+    MODES = ("on", "off", "deferred")
+
+    def __init__(self, watermarker, sample_rate: int, mode: str = "on"):
+        if mode not in self.MODES:
+            raise ValueError(f"Invalid watermark mode '{mode}'. Must be one of: {', '.join(self.MODES)}")
+        self.watermarker = watermarker
+        self.sample_rate = sample_rate
+        self.mode = mode
+        self._lock = Lock()
+        self.calls = 0
+        self.seconds = 0.0
+        self.audio_seconds = 0.0
+        self.request_seconds = 0.0
+
+    def apply(self, wav: np.ndarray) -> np.ndarray:
+        if self.mode == "off":
+            return wav
+        start = time.perf_counter()
+        wav = self.watermarker.apply_watermark(wav, sample_rate=self.sample_rate)
+        elapsed = time.perf_counter() - start
+        instrumentation.record("watermark", elapsed)
+        with self._lock:
+            self.calls += 1
+            self.seconds += elapsed
+            self.audio_seconds += len(wav) / self.sample_rate
+        return wav
+
+    def stream(self, chunks: Iterable[np.ndarray]) -> Generator[np.ndarray, None, None]:
+        start = time.perf_counter()
+        try:
+            if self.mode == "off":
+                yield from chunks
+            elif self.mode == "deferred":
+                pending = list(chunks)
+                if pending:
+                    wav = self.apply(np.concatenate(pending))
+                    yield from np.split(wav, np.cumsum([len(c) for c in pending[:-1]]))
+            else:
+                yield from self._pipelined(chunks)
+        finally:
+            with self._lock:
+                self.request_seconds += time.perf_counter() - start
+
+    def _pipelined(self, chunks: Iterable[np.ndarray]) -> Generator[np.ndarray, None, None]:
+        decoded = queue.Queue()
+        watermarked = queue.Queue()
+        stop = Event()
+
+        def decode():
+            try:
+                for chunk in chunks:
+                    decoded.put(chunk)
+                    if stop.is_set():
+                        break
+            except BaseException as e:
+                decoded.put(e)
+            finally:
+                if hasattr(chunks, "close"):
+                    chunks.close()
+                decoded.put(None)
+
+        def watermark():
+            while (item := decoded.get()) is not None:
+                if not isinstance(item, BaseException) and not stop.is_set():
+                    item = self.apply(item)
+                watermarked.put(item)
+            watermarked.put(None)
+
+        threads = [
+            Thread(target=instrumentation.bind(decode), daemon=True),
+            Thread(target=instrumentation.bind(watermark), daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while (item := watermarked.get()) is not None:
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # The decoder stops after its current chunk, which also releases the backbone
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "calls": self.calls,
+                "seconds": round(self.seconds, 4),
+                "audio_seconds": round(self.audio_seconds, 3),
+                # Fraction of streamed request time spent watermarking (overlapped in "on" mode)
+                "latency_share": round(self.seconds / self.request_seconds, 4) if self.request_seconds else 0.0,
+            }
+
+
+class NeuTTSVoice:
+    """The parts of a prompt that only depend on the reference voice.
+
+    The prompt reads `<ref text> <input text>` followed by the reference codes, so the
+    prefix that can be prefilled ends at the reference transcript. The codes are kept as
+    ready-made token ids after the input text.
+    """
+
+    def __init__(self, ref_codes: np.ndarray, ref_text: str, ref_phones: str, prefix_ids: list[int], suffix_ids: list[int]):
+        self.ref_codes = ref_codes
+        self.ref_text = ref_text
+        self.ref_phones = ref_phones
+        self.prefix_ids = prefix_ids
+        self.suffix_ids = suffix_ids
+        # Backbone state after the prefix: a KV cache for torch, a LlamaState for GGUF
+        self.prefix_state = None
+
+
 class NeuTTSAir:
 
     def __init__(
@@ -46,12 +289,17 @@ class NeuTTSAir:
         backbone_device="cpu",
         codec_repo="neuphonic/neucodec",
         codec_device="cpu",
+        watermark="on",
+        num_threads=None,
+        n_batch=512,
+        n_ctx=2048,
     ):
 
         # Consts
         self.sample_rate = 24_000
-        self.max_context = 2048
+        self.max_context = n_ctx
         self.hop_length = 480
+        self.codebook_size = 65_536
         self.streaming_overlap_frames = 1
         self.streaming_frames_per_chunk = 25
         self.streaming_lookforward = 5
@@ -61,15 +309,19 @@ class NeuTTSAir:
         # ggml & onnx flags
         self._is_quantized_model = False
         self._is_onnx_codec = False
+        self._reference_codec = None
 
         # HF tokenizer
         self.tokenizer = None
 
+        # CPU threads for the backbone (None keeps the runtime default) and llama_cpp prompt batch
+        self.num_threads = num_threads
+        self.n_batch = n_batch
+
         # Load phonemizer + models
         print("Loading phonemizer...")
-        self.phonemizer = EspeakBackend(
-            language="en-us", preserve_punctuation=True, with_stress=True
-        )
+        self.language = "en-us"
+        self.phonemizer = get_phonemizer()
 
         self._load_backbone(backbone_repo, backbone_device)
 
@@ -77,10 +329,59 @@ class NeuTTSAir:
 
         # Load watermarker
         self.watermarker = perth.PerthImplicitWatermarker()
+        self.watermarking = _WatermarkStage(self.watermarker, self.sample_rate, mode=watermark)
 
     def _load_backbone(self, backbone_repo, backbone_device):
         print(f"Loading backbone from: {backbone_repo} on {backbone_device} ...")
 
+        with get_weight_store().track(f"neutts:{backbone_repo}"):
+            self._load_backbone_weights(backbone_repo, backbone_device)
+
+        self._build_speech_token_table()
+
+    def set_num_threads(self, num_threads: int):
+        """Change the backbone's CPU threads without reloading it.
+
+        For torch backbones this is torch.set_num_threads, which applies to every model in the
+        process. llama_cpp threads belong to this backbone only.
+        """
+        self.num_threads = num_threads
+        if self._is_quantized_model:
+            import llama_cpp
+
+            llama_cpp.llama_set_n_threads(self.backbone.ctx, num_threads, num_threads)
+        else:
+            torch.set_num_threads(num_threads)
+
+    def _build_speech_token_table(self):
+        # Codec code i is the vocabulary token <|speech_i|>; both directions become array lookups
+        names = [f"<|speech_{i}|>" for i in range(self.codebook_size)]
+        if self._is_quantized_model:
+            ids = self.backbone.tokenize("".join(names).encode("utf-8"), add_bos=False, special=True)
+            self._speech_end_id = self.backbone.tokenize(
+                b"<|SPEECH_GENERATION_END|>", add_bos=False, special=True
+            )[0]
+            vocab_size = self.backbone.n_vocab()
+        else:
+            ids = self.tokenizer.convert_tokens_to_ids(names)
+            self._speech_end_id = self.tokenizer.convert_tokens_to_ids("<|SPEECH_GENERATION_END|>")
+            vocab_size = len(self.tokenizer)
+
+        if len(ids) != self.codebook_size or any(i is None for i in ids):
+            raise ValueError("Backbone vocabulary does not contain one token per speech code")
+
+        self._code_to_token = np.asarray(ids, dtype=np.int64)
+        self._token_to_code = np.full(
+            max(vocab_size, int(self._code_to_token.max()) + 1), -1, dtype=np.int64
+        )
+        self._token_to_code[self._code_to_token] = np.arange(self.codebook_size)
+
+    def _load_backbone_weights(self, backbone_repo, backbone_device):
+        # "gpu" is kept as an alias of "cuda" for callers of the upstream API
+        if backbone_device == "gpu":
+            backbone_device = "cuda"
+        on_gpu = backbone_device.startswith("cuda")
+
         # GGUF loading
         if backbone_repo.endswith("gguf"):
 
@@ -97,22 +398,33 @@ class NeuTTSAir:
                 repo_id=backbone_repo,
                 filename="*.gguf",
                 verbose=False,
-                n_gpu_layers=-1 if backbone_device == "gpu" else 0,
+                n_gpu_layers=-1 if on_gpu else 0,
                 n_ctx=self.max_context,
+                n_batch=self.n_batch,
+                n_threads=self.num_threads,
+                n_threads_batch=self.num_threads,
                 mlock=True,
-                flash_attn=True if backbone_device == "gpu" else False,
+                flash_attn=on_gpu,
             )
             self._is_quantized_model = True
 
         else:
+            if self.num_threads is not None and not on_gpu:
+                torch.set_num_threads(self.num_threads)
             self.tokenizer = AutoTokenizer.from_pretrained(backbone_repo)
-            self.backbone = AutoModelForCausalLM.from_pretrained(backbone_repo).to(
-                torch.device(backbone_device)
-            )
+            # safetensors shards are mapped straight into the parameters instead of
+            # first materialising a randomly initialised model
+            self.backbone = AutoModelForCausalLM.from_pretrained(
+                backbone_repo, low_cpu_mem_usage=True
+            ).to(torch.device(backbone_device))
 
     def _load_codec(self, codec_repo, codec_device):
 
         print(f"Loading codec from: {codec_repo} on {codec_device} ...")
+        with get_weight_store().track(f"neutts:{codec_repo}"):
+            self._load_codec_weights(codec_repo, codec_device)
+
+    def _load_codec_weights(self, codec_repo, codec_device):
         match codec_repo:
             case "neuphonic/neucodec":
                 self.codec = NeuCodec.from_pretrained(codec_repo)
@@ -143,7 +455,13 @@ class NeuTTSAir:
                     " 'neuphonic/neucodec-onnx-decoder'."
                 )
 
-    def infer(self, text: str, ref_codes: np.ndarray | torch.Tensor, ref_text: str) -> np.ndarray:
+    def infer(
+        self,
+        text: str,
+        ref_codes: np.ndarray | torch.Tensor | None = None,
+        ref_text: str | None = None,
+        voice: NeuTTSVoice | None = None,
+    ) -> np.ndarray:
         """
         Perform inference to generate speech from text using the TTS model and reference audio.
 
@@ -151,24 +469,33 @@ class NeuTTSAir:
             text (str): Input text to be converted to speech.
             ref_codes (np.ndarray | torch.tensor): Encoded reference.
             ref_text (str): Reference text for reference audio. Defaults to None.
+            voice (NeuTTSVoice): Prepared reference voice, used instead of ref_codes/ref_text.
         Returns:
             np.ndarray: Generated speech waveform.
         """
+        if voice is None:
+            voice = self.prepare_voice(ref_codes, ref_text)
 
         # Generate tokens
+        prompt_ids = self._prompt_ids(voice, text)
         if self._is_quantized_model:
-            output_str = self._infer_ggml(ref_codes, ref_text, text)
+            codes = self._to_codes(list(self._generate_ggml(prompt_ids, voice)))
         else:
-            prompt_ids = self._apply_chat_template(ref_codes, ref_text, text)
-            output_str = self._infer_torch(prompt_ids)
+            codes = self._infer_torch(prompt_ids, voice)
 
         # Decode
-        wav = self._decode(output_str)
-        watermarked_wav = self.watermarker.apply_watermark(wav, sample_rate=24_000)
+        wav = self._decode_codes(codes)
+        watermarked_wav = self.watermarking.apply(wav)
 
         return watermarked_wav
-    
-    def infer_stream(self, text: str, ref_codes: np.ndarray | torch.Tensor, ref_text: str) -> Generator[np.ndarray, None, None]:
+
+    def infer_stream(
+        self,
+        text: str,
+        ref_codes: np.ndarray | torch.Tensor | None = None,
+        ref_text: str | None = None,
+        voice: NeuTTSVoice | None = None,
+    ) -> Generator[np.ndarray, None, None]:
         """
         Perform streaming inference to generate speech from text using the TTS model and reference audio.
 
@@ -176,150 +503,296 @@ class NeuTTSAir:
             text (str): Input text to be converted to speech.
             ref_codes (np.ndarray | torch.tensor): Encoded reference.
             ref_text (str): Reference text for reference audio. Defaults to None.
+            voice (NeuTTSVoice): Prepared reference voice, used instead of ref_codes/ref_text.
         Yields:
             np.ndarray: Generated speech waveform.
-        """ 
+        """
+        if voice is None:
+            voice = self.prepare_voice(ref_codes, ref_text)
+
+        prompt_ids = self._prompt_ids(voice, text)
+        if self._is_quantized_model:
+            token_ids = self._generate_ggml(prompt_ids, voice)
+        else:
+            token_ids = self._stream_tokens_torch(prompt_ids, voice)
+
+        return self.watermarking.stream(self._decode_stream(token_ids, voice.ref_codes))
+
+    def infer_batch(self, texts: list[str], voice: NeuTTSVoice, cancelled: Event | None = None) -> list[np.ndarray]:
+        """
+        Generate speech for several independent texts with one batched backbone.generate call.
+
+        Args:
+            texts (list[str]): Input texts, generated independently.
+            voice (NeuTTSVoice): Prepared reference voice.
+            cancelled (Event): Stops generation early when set.
+        Returns:
+            list[np.ndarray]: Generated speech waveform for each text, in order.
+        """
+        if self._is_quantized_model:
+            # llama_cpp decodes one sequence at a time
+            return [self.infer(text, voice=voice) for text in texts]
+
+        # Every row continues from the cached reference prefix, repeated across the batch. Only
+        # the rest of each prompt is left-padded, so the padding sits between the two and masked
+        # positions keep the text and speech of every row contiguous with the prefix.
+        prefix_length = len(voice.prefix_ids)
+        rests = [self._prompt_ids(voice, text)[prefix_length:] for text in texts]
+        width = prefix_length + max(len(rest) for rest in rests)
+        pad_id = self.tokenizer.pad_token_id
+        if pad_id is None:
+            pad_id = self._speech_end_id
+        input_ids = torch.tensor(
+            [voice.prefix_ids + [pad_id] * (width - prefix_length - len(r)) + r for r in rests]
+        )
+        attention_mask = torch.tensor(
+            [[1] * prefix_length + [0] * (width - prefix_length - len(r)) + [1] * len(r) for r in rests]
+        )
+        past_key_values = self._prefix_cache(voice)
+        past_key_values.batch_repeat_interleave(len(texts))
+
+        stopping_criteria = None
+        if cancelled is not None:
+            stopping_criteria = StoppingCriteriaList([_CancelGeneration(cancelled.is_set)])
+
+        with torch.no_grad():
+            output_tokens = self.backbone.generate(
+                input_ids.to(self.backbone.device),
+                attention_mask=attention_mask.to(self.backbone.device),
+                past_key_values=past_key_values,
+                max_length=self.max_context,
+                eos_token_id=self._speech_end_id,
+                pad_token_id=pad_id,
+                do_sample=True,
+                temperature=1.0,
+                top_k=50,
+                use_cache=True,
+                min_new_tokens=50,
+                stopping_criteria=stopping_criteria,
+                streamer=_StepTimer() if instrumentation.enabled() else None,
+            )
+
+        wavs = []
+        for row in output_tokens[:, width:].cpu().numpy():
+            # Finished rows are padded with the end token, so cut at its first occurrence
+            end = np.flatnonzero(row == self._speech_end_id)
+            codes = self._to_codes(row[: end[0]] if len(end) else row)
+            wavs.append(self.watermarking.apply(self._decode_codes(codes)))
+        return wavs
 
+    def prepare_voice(self, ref_codes: np.ndarray | torch.Tensor, ref_text: str) -> NeuTTSVoice:
+        """
+        Build the reusable prompt pieces for a reference voice and prefill the backbone with them.
+
+        Args:
+            ref_codes (np.ndarray | torch.tensor): Encoded reference.
+            ref_text (str): Reference text for reference audio.
+        Returns:
+            NeuTTSVoice: Voice to pass to infer / infer_stream.
+        """
+        ref_codes = self._as_codes(ref_codes)
+        ref_phones = self._to_phones(ref_text)
+        code_ids = self._code_to_token[ref_codes].tolist()
+
+        if self._is_quantized_model:
+            prefix_ids = self.backbone.tokenize(
+                f"user: Convert the text to speech:<|TEXT_PROMPT_START|>{ref_phones}".encode("utf-8"),
+                special=True,
+            )
+            suffix_ids = self.backbone.tokenize(
+                b"<|TEXT_PROMPT_END|>\nassistant:<|SPEECH_GENERATION_START|>",
+                add_bos=False,
+                special=True,
+            )
+        else:
+            chat = """user: Convert the text to speech:<|TEXT_REPLACE|>\nassistant:<|SPEECH_REPLACE|>"""
+            ids = self.tokenizer.encode(chat)
+            text_replace_idx = ids.index(self.tokenizer.convert_tokens_to_ids("<|TEXT_REPLACE|>"))
+            speech_replace_idx = ids.index(self.tokenizer.convert_tokens_to_ids("<|SPEECH_REPLACE|>"))
+            prefix_ids = (
+                ids[:text_replace_idx]
+                + [self.tokenizer.convert_tokens_to_ids("<|TEXT_PROMPT_START|>")]
+                + self.tokenizer.encode(ref_phones, add_special_tokens=False)
+            )
+            suffix_ids = (
+                [self.tokenizer.convert_tokens_to_ids("<|TEXT_PROMPT_END|>")]
+                + ids[text_replace_idx + 1 : speech_replace_idx]
+                + [self.tokenizer.convert_tokens_to_ids("<|SPEECH_GENERATION_START|>")]
+            )
+
+        voice = NeuTTSVoice(ref_codes, ref_text, ref_phones, prefix_ids, suffix_ids + code_ids)
+        voice.prefix_state = self._prefill(prefix_ids)
+        return voice
+
+    def _prefill(self, prefix_ids: list[int]):
         if self._is_quantized_model:
-            return self._infer_stream_ggml(ref_codes, ref_text, text)
+            self.backbone.reset()
+            self.backbone.eval(prefix_ids)
+            return self.backbone.save_state()
 
+        prefix_tensor = torch.tensor(prefix_ids).unsqueeze(0).to(self.backbone.device)
+        with torch.no_grad():
+            return self.backbone(prefix_tensor, use_cache=True).past_key_values
+
+    def _prompt_ids(self, voice: NeuTTSVoice, text: str) -> list[int]:
+        # Only the new text is phonemized and tokenized; it joins the reference transcript with a space
+        phones = " " + self._to_phones(text)
+        if self._is_quantized_model:
+            text_ids = self.backbone.tokenize(phones.encode("utf-8"), add_bos=False)
         else:
-            raise NotImplementedError("Streaming is not implemented for the torch backend!")
+            text_ids = self.tokenizer.encode(phones, add_special_tokens=False)
+        return voice.prefix_ids + text_ids + voice.suffix_ids
+
+    def _prefix_cache(self, voice: NeuTTSVoice):
+        # generate() extends the cache in place, so every request starts from its own copy
+        return copy.deepcopy(voice.prefix_state)
+
+    def watermark_stats(self) -> dict:
+        return self.watermarking.stats()
 
     def encode_reference(self, ref_audio_path: str | Path):
-        wav, _ = librosa.load(ref_audio_path, sr=16000, mono=True)
+        wav, sr = librosa.load(ref_audio_path, sr=None, mono=True)
+        wav = resample(wav, sr, 16000)
         wav_tensor = torch.from_numpy(wav).float().unsqueeze(0).unsqueeze(0)  # [1, 1, T]
         with torch.no_grad():
-            ref_codes = self.codec.encode_code(audio_or_path=wav_tensor).squeeze(0).squeeze(0)
+            ref_codes = self._encoder().encode_code(audio_or_path=wav_tensor).squeeze(0).squeeze(0)
         return ref_codes
 
-    def _decode(self, codes: str):
-
-        # Extract speech token IDs using regex
-        speech_ids = [int(num) for num in re.findall(r"<\|speech_(\d+)\|>", codes)]
-
-        if len(speech_ids) > 0:
+    def _encoder(self):
+        if not self._is_onnx_codec:
+            return self.codec
+        # The ONNX decoder cannot encode, so the torch codec is only loaded once a
+        # reference actually needs encoding
+        if self._reference_codec is None:
+            print("Loading torch codec to encode references ...")
+            with get_weight_store().track("neutts:neuphonic/neucodec"):
+                self._reference_codec = NeuCodec.from_pretrained("neuphonic/neucodec").eval()
+        return self._reference_codec
+
+    def _as_codes(self, ref_codes) -> np.ndarray:
+        if isinstance(ref_codes, torch.Tensor):
+            ref_codes = ref_codes.cpu().numpy()
+        return np.asarray(ref_codes, dtype=np.int64).reshape(-1)
+
+    def _to_codes(self, token_ids) -> np.ndarray:
+        # Anything that is not a speech token maps to -1 and is dropped
+        codes = self._token_to_code[np.asarray(token_ids, dtype=np.int64)]
+        return codes[codes >= 0]
+
+    def _decode_codes(self, codes) -> np.ndarray:
+        codes = np.asarray(codes, dtype=np.int64)
+        if len(codes) == 0:
+            raise ValueError("No valid speech tokens found in the output.")
 
+        with instrumentation.span("vocoder"):
             # Onnx decode
             if self._is_onnx_codec:
-                codes = np.array(speech_ids, dtype=np.int32)[np.newaxis, np.newaxis, :]
-                recon = self.codec.decode_code(codes)
+                recon = self.codec.decode_code(codes.astype(np.int32)[np.newaxis, np.newaxis, :])
 
             # Torch decode
             else:
                 with torch.no_grad():
-                    codes = torch.tensor(speech_ids, dtype=torch.long)[None, None, :].to(
-                        self.codec.device
-                    )
+                    codes = torch.from_numpy(codes)[None, None, :].to(self.codec.device)
                     recon = self.codec.decode_code(codes).cpu().numpy()
 
-            return recon[0, 0, :]
-        else:
-            raise ValueError("No valid speech tokens found in the output.")
+        return recon[0, 0, :]
 
     def _to_phones(self, text: str) -> str:
-        phones = self.phonemizer.phonemize([text])
-        phones = phones[0].split()
-        phones = " ".join(phones)
-        return phones
-
-    def _apply_chat_template(
-        self, ref_codes: list[int], ref_text: str, input_text: str
-    ) -> list[int]:
-
-        input_text = self._to_phones(ref_text) + " " + self._to_phones(input_text)
-        speech_replace = self.tokenizer.convert_tokens_to_ids("<|SPEECH_REPLACE|>")
-        speech_gen_start = self.tokenizer.convert_tokens_to_ids("<|SPEECH_GENERATION_START|>")
-        text_replace = self.tokenizer.convert_tokens_to_ids("<|TEXT_REPLACE|>")
-        text_prompt_start = self.tokenizer.convert_tokens_to_ids("<|TEXT_PROMPT_START|>")
-        text_prompt_end = self.tokenizer.convert_tokens_to_ids("<|TEXT_PROMPT_END|>")
-
-        input_ids = self.tokenizer.encode(input_text, add_special_tokens=False)
-        chat = """user: Convert the text to speech:<|TEXT_REPLACE|>\nassistant:<|SPEECH_REPLACE|>"""
-        ids = self.tokenizer.encode(chat)
-
-        text_replace_idx = ids.index(text_replace)
-        ids = (
-            ids[:text_replace_idx]
-            + [text_prompt_start]
-            + input_ids
-            + [text_prompt_end]
-            + ids[text_replace_idx + 1 :]  # noqa
-        )
+        return self.phonemizer(text, self.language)
 
-        speech_replace_idx = ids.index(speech_replace)
-        codes_str = "".join([f"<|speech_{i}|>" for i in ref_codes])
-        codes = self.tokenizer.encode(codes_str, add_special_tokens=False)
-        ids = ids[:speech_replace_idx] + [speech_gen_start] + list(codes)
-
-        return ids
-
-    def _infer_torch(self, prompt_ids: list[int]) -> str:
+    def _infer_torch(self, prompt_ids: list[int], voice: NeuTTSVoice) -> np.ndarray:
         prompt_tensor = torch.tensor(prompt_ids).unsqueeze(0).to(self.backbone.device)
-        speech_end_id = self.tokenizer.convert_tokens_to_ids("<|SPEECH_GENERATION_END|>")
         with torch.no_grad():
             output_tokens = self.backbone.generate(
                 prompt_tensor,
+                past_key_values=self._prefix_cache(voice),
                 max_length=self.max_context,
-                eos_token_id=speech_end_id,
+                eos_token_id=self._speech_end_id,
                 do_sample=True,
                 temperature=1.0,
                 top_k=50,
                 use_cache=True,
                 min_new_tokens=50,
+                streamer=_StepTimer() if instrumentation.enabled() else None,
             )
         input_length = prompt_tensor.shape[-1]
-        output_str = self.tokenizer.decode(
-            output_tokens[0, input_length:].cpu().numpy().tolist(), add_special_tokens=False
-        )
-        return output_str
-    
-    def _infer_ggml(self, ref_codes: list[int], ref_text: str, input_text: str) -> str:
-        ref_text = self._to_phones(ref_text)
-        input_text = self._to_phones(input_text)
-
-        codes_str = "".join([f"<|speech_{idx}|>" for idx in ref_codes])
-        prompt = (
-            f"user: Convert the text to speech:<|TEXT_PROMPT_START|>{ref_text} {input_text}"
-            f"<|TEXT_PROMPT_END|>\nassistant:<|SPEECH_GENERATION_START|>{codes_str}"
-        )
-        output = self.backbone(
-            prompt,
-            max_tokens=self.max_context,
-            temperature=1.0,
-            top_k=50,
-            stop=["<|SPEECH_GENERATION_END|>"],
-        )
-        output_str = output["choices"][0]["text"]
-        return output_str
-
-    def _infer_stream_ggml(self, ref_codes: torch.Tensor, ref_text: str, input_text: str) -> Generator[np.ndarray, None, None]:
-        ref_text = self._to_phones(ref_text)
-        input_text = self._to_phones(input_text)
-
-        codes_str = "".join([f"<|speech_{idx}|>" for idx in ref_codes])
-        prompt = (
-            f"user: Convert the text to speech:<|TEXT_PROMPT_START|>{ref_text} {input_text}"
-            f"<|TEXT_PROMPT_END|>\nassistant:<|SPEECH_GENERATION_START|>{codes_str}"
-        )
-
-        audio_cache: list[np.ndarray] = []
-        token_cache: list[str] = [f"<|speech_{idx}|>" for idx in ref_codes]
-        n_decoded_samples: int = 0
-        n_decoded_tokens: int = len(ref_codes)
-
-        for item in self.backbone(
-            prompt,
-            max_tokens=self.max_context,
-            temperature=1.0,
-            top_k=50,
-            stop=["<|SPEECH_GENERATION_END|>"],
-            stream=True
-        ):
-            output_str = item["choices"][0]["text"]
-            token_cache.append(output_str)
+        return self._to_codes(output_tokens[0, input_length:].cpu().numpy())
+
+    def _generate_ggml(self, prompt_ids: list[int], voice: NeuTTSVoice) -> Generator[int, None, None]:
+        # generate() reuses the loaded state for the longest matching prefix of the prompt
+        self.backbone.load_state(voice.prefix_state)
+        # Same sampling settings as create_completion, on token ids instead of text
+        n_ctx = min(self.backbone.n_ctx(), self.max_context)
+        eos_id = self.backbone.token_eos()
+        timer = _StepTimer()
+        timer.put(prompt_ids)
+        try:
+            for n_generated, token_id in enumerate(
+                self.backbone.generate(
+                    prompt_ids, top_k=50, top_p=0.95, min_p=0.05, temp=1.0, repeat_penalty=1.0
+                ),
+                start=1,
+            ):
+                timer.put(token_id)
+                if token_id in (self._speech_end_id, eos_id):
+                    break
+                yield token_id
+                timer.resume()
+                if len(prompt_ids) + n_generated >= n_ctx:
+                    break
+        finally:
+            timer.end()
+
+    def _stream_tokens_torch(self, prompt_ids: list[int], voice: NeuTTSVoice) -> Generator[int, None, None]:
+        prompt_tensor = torch.tensor(prompt_ids).unsqueeze(0).to(self.backbone.device)
+        past_key_values = self._prefix_cache(voice)
+        speech_end_id = self._speech_end_id
+        streamer = _SpeechTokenStreamer()
 
-            if len(token_cache[n_decoded_tokens:]) >= self.streaming_frames_per_chunk + self.streaming_lookforward:
+        def generate():
+            try:
+                with torch.no_grad():
+                    self.backbone.generate(
+                        prompt_tensor,
+                        past_key_values=past_key_values,
+                        max_length=self.max_context,
+                        eos_token_id=speech_end_id,
+                        do_sample=True,
+                        temperature=1.0,
+                        top_k=50,
+                        use_cache=True,
+                        min_new_tokens=50,
+                        streamer=streamer,
+                        stopping_criteria=StoppingCriteriaList([_CancelGeneration(lambda: streamer.cancelled)]),
+                    )
+            except BaseException as e:
+                streamer.queue.put(e)
+
+        # Sampling runs on its own thread so chunks are decoded while later tokens are generated
+        thread = Thread(target=instrumentation.bind(generate), daemon=True)
+        thread.start()
+        try:
+            for token_id in streamer:
+                if token_id == speech_end_id:
+                    break
+                yield token_id
+        finally:
+            # Stops generation early if the caller abandons the stream
+            streamer.cancelled = True
+            thread.join()
+
+    def _decode_stream(self, token_ids: Iterable[int], ref_codes: torch.Tensor) -> Generator[np.ndarray, None, None]:
+        overlap_add = _OverlapAdd(stride=self.streaming_stride_samples)
+        token_cache: list[int] = self._as_codes(ref_codes).tolist()
+        n_decoded_tokens: int = len(token_cache)
+
+        for token_id in token_ids:
+            code = int(self._token_to_code[token_id])
+            if code < 0:
+                continue
+            token_cache.append(code)
+
+            if len(token_cache) - n_decoded_tokens >= self.streaming_frames_per_chunk + self.streaming_lookforward:
 
                 # decode chunk
                 tokens_start = max(
@@ -342,20 +815,11 @@ class NeuTTSAir:
                     + (self.streaming_frames_per_chunk + 2 * self.streaming_overlap_frames) * self.hop_length
                 )
                 curr_codes = token_cache[tokens_start:tokens_end]
-                recon = self._decode("".join(curr_codes))
-                recon = self.watermarker.apply_watermark(recon, sample_rate=24_000)
+                recon = self._decode_codes(curr_codes)
                 recon = recon[sample_start:sample_end]
-                audio_cache.append(recon)
 
                 # postprocess
-                processed_recon = _linear_overlap_add(
-                    audio_cache, stride=self.streaming_stride_samples
-                )
-                new_samples_end = len(audio_cache) * self.streaming_stride_samples
-                processed_recon = processed_recon[
-                    n_decoded_samples:new_samples_end
-                ]
-                n_decoded_samples = new_samples_end
+                processed_recon = overlap_add.add(recon)
                 n_decoded_tokens += self.streaming_frames_per_chunk
                 yield processed_recon
 
@@ -374,11 +838,8 @@ class NeuTTSAir:
                 - self.streaming_overlap_frames
             ) * self.hop_length
             curr_codes = token_cache[tokens_start:]
-            recon = self._decode("".join(curr_codes))
-            recon = self.watermarker.apply_watermark(recon, sample_rate=24_000)
+            recon = self._decode_codes(curr_codes)
             recon = recon[sample_start:]
-            audio_cache.append(recon)
 
-            processed_recon = _linear_overlap_add(audio_cache, stride=self.streaming_stride_samples)
-            processed_recon = processed_recon[n_decoded_samples:]
+            processed_recon = overlap_add.add(recon, final=True)
             yield processed_recon
\ No newline at end of file
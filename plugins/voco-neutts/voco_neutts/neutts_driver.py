@@ -1,4 +1,5 @@
 from typing import Any, Generator
+from voco.core.audio import AudioChunk, ChunkStream
 from voco.core.base_model import BaseAudioModel
 
 
@@ -12,38 +13,104 @@ class NeuTTSDriver(BaseAudioModel):
     ) -> None:
         super().__init__(device=device, dtype=dtype, **kwargs)
         self.pipeline = None
-        self._backbone_repo = kwargs.get("backbone_repo", "neuphonic/neutts-air")
-        self._codec_repo = kwargs.get("codec_repo", "neuphonic/neucodec")
+        self._backend = kwargs.get("backend", "auto")
+        self._backbone_repo = kwargs.get("backbone_repo")
+        self._codec_repo = kwargs.get("codec_repo")
+        self._backend_info = None
+        self._watermark = kwargs.get("watermark", "on")
+        self._reference_cache_dir = kwargs.get("reference_cache_dir", "~/.voco/references")
+        self._persist_references = kwargs.get("persist_references", False)
+        self._max_references = kwargs.get("max_references", 256)
+        self._voices = kwargs.get("voices", {})
+        # With a torch backbone this is torch.set_num_threads, which affects the whole process
+        self._num_threads = kwargs.get("num_threads")
+        self._n_batch = kwargs.get("n_batch", 512)
+        self._n_ctx = kwargs.get("n_ctx", 2048)
 
     def load(self) -> None:
+        from .backends import select_backend
         from .pipeline import NeuTTSPipeline
 
-        self.pipeline = NeuTTSPipeline(
+        # On CPU, a GGUF backbone and the ONNX decoder are used when their runtimes are installed
+        self._backend_info = select_backend(
+            self.device,
+            backend=self._backend,
             backbone_repo=self._backbone_repo,
             codec_repo=self._codec_repo,
-            device=self.device
         )
+        self.pipeline = NeuTTSPipeline(
+            backbone_repo=self._backend_info["backbone_repo"],
+            codec_repo=self._backend_info["codec_repo"],
+            device=self.device,
+            watermark=self._watermark,
+            reference_cache_dir=self._reference_cache_dir,
+            persist_references=self._persist_references,
+            max_references=self._max_references,
+            num_threads=self._num_threads,
+            n_batch=self._n_batch,
+            n_ctx=self._n_ctx
+        )
+        for name, voice in self._voices.items():
+            self.register_voice(name, voice["audio"], voice["text"])
         self._loaded = True
 
+    def describe_backend(self) -> dict[str, Any]:
+        from .backends import select_backend
+
+        info = self._backend_info or select_backend(
+            self.device,
+            backend=self._backend,
+            backbone_repo=self._backbone_repo,
+            codec_repo=self._codec_repo,
+        )
+        return {
+            **info,
+            "device": self.device,
+            "num_threads": self._num_threads,
+            "n_batch": self._n_batch,
+            "n_ctx": self._n_ctx,
+            "loaded": self._loaded,
+        }
+
+    def register_voice(self, name: str, audio: str | bytes, text: str) -> None:
+        self.pipeline.register_voice(name, audio, text)
+
+    def warmup(self, voices: Any = None) -> None:
+        # {"name": {"audio": ..., "text": ...}}, encoded and prepared once, then served by name
+        for name, voice in (voices or {}).items():
+            self.register_voice(name, voice["audio"], voice["text"])
+
     def generate(
         self,
         text: str,
         ref_audio: str = None,
         ref_text: str = None,
         ref_codes: Any = None,
+        voice: str = None,
         **kwargs: Any
-    ) -> Generator[Any, None, None]:
+    ) -> Generator[AudioChunk, None, None]:
         if not self._loaded or self.pipeline is None:
             raise RuntimeError("Model not loaded. Call load() first.")
 
+        stream = ChunkStream(self.pipeline.tts.sample_rate)
         for result in self.pipeline(
             text=text,
             ref_audio=ref_audio,
             ref_text=ref_text,
             ref_codes=ref_codes,
+            voice=voice,
             **kwargs
         ):
-            yield result
+            yield stream.chunk(result.audio, text=result.graphemes, phonemes=result.phonemes)
+
+    def stats(self) -> dict[str, Any]:
+        if self.pipeline is None:
+            return {}
+        return {
+            "watermark": self.pipeline.tts.watermark_stats(),
+            "references": self.pipeline.references.stats(),
+            "phonemizer": self.pipeline.tts.phonemizer.stats(),
+        }
 
     def unload(self) -> None:
         if self.pipeline is not None:
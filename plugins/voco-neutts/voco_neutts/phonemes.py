@@ -0,0 +1,128 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from phonemizer.backend import EspeakBackend
+from voco.core import instrumentation
+
+
+class PhonemizerService:
+    """Process-wide espeak phonemizer with an LRU of results.
+
+    Texts that miss the cache are queued, and whichever caller gets to espeak
+    first phonemizes everything queued so far, one espeak call per language.
+    """
+
+    def __init__(self, cache_size: int = 4096):
+        self.cache_size = cache_size
+        self._backends: dict[str, EspeakBackend] = {}
+        self._cache: OrderedDict[tuple[str, str], str] = OrderedDict()
+        self._reset_locks()
+
+        self.hits = 0
+        self.misses = 0
+        self.espeak_calls = 0
+
+    def _reset_locks(self):
+        # Locks held by another thread at fork time would never be released in the child
+        self._lock = threading.Lock()
+        self._espeak_lock = threading.Lock()
+        self._pending: list[tuple[str, list[str], Future]] = []
+
+    def _backend(self, language: str) -> EspeakBackend:
+        backend = self._backends.get(language)
+        if backend is None:
+            backend = self._backends[language] = EspeakBackend(
+                language=language, preserve_punctuation=True, with_stress=True
+            )
+        return backend
+
+    def phonemize(self, texts: list[str], language: str = "en-us") -> list[str]:
+        with instrumentation.span("text"):
+            return self._phonemize(texts, language)
+
+    def _phonemize(self, texts: list[str], language: str) -> list[str]:
+        found: dict[str, str] = {}
+        missing: list[str] = []
+        with self._lock:
+            for text in texts:
+                phones = self._cache.get((language, text))
+                if phones is None:
+                    missing.append(text)
+                else:
+                    self._cache.move_to_end((language, text))
+                    found[text] = phones
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+            if missing:
+                missing = list(dict.fromkeys(missing))
+                future = Future()
+                self._pending.append((language, missing, future))
+
+        if missing:
+            with self._espeak_lock:
+                if not future.done():
+                    self._run_pending()
+            found.update(zip(missing, future.result()))
+
+        return [found[text] for text in texts]
+
+    def _run_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+
+        by_language: dict[str, list[tuple[list[str], Future]]] = {}
+        for language, texts, future in pending:
+            by_language.setdefault(language, []).append((texts, future))
+
+        for language, requests in by_language.items():
+            batch = list(dict.fromkeys(text for texts, _ in requests for text in texts))
+            try:
+                # One line in, one line out, so a batch cannot contain line breaks
+                raw = self._backend(language).phonemize([" ".join(text.splitlines()) for text in batch])
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+
+            phones = {text: " ".join(p.split()) for text, p in zip(batch, raw)}
+            with self._lock:
+                self.espeak_calls += 1
+                for text, p in phones.items():
+                    self._cache[(language, text)] = p
+                    self._cache.move_to_end((language, text))
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+            for texts, future in requests:
+                future.set_result([phones[text] for text in texts])
+
+    def __call__(self, text: str, language: str = "en-us") -> str:
+        return self.phonemize([text], language)[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._cache),
+                "cache_size": self.cache_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "espeak_calls": self.espeak_calls,
+            }
+
+
+_service: PhonemizerService | None = None
+_service_lock = threading.Lock()
+
+
+def get_phonemizer() -> PhonemizerService:
+    """The phonemizer shared by every NeuTTS pipeline in this process"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = PhonemizerService()
+            if hasattr(os, "register_at_fork"):
+                os.register_at_fork(after_in_child=_service._reset_locks)
+        return _service
@@ -1,7 +1,15 @@
+import io
+import re
+from collections import OrderedDict
+from concurrent.futures import Future
 from dataclasses import dataclass
 from pathlib import Path
+from threading import Event, Lock, Thread
 from typing import Generator, Optional, Union
 from loguru import logger
+from voco.core import instrumentation
+from voco.core.references import ReferenceStore
+from .backends import ONNX_CODEC, TORCH_CODEC
 import torch
 import numpy as np
 
@@ -19,6 +27,23 @@ class NeuTTSResult:
         yield self.audio
 
 
+def split_sentences(text: str, min_chars: int = 20) -> list[str]:
+    """Split text at sentence ends, merging fragments shorter than min_chars into the next one"""
+    sentences = []
+    pending = ""
+    for part in re.split(r"(?<=[.!?;])\s+|\n+", text.strip()):
+        pending = f"{pending} {part}".strip() if pending else part.strip()
+        if len(pending) >= min_chars:
+            sentences.append(pending)
+            pending = ""
+    if pending:
+        if sentences:
+            sentences[-1] = f"{sentences[-1]} {pending}"
+        else:
+            sentences.append(pending)
+    return sentences
+
+
 class NeuTTSPipeline:
     """
     NeuTTS Air pipeline wrapper for VOCO.
@@ -30,7 +55,14 @@ class NeuTTSPipeline:
         self,
         backbone_repo: str = "neuphonic/neutts-air",
         codec_repo: str = "neuphonic/neucodec",
-        device: Optional[str] = None
+        device: Optional[str] = None,
+        watermark: str = "on",
+        reference_cache_dir: str = "~/.voco/references",
+        persist_references: bool = False,
+        max_references: Optional[int] = 256,
+        num_threads: Optional[int] = None,
+        n_batch: int = 512,
+        n_ctx: int = 2048
     ):
         """Initialize NeuTTS Air pipeline.
 
@@ -38,6 +70,13 @@ class NeuTTSPipeline:
             backbone_repo: HuggingFace repo for the backbone model
             codec_repo: HuggingFace repo for the codec
             device: Device to run on ('cpu', 'cuda', 'mps')
+            watermark: 'on' (per chunk, on a worker thread), 'deferred' (once per utterance) or 'off'
+            reference_cache_dir: Directory for encoded reference codes shared between processes
+            persist_references: Keep encoded reference codes on disk across restarts
+            max_references: Encoded references kept in memory, least recently used evicted first
+            num_threads: CPU threads for the backbone (runtime default when None)
+            n_batch: Prompt tokens evaluated per llama_cpp batch (GGUF backbones)
+            n_ctx: Context length in tokens, prompt and generated speech together
         """
         from .neutts import NeuTTSAir
 
@@ -49,8 +88,7 @@ class NeuTTSPipeline:
             else:
                 device = 'cpu'
 
-        # Map VOCO device names to NeuTTS device names
-        backbone_device = 'gpu' if device == 'cuda' else device
+        backbone_device = device
         codec_device = device if device != 'mps' else 'cpu'  # NeuTTS may not support MPS for codec
 
         logger.info(f"Initializing NeuTTS Air with backbone on {backbone_device}, codec on {codec_device}")
@@ -59,33 +97,74 @@ class NeuTTSPipeline:
             backbone_repo=backbone_repo,
             backbone_device=backbone_device,
             codec_repo=codec_repo,
-            codec_device=codec_device
+            codec_device=codec_device,
+            watermark=watermark,
+            num_threads=num_threads,
+            n_batch=n_batch,
+            n_ctx=n_ctx
         )
         self.device = device
-        self._ref_codes_cache = {}
+        self.max_references = max_references
 
-    def encode_reference(self, ref_audio_path: Union[str, Path]) -> torch.Tensor:
+        # Encoded reference codes, keyed by audio content hash and reference text. Codes are
+        # only valid for the codec that encoded them; the ONNX decoder's come from NeuCodec.
+        encoder_repo = TORCH_CODEC if codec_repo == ONNX_CODEC else codec_repo
+        self.references = ReferenceStore(
+            f"neutts/{encoder_repo}",
+            cache_dir=reference_cache_dir,
+            persist=persist_references,
+            loader=torch.from_numpy,
+            max_entries=max_references,
+        )
+        self._voice_cache = OrderedDict()
+        self._voice_lock = Lock()
+
+    def _encode(self, audio: Union[str, Path, bytes]) -> torch.Tensor:
+        logger.debug("Encoding reference audio")
+        return self.tts.encode_reference(io.BytesIO(audio) if isinstance(audio, bytes) else audio)
+
+    def encode_reference(self, ref_audio: Union[str, Path, bytes], ref_text: str = "") -> torch.Tensor:
         """Encode reference audio for voice cloning.
 
         Args:
-            ref_audio_path: Path to reference audio file
+            ref_audio: Path to reference audio file, or its bytes
+            ref_text: Transcript of reference audio, part of the cache key
 
         Returns:
             Encoded reference codes
         """
-        ref_audio_path = str(ref_audio_path)
+        return self.references.get_or_encode(ref_audio, ref_text, self._encode).codes
+
+    def register_voice(self, name: str, audio: Union[str, Path, bytes], text: str) -> None:
+        """Encode a reference once, prefill its prompt and make it available as `voice=name`"""
+        prompt = self.references.register_voice(name, audio, text, self._encode)
+        self.prepare_voice(prompt.codes, prompt.text)
+        logger.info(f"Registered voice '{name}'")
 
-        # Check cache
-        if ref_audio_path in self._ref_codes_cache:
-            logger.debug(f"Using cached reference codes for {ref_audio_path}")
-            return self._ref_codes_cache[ref_audio_path]
+    def prepare_voice(self, ref_codes: Union[torch.Tensor, np.ndarray], ref_text: str):
+        """Return the prepared prompt prefix for a reference voice, building it on first use.
 
-        logger.debug(f"Encoding reference audio: {ref_audio_path}")
-        ref_codes = self.tts.encode_reference(ref_audio_path)
+        Args:
+            ref_codes: Encoded reference codes
+            ref_text: Transcript of reference audio
 
-        # Cache the codes
-        self._ref_codes_cache[ref_audio_path] = ref_codes
-        return ref_codes
+        Returns:
+            NeuTTSVoice reused by every request with this reference
+        """
+        key = (self.tts._as_codes(ref_codes).tobytes(), ref_text)
+        with self._voice_lock:
+            voice = self._voice_cache.get(key)
+            if voice is not None:
+                self._voice_cache.move_to_end(key)
+                return voice
+
+        logger.debug("Preparing prompt prefix for reference voice")
+        voice = self.tts.prepare_voice(ref_codes, ref_text)
+        with self._voice_lock:
+            self._voice_cache[key] = voice
+            if self.max_references is not None and len(self._voice_cache) > self.max_references:
+                self._voice_cache.popitem(last=False)
+        return voice
 
     def __call__(
         self,
@@ -93,6 +172,10 @@ class NeuTTSPipeline:
         ref_audio: Optional[str] = None,
         ref_text: Optional[str] = None,
         ref_codes: Optional[Union[torch.Tensor, np.ndarray]] = None,
+        stream: bool = True,
+        voice: Optional[str] = None,
+        long_form: bool = False,
+        batch_size: int = 4,
         **kwargs
     ) -> Generator[NeuTTSResult, None, None]:
         """Generate speech from text using reference voice.
@@ -102,29 +185,54 @@ class NeuTTSPipeline:
             ref_audio: Path to reference audio file (for voice cloning)
             ref_text: Transcript of reference audio
             ref_codes: Pre-encoded reference codes (if already encoded)
+            stream: Yield audio chunk by chunk as speech tokens are generated
+            voice: Name of a voice added with register_voice, used instead of ref_audio/ref_text
+            long_form: Split the text into sentences and generate them in batches
+            batch_size: Sentences per batched generate call in long-form mode
             **kwargs: Additional arguments
 
         Yields:
             NeuTTSResult containing generated audio
         """
-        # Handle reference encoding
-        if ref_codes is None:
-            if ref_audio is None:
-                raise ValueError("Either ref_audio or ref_codes must be provided")
-            ref_codes = self.encode_reference(ref_audio)
-
         # Load reference text if it's a file path
         if ref_text and Path(ref_text).exists():
             with open(ref_text, 'r') as f:
                 ref_text = f.read().strip()
 
+        # Reference codes are only encoded the first time a reference is seen
+        if voice is not None:
+            prompt = self.references.get_voice(voice)
+            ref_codes, ref_text = prompt.codes, prompt.text
+        elif ref_codes is None:
+            if ref_audio is None:
+                raise ValueError("Either ref_audio, ref_codes or voice must be provided")
+            ref_codes = self.encode_reference(ref_audio, ref_text or "")
+
         if not ref_text:
             raise ValueError("ref_text must be provided")
 
         logger.debug(f"Generating speech for: {text[:50]}{'...' if len(text) > 50 else ''}")
 
+        prepared = self.prepare_voice(ref_codes, ref_text)
+        if long_form:
+            yield from self._generate_long_form(text, prepared, batch_size)
+            return
+
+        # Get phonemes (NeuTTS uses phonemizer internally)
+        phonemes = self.tts._to_phones(text)
+
+        if stream:
+            # Chunks are decoded while later speech tokens are still being generated
+            for wav in self.tts.infer_stream(text, voice=prepared):
+                yield NeuTTSResult(
+                    graphemes=text,
+                    phonemes=phonemes,
+                    audio=torch.from_numpy(wav).unsqueeze(0)
+                )
+            return
+
         # Generate audio
-        wav = self.tts.infer(text, ref_codes, ref_text)
+        wav = self.tts.infer(text, voice=prepared)
 
         # Convert to torch tensor if needed
         if isinstance(wav, np.ndarray):
@@ -132,11 +240,60 @@ class NeuTTSPipeline:
         else:
             audio = wav
 
-        # Get phonemes (NeuTTS uses phonemizer internally)
-        phonemes = self.tts._to_phones(text)
-
         yield NeuTTSResult(
             graphemes=text,
             phonemes=phonemes,
             audio=audio
         )
+
+    def _generate_long_form(self, text: str, prepared, batch_size: int) -> Generator[NeuTTSResult, None, None]:
+        sentences = split_sentences(text)
+        if not sentences:
+            return
+        # Phonemized in one espeak call; later lookups for the prompts hit the cache
+        phonemes = self.tts.phonemizer.phonemize(sentences, self.tts.language)
+        logger.debug(f"Long-form generation of {len(sentences)} sentences")
+
+        # The first sentence streams for a quick start. The rest are then generated in batches
+        # on a background thread while the caller plays it; llama_cpp runs one sequence at a
+        # time, so GGUF backbones stream every sentence in turn instead.
+        # The backbone, codec and watermarker are never used by two threads at once: the batch
+        # thread starts only once the first sentence is complete, so it does not compete with
+        # it for the intra-op thread pool either.
+        concurrent = not self.tts._is_quantized_model and len(sentences) > 1
+        results = [Future() for _ in sentences]
+        cancelled = Event()
+
+        def generate_rest():
+            for start in range(1, len(sentences), batch_size):
+                indices = range(start, min(start + batch_size, len(sentences)))
+                if cancelled.is_set():
+                    return
+                try:
+                    wavs = self.tts.infer_batch([sentences[i] for i in indices], prepared, cancelled)
+                except BaseException as e:
+                    for i in indices:
+                        results[i].set_exception(e)
+                    return
+                for i, wav in zip(indices, wavs):
+                    results[i].set_result(wav)
+
+        thread = Thread(target=instrumentation.bind(generate_rest), daemon=True) if concurrent else None
+        try:
+            for i, sentence in enumerate(sentences):
+                if i == 0 or thread is None:
+                    wavs = self.tts.infer_stream(sentence, voice=prepared)
+                else:
+                    wavs = [results[i].result()]
+                for wav in wavs:
+                    yield NeuTTSResult(
+                        graphemes=sentence,
+                        phonemes=phonemes[i],
+                        audio=torch.from_numpy(wav).unsqueeze(0)
+                    )
+                if i == 0 and thread is not None:
+                    thread.start()
+        finally:
+            cancelled.set()
+            if thread is not None and thread.is_alive():
+                thread.join()
@@ -0,0 +1,117 @@
+"""Sweep NeuTTS backbone thread counts and report generation speed.
+
+    python -m voco_neutts.tune --ref-audio samples/dave.wav --ref-text samples/dave.txt \
+        --threads 1 2 4 8 --backbone-repo neuphonic/neutts-air-q4-gguf
+
+Pass the best count to router.load("neutts", num_threads=...).
+"""
+import argparse
+import os
+import time
+from pathlib import Path
+
+import torch
+
+DEFAULT_TEXT = "The quick brown fox jumps over the lazy dog, then naps in the afternoon sun."
+
+
+def measure(tts, voice, text: str, runs: int = 3) -> dict:
+    """Median tokens/sec and time to first token for one thread setting"""
+    prompt_ids = tts._prompt_ids(voice, text)
+    speeds, first_tokens, counts = [], [], []
+    for _ in range(runs):
+        if tts._is_quantized_model:
+            token_ids = tts._generate_ggml(prompt_ids, voice)
+        else:
+            token_ids = tts._stream_tokens_torch(prompt_ids, voice)
+
+        start = time.perf_counter()
+        first = None
+        count = 0
+        for _ in token_ids:
+            if first is None:
+                first = time.perf_counter() - start
+            count += 1
+        elapsed = time.perf_counter() - start
+
+        speeds.append(count / elapsed if elapsed > 0 else 0.0)
+        first_tokens.append(first or 0.0)
+        counts.append(count)
+
+    middle = runs // 2
+    return {
+        "tokens_per_sec": round(sorted(speeds)[middle], 1),
+        "first_token_ms": round(sorted(first_tokens)[middle] * 1000, 1),
+        "tokens": sorted(counts)[middle],
+        # Seconds of audio generated per second at 50 speech tokens per second of audio;
+        # above 1 is faster than real time
+        "speed_x_realtime": round(sorted(speeds)[middle] / 50, 2),
+    }
+
+
+def sweep(pipeline, ref_codes, ref_text: str, threads: list[int], text: str = DEFAULT_TEXT, runs: int = 3) -> list[dict]:
+    tts = pipeline.tts
+    voice = pipeline.prepare_voice(ref_codes, ref_text)
+    # One untimed run, so the first setting does not pay for warming caches
+    measure(tts, voice, text, runs=1)
+
+    # torch threads are process-wide, so the sweep puts back what it found
+    previous = tts.num_threads
+    if tts._is_quantized_model:
+        original = tts.backbone.n_threads
+    else:
+        original = torch.get_num_threads()
+
+    results = []
+    try:
+        for num_threads in threads:
+            tts.set_num_threads(num_threads)
+            results.append({"num_threads": num_threads, **measure(tts, voice, text, runs)})
+    finally:
+        tts.set_num_threads(original)
+        tts.num_threads = previous
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ref-audio", required=True)
+    parser.add_argument("--ref-text", required=True, help="Transcript, or a file containing it")
+    parser.add_argument("--text", default=DEFAULT_TEXT)
+    parser.add_argument("--threads", type=int, nargs="+")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--backbone-repo", default="neuphonic/neutts-air")
+    parser.add_argument("--codec-repo", default="neuphonic/neucodec")
+    parser.add_argument("--n-batch", type=int, default=512)
+    parser.add_argument("--n-ctx", type=int, default=2048)
+    args = parser.parse_args()
+
+    from .pipeline import NeuTTSPipeline
+
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    threads = args.threads or sorted({1, 2, 4, 8, cpus} & set(range(1, cpus + 1)))
+
+    ref_text = args.ref_text
+    if Path(ref_text).exists():
+        ref_text = Path(ref_text).read_text().strip()
+
+    pipeline = NeuTTSPipeline(
+        backbone_repo=args.backbone_repo,
+        codec_repo=args.codec_repo,
+        device="cpu",
+        watermark="off",
+        n_batch=args.n_batch,
+        n_ctx=args.n_ctx,
+    )
+    ref_codes = pipeline.encode_reference(args.ref_audio, ref_text)
+
+    print(f"{'threads':>8} {'tok/s':>8} {'first ms':>9} {'tokens':>7} {'x realtime':>11}")
+    for row in sweep(pipeline, ref_codes, ref_text, threads, args.text, args.runs):
+        print(
+            f"{row['num_threads']:>8} {row['tokens_per_sec']:>8} {row['first_token_ms']:>9} "
+            f"{row['tokens']:>7} {row['speed_x_realtime']:>11}"
+        )
+
+
+if __name__ == "__main__":
+    main()
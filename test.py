@@ -1,8 +1,5 @@
-from voco.core import AudioRouter
+from voco.core import AudioChunk, AudioRouter, write_wav
 import voco_kokoro
-import torch
-import numpy as np
-from scipy.io import wavfile
 
 print("Loading Kokoro TTS model...")
 router = AudioRouter()
@@ -12,19 +9,17 @@ text = "Hello world! This is a test of the Kokoro text to speech model running t
 print(f"\nGenerating audio for: '{text}'")
 
 audio_chunks = []
-for result in router.infer("tts", text=text, voice="af_heart", speed=1.0):
-    if result.audio is not None:
-        audio_chunks.append(result.audio)
-        print(f"  Chunk: '{result.graphemes}' -> {result.audio.shape[-1]} samples")
+for chunk in router.infer("tts", text=text, voice="af_heart", speed=1.0):
+    audio_chunks.append(chunk)
+    print(f"  Chunk: '{chunk.text}' -> {chunk.num_samples} samples")
 
 if audio_chunks:
-    audio = torch.cat(audio_chunks, dim=-1)
-    print(f"\nTotal audio shape: {audio.shape}")
-    print(f"Duration: {audio.shape[-1] / 24000:.2f}s")
+    audio = AudioChunk.concat(audio_chunks)
+    print(f"\nTotal samples: {audio.num_samples}")
+    print(f"Duration: {audio.duration:.2f}s")
 
     output_file = "output.wav"
-    audio_np = audio.squeeze().cpu().numpy()
-    wavfile.write(output_file, 24000, audio_np)
+    write_wav(output_file, audio_chunks)
     print(f"Saved to: {output_file}")
 else:
     print("No audio generated!")
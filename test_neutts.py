@@ -10,9 +10,7 @@ if sys.platform == 'darwin':
     except Exception:
         pass
 
-from voco.core import AudioRouter
-import torch
-from scipy.io import wavfile
+from voco.core import AudioChunk, AudioRouter, write_wav
 
 print("Loading NeuTTS Air model...")
 router = AudioRouter()
@@ -39,25 +37,24 @@ print(f"Using reference voice from: {ref_audio}")
 print(f"Reference text: {ref_text_content}")
 
 audio_chunks = []
-for result in router.infer(
+for chunk in router.infer(
     "tts",
     text=text,
     ref_audio=ref_audio,
     ref_text=ref_text_content
 ):
-    if result.audio is not None:
-        audio_chunks.append(result.audio)
-        print(f"  Generated audio chunk: {result.audio.shape[-1]} samples")
-        print(f"  Phonemes: {result.phonemes[:100]}{'...' if len(result.phonemes) > 100 else ''}")
+    audio_chunks.append(chunk)
+    phonemes = chunk.metadata.get("phonemes", "")
+    print(f"  Generated audio chunk: {chunk.num_samples} samples")
+    print(f"  Phonemes: {phonemes[:100]}{'...' if len(phonemes) > 100 else ''}")
 
 if audio_chunks:
-    audio = torch.cat(audio_chunks, dim=-1)
-    print(f"\nTotal audio shape: {audio.shape}")
-    print(f"Duration: {audio.shape[-1] / 24000:.2f}s")
+    audio = AudioChunk.concat(audio_chunks)
+    print(f"\nTotal samples: {audio.num_samples}")
+    print(f"Duration: {audio.duration:.2f}s")
 
     output_file = "output_neutts.wav"
-    audio_np = audio.squeeze().cpu().numpy()
-    wavfile.write(output_file, 24000, audio_np)
+    write_wav(output_file, audio_chunks)
     print(f"Saved to: {output_file}")
 else:
     print("No audio generated!")
@@ -1,15 +1,18 @@
-from . import device, registry
+from . import device, instrumentation, registry
+from .audio import AudioChunk, ChunkStream, write_wav
 from .base_model import BaseAudioModel
-from .plugin_loader import discover_plugins
-
-discover_plugins()
+from .plugin_loader import PluginLoadError, discover_plugins, get_plugin_diagnostics
 from .cache import VocoCache
 from .config import ModelConfig, merge_configs
+from .instrumentation import MetricsSink, add_sink, remove_sink
 from .device import get_device, get_dtype
+from .pool import ModelPool, PoolWorkerError
+from .references import ReferencePrompt, ReferenceStore, VoiceNotFoundError
 from .registry import (
     ModelAlreadyRegisteredError,
     ModelNotFoundError,
     clear_registry,
+    get_available_models,
     get_registered_models,
     is_registered,
     load,
@@ -17,24 +20,48 @@ from .registry import (
     unregister_model,
 )
 from .router import AudioRouter, ModelNotLoadedError
+from .warmup import WarmupError, WarmupManifest, WarmupModel, WarmupStatus
+from .weights import WeightStore, get_weight_store
 
 __all__ = [
+    "AudioChunk",
+    "ChunkStream",
     "BaseAudioModel",
     "AudioRouter",
+    "ModelPool",
     "VocoCache",
     "ModelConfig",
+    "MetricsSink",
+    "WarmupManifest",
+    "WarmupModel",
+    "WarmupStatus",
+    "ReferencePrompt",
+    "ReferenceStore",
+    "WeightStore",
+    "get_weight_store",
     "register_model",
     "unregister_model",
     "load",
     "is_registered",
     "get_registered_models",
+    "get_available_models",
+    "discover_plugins",
+    "get_plugin_diagnostics",
     "clear_registry",
     "get_device",
     "get_dtype",
     "merge_configs",
+    "add_sink",
+    "remove_sink",
+    "write_wav",
     "ModelAlreadyRegisteredError",
     "ModelNotFoundError",
     "ModelNotLoadedError",
+    "PluginLoadError",
+    "PoolWorkerError",
+    "VoiceNotFoundError",
+    "WarmupError",
     "registry",
     "device",
+    "instrumentation",
 ]
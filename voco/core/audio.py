@@ -0,0 +1,273 @@
+import struct
+import sys
+import time
+from typing import Any, BinaryIO, Iterable, Optional, Union
+
+# dtype name -> (struct format, bytes per sample, WAV format tag)
+SAMPLE_FORMATS = {
+    "float32": ("f", 4, 3),
+    "float64": ("d", 8, 3),
+    "int16": ("h", 2, 1),
+    "int32": ("i", 4, 1),
+    "uint8": ("B", 1, 1),
+}
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class AudioChunk:
+    def __init__(
+        self,
+        data: Any,
+        sample_rate: int,
+        dtype: str = "float32",
+        channels: int = 1,
+        index: int = 0,
+        offset: int = 0,
+        elapsed: Optional[float] = None,
+        text: Optional[str] = None,
+        metadata: Optional[dict[str, Any]] = None,
+    ) -> None:
+        if dtype not in SAMPLE_FORMATS:
+            raise ValueError(f"Unsupported sample dtype: {dtype}")
+        # Any C-contiguous buffer is referenced as-is, never copied
+        view = data if isinstance(data, memoryview) else memoryview(data)
+        if not view.c_contiguous:
+            raise ValueError("Audio buffer must be contiguous")
+        self._data = view.cast("B") if view.format != "B" or view.ndim != 1 else view
+
+        self.sample_rate = sample_rate
+        self.dtype = dtype
+        self.channels = channels
+        self.index = index
+        self.offset = offset
+        self.elapsed = elapsed
+        self.text = text
+        self.metadata = metadata or {}
+
+    @classmethod
+    def from_array(cls, audio: Any, sample_rate: int, **kwargs: Any) -> "AudioChunk":
+        # Checked through sys.modules so torch is never imported just for this
+        torch = sys.modules.get("torch")
+        if torch is not None and isinstance(audio, torch.Tensor):
+            audio = audio.detach()
+            if str(audio.dtype).replace("torch.", "") not in SAMPLE_FORMATS:
+                audio = audio.float()
+            # Shares memory with a contiguous CPU tensor
+            audio = audio.cpu().contiguous().numpy()
+
+        import numpy as np
+
+        audio = np.ascontiguousarray(audio)
+        if audio.dtype.name not in SAMPLE_FORMATS:
+            audio = audio.astype(np.float32)
+        channels = kwargs.pop("channels", 1)
+        return cls(audio.reshape(-1), sample_rate, dtype=audio.dtype.name, channels=channels, **kwargs)
+
+    @property
+    def data(self) -> memoryview:
+        return self._data
+
+    @property
+    def sample_width(self) -> int:
+        return SAMPLE_FORMATS[self.dtype][1]
+
+    @property
+    def nbytes(self) -> int:
+        return self._data.nbytes
+
+    @property
+    def num_samples(self) -> int:
+        return self.nbytes // (self.sample_width * self.channels)
+
+    @property
+    def duration(self) -> float:
+        return self.num_samples / self.sample_rate
+
+    @property
+    def start_time(self) -> float:
+        return self.offset / self.sample_rate
+
+    @property
+    def audio(self) -> Any:
+        return self.numpy()
+
+    def memoryview(self) -> memoryview:
+        return self._data.cast(SAMPLE_FORMATS[self.dtype][0])
+
+    def numpy(self) -> Any:
+        import numpy as np
+
+        array = np.frombuffer(self._data, dtype=self.dtype)
+        return array.reshape(-1, self.channels) if self.channels > 1 else array
+
+    def tensor(self) -> Any:
+        import torch
+
+        return torch.from_numpy(self.numpy())
+
+    def tobytes(self) -> bytes:
+        return self._data.tobytes()
+
+    def to_wav(self) -> bytes:
+        return wav_header(self.sample_rate, self.dtype, self.channels, self.nbytes) + self.tobytes()
+
+    @classmethod
+    def from_wav(cls, data: Union[bytes, bytearray, memoryview], **kwargs: Any) -> "AudioChunk":
+        sample_rate, dtype, channels, start, end = parse_wav(data)
+        return cls(memoryview(data)[start:end], sample_rate, dtype=dtype, channels=channels, **kwargs)
+
+    @classmethod
+    def concat(cls, chunks: Iterable["AudioChunk"]) -> "AudioChunk":
+        chunks = list(chunks)
+        if not chunks:
+            raise ValueError("No chunks to concatenate")
+        first = chunks[0]
+        _check_compatible(first, chunks)
+        return cls(
+            b"".join(c.data for c in chunks),
+            first.sample_rate,
+            dtype=first.dtype,
+            channels=first.channels,
+            offset=first.offset,
+            elapsed=chunks[-1].elapsed,
+            text=" ".join(c.text for c in chunks if c.text) or None,
+        )
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+    def __bytes__(self) -> bytes:
+        return self.tobytes()
+
+    def __array__(self, dtype: Any = None, copy: Any = None) -> Any:
+        array = self.numpy()
+        return array if dtype is None else array.astype(dtype)
+
+    def __buffer__(self, flags: int) -> memoryview:
+        return self.memoryview()
+
+    def __reduce__(self) -> Any:
+        # Pickled as an array when numpy is around, so process pools can share the buffer
+        data = self.numpy() if "numpy" in sys.modules else self.tobytes()
+        state = (
+            self.sample_rate, self.dtype, self.channels, self.index,
+            self.offset, self.elapsed, self.text, self.metadata,
+        )
+        return (AudioChunk, (data, *state))
+
+    def __repr__(self) -> str:
+        return (
+            f"AudioChunk(index={self.index}, samples={self.num_samples}, "
+            f"sample_rate={self.sample_rate}, dtype={self.dtype}, duration={self.duration:.3f}s)"
+        )
+
+
+class ChunkStream:
+    # Numbers the chunks of one request and stamps their position and emission time
+    def __init__(self, sample_rate: int) -> None:
+        self.sample_rate = sample_rate
+        self.index = 0
+        self.samples = 0
+        self.started_at = time.perf_counter()
+
+    def chunk(self, audio: Any, text: Optional[str] = None, **metadata: Any) -> AudioChunk:
+        chunk = AudioChunk.from_array(
+            audio,
+            self.sample_rate,
+            index=self.index,
+            offset=self.samples,
+            elapsed=time.perf_counter() - self.started_at,
+            text=text,
+            metadata=metadata,
+        )
+        self.index += 1
+        self.samples += chunk.num_samples
+        return chunk
+
+
+def _check_compatible(first: AudioChunk, chunks: Iterable[AudioChunk]) -> None:
+    for chunk in chunks:
+        if (chunk.sample_rate, chunk.dtype, chunk.channels) != (
+            first.sample_rate, first.dtype, first.channels,
+        ):
+            raise ValueError("Chunks differ in sample rate, dtype or channel count")
+
+
+def wav_header(sample_rate: int, dtype: str, channels: int, data_size: int) -> bytes:
+    _, width, format_tag = SAMPLE_FORMATS[dtype]
+    block_align = width * channels
+    return (
+        b"RIFF"
+        + struct.pack("<I", 36 + data_size)
+        + b"WAVEfmt "
+        + struct.pack(
+            "<IHHIIHH",
+            16, format_tag, channels, sample_rate,
+            sample_rate * block_align, block_align, width * 8,
+        )
+        + b"data"
+        + struct.pack("<I", data_size)
+    )
+
+
+def parse_wav(data: Union[bytes, bytearray, memoryview]) -> tuple[int, str, int, int, int]:
+    # Returns (sample_rate, dtype, channels, data_start, data_end) without copying samples
+    view = memoryview(data)
+    if bytes(view[:4]) != b"RIFF" or bytes(view[8:12]) != b"WAVE":
+        raise ValueError("Not a WAV file")
+
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(view):
+        chunk_id = bytes(view[pos : pos + 4])
+        (size,) = struct.unpack("<I", view[pos + 4 : pos + 8])
+        body = pos + 8
+        if chunk_id == b"fmt ":
+            format_tag, channels, sample_rate = struct.unpack("<HHI", view[body : body + 8])
+            (bits,) = struct.unpack("<H", view[body + 14 : body + 16])
+            if format_tag == WAVE_FORMAT_EXTENSIBLE:
+                (format_tag,) = struct.unpack("<H", view[body + 24 : body + 26])
+            fmt = (format_tag, channels, sample_rate, bits)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("WAV data chunk before fmt chunk")
+            format_tag, channels, sample_rate, bits = fmt
+            for name, (_, width, tag) in SAMPLE_FORMATS.items():
+                if tag == format_tag and width * 8 == bits:
+                    # Streamed files may carry a placeholder size, so clamp to what is there
+                    return sample_rate, name, channels, body, min(body + size, len(view))
+            raise ValueError(f"Unsupported WAV format {format_tag} with {bits} bits")
+        pos = body + size + (size & 1)
+
+    raise ValueError("WAV file has no data chunk")
+
+
+def write_wav(file: Union[str, BinaryIO], chunks: Iterable[AudioChunk]) -> int:
+    # Writes each chunk's buffer directly and fixes up the sizes at the end
+    if isinstance(file, str):
+        with open(file, "wb") as f:
+            return write_wav(f, chunks)
+
+    first = None
+    data_size = 0
+    start = file.tell()
+    for chunk in chunks:
+        if first is None:
+            first = chunk
+            file.write(wav_header(chunk.sample_rate, chunk.dtype, chunk.channels, 0))
+        else:
+            _check_compatible(first, [chunk])
+        file.write(chunk.data)
+        data_size += chunk.nbytes
+
+    if first is None:
+        raise ValueError("No chunks to write")
+
+    end = file.tell()
+    file.seek(start)
+    file.write(wav_header(first.sample_rate, first.dtype, first.channels, data_size))
+    file.seek(end)
+    return data_size
@@ -20,5 +20,8 @@ class BaseAudioModel(ABC):
     def is_loaded(self) -> bool:
         return self._loaded
 
+    def warmup(self, voices: Any = None) -> None:
+        pass
+
     def unload(self) -> None:
         self._loaded = False
@@ -2,7 +2,9 @@ import hashlib
 import json
 import time
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Iterable, Optional
+
+from .audio import AudioChunk, write_wav
 
 
 class VocoCache:
@@ -97,6 +99,22 @@ class VocoCache:
         cache_path.parent.mkdir(parents=True, exist_ok=True)
         cache_path.write_bytes(audio)
 
+    def get_chunk(self, model: str, text: str, **params: Any) -> Optional[AudioChunk]:
+        # Streamed results are stored under their own key, so a hit can be replayed as chunks
+        audio = self.get(model, text, _stream=True, **params)
+        return AudioChunk.from_wav(audio, text=text) if audio is not None else None
+
+    def put_chunks(
+        self, model: str, text: str, chunks: Iterable[AudioChunk], **params: Any
+    ) -> None:
+        self._check_and_warn()
+
+        key = self._make_key(model, text, {"_stream": True, **params})
+        cache_path = self._get_cache_path(model, key)
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(cache_path, "wb") as f:
+            write_wav(f, chunks)
+
     def clear(self, model: Optional[str] = None) -> None:
         if model:
             model_dir = self.cache_dir / model
@@ -0,0 +1,221 @@
+import bisect
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator, Optional
+
+# Histogram bucket upper bounds: quarter powers of two from ~8us to ~17min, which also covers
+# ratios. Neighbouring bounds are 19% apart, and percentiles interpolate within a bucket.
+BUCKETS = tuple(2.0 ** (k / 4) for k in range(-68, 41))
+
+SPAN = "span"
+COUNTER = "counter"
+VALUE = "value"
+
+_tags: contextvars.ContextVar[dict[str, Any]] = contextvars.ContextVar("voco_tags", default={})
+_sinks: list[Callable[["Event"], None]] = []
+_sinks_lock = threading.Lock()
+
+
+@dataclass
+class Event:
+    kind: str
+    name: str
+    value: float
+    tags: dict[str, Any] = field(default_factory=dict)
+    timestamp: float = field(default_factory=time.time)
+
+
+def add_sink(sink: Callable[[Event], None]) -> Callable[[Event], None]:
+    # Sinks are any callable taking an Event; the list is replaced, never mutated,
+    # so emitting needs no lock
+    global _sinks
+    with _sinks_lock:
+        _sinks = [*_sinks, sink]
+    return sink
+
+
+def remove_sink(sink: Callable[[Event], None]) -> None:
+    global _sinks
+    with _sinks_lock:
+        _sinks = [s for s in _sinks if s is not sink]
+
+
+def clear_sinks() -> None:
+    global _sinks
+    with _sinks_lock:
+        _sinks = []
+
+
+def enabled() -> bool:
+    return bool(_sinks)
+
+
+def emit(kind: str, name: str, value: float, **tags: Any) -> None:
+    sinks = _sinks
+    if not sinks:
+        return
+    event = Event(kind, name, value, {**_tags.get(), **tags})
+    for sink in sinks:
+        sink(event)
+
+
+def record(stage: str, seconds: float, **tags: Any) -> None:
+    emit(SPAN, stage, seconds, **tags)
+
+
+def count(name: str, value: float = 1, **tags: Any) -> None:
+    emit(COUNTER, name, value, **tags)
+
+
+def observe(name: str, value: float, **tags: Any) -> None:
+    emit(VALUE, name, value, **tags)
+
+
+@contextmanager
+def span(stage: str, **tags: Any) -> Iterator[None]:
+    if not _sinks:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start, **tags)
+
+
+@contextmanager
+def tags(**values: Any) -> Iterator[None]:
+    # Added to every event emitted in this context, e.g. the model alias of a request
+    token = _tags.set({**_tags.get(), **values})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+def current_tags() -> dict[str, Any]:
+    return dict(_tags.get())
+
+
+def bind(fn: Callable[..., Any]) -> Callable[..., Any]:
+    # Threads do not inherit context variables; run their target in the caller's context
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def measure_stream(result: Iterator[Any], start: float, **request_tags: Any) -> Iterator[Any]:
+    """Pass a stream through, reporting time to first chunk, total time and real-time factor"""
+    first = None
+    audio_seconds = 0.0
+    chunks = 0
+    try:
+        while True:
+            with tags(**request_tags):
+                try:
+                    item = next(result)
+                except StopIteration:
+                    break
+            if first is None:
+                first = time.perf_counter() - start
+                observe("ttfc", first, **request_tags)
+            chunks += 1
+            audio_seconds += getattr(item, "duration", 0.0)
+            yield item
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+        elapsed = time.perf_counter() - start
+        record("request", elapsed, **request_tags)
+        count("chunks", chunks, **request_tags)
+        if audio_seconds > 0:
+            observe("audio_seconds", audio_seconds, **request_tags)
+            observe("rtf", elapsed / audio_seconds, **request_tags)
+
+
+class Histogram:
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float) -> None:
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, q: float) -> float:
+        # Linear within the bucket holding the q-th value, whose bounds are clamped to what
+        # was observed
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, n in enumerate(self.buckets):
+            if n and seen + n >= rank:
+                lower = max(BUCKETS[index - 1] if index else self.min, self.min)
+                upper = min(BUCKETS[index] if index < len(BUCKETS) else self.max, self.max)
+                return lower + (upper - lower) * max(rank - seen, 0) / n
+            seen += n
+        return self.max
+
+    def summary(self) -> dict[str, Any]:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count,
+            "min": self.min,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+
+class MetricsSink:
+    """Aggregates events in memory into per-stage histograms and counter totals.
+
+    Events are grouped by name and the tag given by `group_by` (the model alias by default).
+    """
+
+    def __init__(self, group_by: Optional[str] = "model") -> None:
+        self.group_by = group_by
+        self._lock = threading.Lock()
+        self._histograms: dict[tuple[str, str, Any], Histogram] = {}
+        self._counters: dict[tuple[str, Any], float] = {}
+
+    def __call__(self, event: Event) -> None:
+        group = event.tags.get(self.group_by) if self.group_by else None
+        with self._lock:
+            if event.kind == COUNTER:
+                key = (event.name, group)
+                self._counters[key] = self._counters.get(key, 0) + event.value
+                return
+            key = (event.kind, event.name, group)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.add(event.value)
+
+    def report(self) -> dict[str, Any]:
+        report: dict[str, Any] = {}
+        with self._lock:
+            for (kind, name, group), histogram in self._histograms.items():
+                section = "stages" if kind == SPAN else "values"
+                report.setdefault(group, {}).setdefault(section, {})[name] = histogram.summary()
+            for (name, group), total in self._counters.items():
+                report.setdefault(group, {}).setdefault("counters", {})[name] = total
+        return report
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
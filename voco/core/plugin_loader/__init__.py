@@ -1,19 +1,96 @@
-from importlib.metadata import entry_points
+import threading
+import time
+from importlib.metadata import EntryPoint, entry_points
+from typing import Any, Optional
 
+PLUGIN_GROUP = "voco.plugins"
+
+_ENTRY_POINTS: dict[str, EntryPoint] = {}
+_DIAGNOSTICS: dict[str, dict[str, Any]] = {}
+_discovered = False
+_lock = threading.RLock()
+
+
+class PluginLoadError(Exception):
+    pass
+
+
+def discover_plugins(refresh: bool = False) -> list[str]:
+    # Only reads package metadata; plugins are imported on first use by load_plugin
+    global _discovered
+    with _lock:
+        if _discovered and not refresh:
+            return list(_ENTRY_POINTS.keys())
+
+        eps = entry_points()
+        if hasattr(eps, "select"):
+            group = eps.select(group=PLUGIN_GROUP)
+        else:
+            group = eps.get(PLUGIN_GROUP, [])
+
+        for ep in group:
+            _ENTRY_POINTS[ep.name] = ep
+            _DIAGNOSTICS.setdefault(
+                ep.name,
+                {"entry_point": ep.value, "loaded": False, "import_seconds": None, "error": None},
+            )
+        _discovered = True
+
+        return list(_ENTRY_POINTS.keys())
+
+
+def available_plugins() -> list[str]:
+    return discover_plugins()
 
-def discover_plugins() -> list[str]:
-    loaded = []
-    eps = entry_points()
-    group = eps.select(group="voco.plugins") if hasattr(eps, "select") else eps.get("voco.plugins", [])
 
-    for ep in group:
+def load_plugin(name: str) -> bool:
+    discover_plugins()
+    with _lock:
+        if name not in _ENTRY_POINTS:
+            return False
+
+        info = _DIAGNOSTICS[name]
+        if info["loaded"]:
+            return True
+
+        start = time.perf_counter()
         try:
-            ep.load()
-            loaded.append(ep.name)
-        except Exception:
-            pass
+            _ENTRY_POINTS[name].load()
+        except Exception as e:
+            info["error"] = f"{type(e).__name__}: {e}"
+            raise PluginLoadError(f"Plugin '{name}' failed to import: {info['error']}") from e
+        finally:
+            info["import_seconds"] = round(time.perf_counter() - start, 3)
+
+        info["loaded"] = True
+        info["error"] = None
+        return True
+
 
+def load_all_plugins() -> list[str]:
+    loaded = []
+    for name in discover_plugins():
+        try:
+            load_plugin(name)
+            loaded.append(name)
+        except PluginLoadError:
+            pass
     return loaded
 
 
-__all__ = ["discover_plugins"]
+def get_plugin_diagnostics(name: Optional[str] = None) -> dict[str, Any]:
+    discover_plugins()
+    with _lock:
+        if name is not None:
+            return dict(_DIAGNOSTICS.get(name, {}))
+        return {plugin: dict(info) for plugin, info in _DIAGNOSTICS.items()}
+
+
+__all__ = [
+    "PluginLoadError",
+    "available_plugins",
+    "discover_plugins",
+    "get_plugin_diagnostics",
+    "load_all_plugins",
+    "load_plugin",
+]
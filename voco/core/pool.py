@@ -0,0 +1,375 @@
+import io
+import multiprocessing as mp
+import os
+import pickle
+import queue
+import sys
+import traceback
+from collections import deque
+from multiprocessing import shared_memory
+from typing import Any, Iterator, Optional
+
+from .base_model import BaseAudioModel
+from .device import get_device, normalize_device_string
+from .registry import load as registry_load
+
+# Arrays smaller than this are cheaper to pickle inline than to route through shared memory
+MIN_SHARED_BYTES = 4096
+
+
+class PoolWorkerError(Exception):
+    pass
+
+
+def _array_bytes(obj: Any) -> Optional[tuple[str, str, tuple[int, ...], memoryview]]:
+    # Checked through sys.modules so neither numpy nor torch is imported just for this
+    np = sys.modules.get("numpy")
+    if np is not None and type(obj) is np.ndarray and obj.dtype.kind in "biuf":
+        data = np.ascontiguousarray(obj)
+        return "numpy", data.dtype.str, data.shape, memoryview(data).cast("B")
+
+    torch = sys.modules.get("torch")
+    if torch is not None and isinstance(obj, torch.Tensor) and obj.layout == torch.strided:
+        data = obj.detach().cpu().contiguous()
+        dtype = str(data.dtype).replace("torch.", "")
+        raw = data.view(-1).view(torch.uint8).numpy()
+        return "torch", dtype, tuple(data.shape), memoryview(raw).cast("B")
+
+    return None
+
+
+class _SharedRing:
+    # Worker-side allocator over the shared buffer. Regions are released in the order
+    # they were written, once the parent acknowledges the message that carried them.
+    def __init__(self, buf: memoryview) -> None:
+        self.buf = buf
+        self.capacity = len(buf)
+        self._head = 0
+        self._regions: deque[tuple[int, int]] = deque()
+
+    def try_alloc(self, size: int) -> Optional[int]:
+        if not self._regions:
+            self._head = 0
+            offset = 0 if size <= self.capacity else None
+        else:
+            tail = self._regions[0][0]
+            if self._head > tail:
+                # Free space is [head, capacity) followed by [0, tail)
+                if self._head + size <= self.capacity:
+                    offset = self._head
+                elif size <= tail:
+                    offset = 0
+                else:
+                    offset = None
+            else:
+                offset = self._head if self._head + size <= tail else None
+
+        if offset is not None:
+            self._regions.append((offset, size))
+            self._head = offset + size
+        return offset
+
+    def release(self, count: int) -> None:
+        for _ in range(count):
+            self._regions.popleft()
+
+
+class _SharedPickler(pickle.Pickler):
+    def __init__(self, file: io.BytesIO, ring: _SharedRing, wait_for_space) -> None:
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.ring = ring
+        self.wait_for_space = wait_for_space
+        self.regions = 0
+
+    def persistent_id(self, obj: Any) -> Any:
+        parts = _array_bytes(obj)
+        if parts is None or parts[3].nbytes < MIN_SHARED_BYTES:
+            return None
+        if parts[3].nbytes > self.ring.capacity:
+            return None
+
+        kind, dtype, shape, data = parts
+        offset = self.ring.try_alloc(data.nbytes)
+        while offset is None:
+            # Pickled inline when nothing in flight can free enough space
+            if not self.wait_for_space():
+                return None
+            offset = self.ring.try_alloc(data.nbytes)
+
+        self.ring.buf[offset : offset + data.nbytes] = data
+        self.regions += 1
+        return ("shm", kind, dtype, shape, offset, data.nbytes)
+
+
+class _SharedUnpickler(pickle.Unpickler):
+    def __init__(self, file: io.BytesIO, buf: memoryview) -> None:
+        super().__init__(file)
+        self.buf = buf
+
+    def persistent_load(self, pid: Any) -> Any:
+        _, kind, dtype, shape, offset, nbytes = pid
+        data = self.buf[offset : offset + nbytes]
+        # One copy out of the shared buffer, so the region can be reused right away
+        if kind == "numpy":
+            import numpy as np
+
+            return np.frombuffer(data, dtype=np.dtype(dtype)).reshape(shape).copy()
+
+        import torch
+
+        raw = torch.frombuffer(data, dtype=torch.uint8).clone()
+        return raw.view(getattr(torch, dtype)).reshape(shape)
+
+
+class _Worker:
+    def __init__(self, model: BaseAudioModel, conn: Any, shm: Any) -> None:
+        self.model = model
+        self.conn = conn
+        self.ring = _SharedRing(shm.buf)
+        self.pending_acks: deque[int] = deque()
+        self.cancelled = False
+
+    def _handle(self, message: tuple) -> None:
+        kind = message[0]
+        if kind == "ack":
+            self.ring.release(self.pending_acks.popleft())
+        elif kind == "cancel":
+            self.cancelled = True
+
+    def _wait_for_space(self) -> bool:
+        if not self.pending_acks:
+            return False
+        self._handle(self.conn.recv())
+        return True
+
+    def _send(self, kind: str, obj: Any) -> None:
+        buffer = io.BytesIO()
+        pickler = _SharedPickler(buffer, self.ring, self._wait_for_space)
+        pickler.dump(obj)
+        self.pending_acks.append(pickler.regions)
+        self.conn.send((kind, buffer.getvalue()))
+
+    def _run(self, method: str, args: tuple, kwargs: dict) -> None:
+        self.cancelled = False
+        result = getattr(self.model, method)(*args, **kwargs)
+        if not hasattr(result, "__next__"):
+            self._send("result", result)
+            return
+
+        try:
+            for item in result:
+                self._send("item", item)
+                while self.conn.poll():
+                    self._handle(self.conn.recv())
+                if self.cancelled:
+                    break
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        self.conn.send(("done", None))
+
+    def serve(self) -> None:
+        self.conn.send(("ready", os.getpid()))
+        while True:
+            try:
+                message = self.conn.recv()
+            except EOFError:
+                break
+
+            kind = message[0]
+            if kind == "stop":
+                break
+            if kind in ("ack", "cancel"):
+                # Late acknowledgements of a finished request
+                self._handle(message)
+                continue
+
+            _, method, args, kwargs = message
+            try:
+                self._run(method, args, kwargs)
+            except Exception as e:
+                self.conn.send(("error", f"{type(e).__name__}: {e}\n{traceback.format_exc()}"))
+
+            # The parent acknowledges every message before it releases the worker
+            while self.pending_acks:
+                self._handle(self.conn.recv())
+
+
+def _worker_main(model: BaseAudioModel, conn: Any, shm: Any, num_threads: int) -> None:
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(num_threads)
+    _Worker(model, conn, shm).serve()
+
+
+class ModelPool(BaseAudioModel):
+    def __init__(
+        self,
+        name: str,
+        workers: int = 2,
+        device: Optional[str] = None,
+        dtype: Optional[str] = None,
+        threads_per_worker: Optional[int] = None,
+        shm_size_mb: int = 64,
+        **kwargs: Any,
+    ) -> None:
+        # dtype stays None until load() when the driver picks its own default
+        super().__init__(device=get_device(device), dtype=dtype, **kwargs)
+        if workers < 1:
+            raise ValueError("A model pool needs at least one worker")
+        if normalize_device_string(self.device) != "cpu":
+            # CUDA and MPS cannot be used again in a forked child once the parent has touched them
+            raise ValueError(
+                f"ModelPool only supports device='cpu', got '{self.device}'. "
+                "Load GPU models without workers."
+            )
+        if "fork" not in mp.get_all_start_methods():
+            raise RuntimeError("ModelPool requires the 'fork' start method to share weights")
+
+        self.name = name
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+        self.shm_size = shm_size_mb * 1024 * 1024
+
+        self.model: Optional[BaseAudioModel] = None
+        self._ctx = mp.get_context("fork")
+        self._procs: list[Any] = []
+        self._conns: list[Any] = []
+        self._shms: list[Any] = []
+        self._idle: queue.Queue[int] = queue.Queue()
+
+    def load(self) -> None:
+        # Weights are loaded once here; forked workers share those pages copy-on-write
+        self.model = registry_load(
+            self.name, device=self.device, dtype=self.dtype, auto_load=True, **self.config
+        )
+        self.dtype = self.model.dtype
+        for index in range(self.workers):
+            self._procs.append(None)
+            self._conns.append(None)
+            self._shms.append(shared_memory.SharedMemory(create=True, size=self.shm_size))
+            self._spawn(index)
+            self._idle.put(index)
+        self._loaded = True
+
+    def _spawn(self, index: int) -> None:
+        parent_conn, child_conn = self._ctx.Pipe()
+        proc = self._ctx.Process(
+            target=_worker_main,
+            args=(self.model, child_conn, self._shms[index], self.threads_per_worker),
+            name=f"voco-{self.name}-{index}",
+            daemon=True,
+        )
+        proc.start()
+        child_conn.close()
+
+        kind, payload = parent_conn.recv()
+        if kind != "ready":
+            raise PoolWorkerError(f"Worker {index} failed to start: {payload}")
+        self._procs[index] = proc
+        self._conns[index] = parent_conn
+
+    def _receive(self, index: int) -> tuple[str, Any]:
+        try:
+            kind, payload = self._conns[index].recv()
+        except (EOFError, OSError) as e:
+            # Replace the dead worker so the pool keeps its size
+            self._spawn(index)
+            raise PoolWorkerError(f"Worker {index} of '{self.name}' exited unexpectedly") from e
+
+        if kind in ("item", "result"):
+            obj = _SharedUnpickler(io.BytesIO(payload), self._shms[index].buf).load()
+            self._conns[index].send(("ack", None))
+            return kind, obj
+        return kind, payload
+
+    def _call(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        if not self._loaded:
+            raise RuntimeError("Model not loaded. Call load() first.")
+
+        index = self._idle.get()
+        try:
+            self._conns[index].send(("call", method, args, kwargs))
+            kind, payload = self._receive(index)
+        except BaseException:
+            self._idle.put(index)
+            raise
+
+        if kind == "result":
+            self._idle.put(index)
+            return payload
+        if kind == "error":
+            self._idle.put(index)
+            raise PoolWorkerError(payload)
+        return self._stream(index, kind, payload)
+
+    def _stream(self, index: int, kind: str, payload: Any) -> Iterator[Any]:
+        finished = False
+        try:
+            while kind == "item":
+                yield payload
+                kind, payload = self._receive(index)
+            finished = True
+            if kind == "error":
+                raise PoolWorkerError(payload)
+        finally:
+            if not finished:
+                # The caller stopped early: cancel and drain so the worker is reusable
+                try:
+                    self._conns[index].send(("cancel", None))
+                    while kind == "item":
+                        kind, payload = self._receive(index)
+                except PoolWorkerError:
+                    pass
+            self._idle.put(index)
+
+    def generate(self, *args: Any, **kwargs: Any) -> Any:
+        return self._call("generate", *args, **kwargs)
+
+    def warmup(self, voices: Any = None) -> None:
+        # Every worker warms its own copy-on-write state (caches, compiled graphs)
+        indices = [self._idle.get() for _ in range(self.workers)]
+        try:
+            for index in indices:
+                self._conns[index].send(("call", "warmup", (), {"voices": voices}))
+            for index in indices:
+                kind, payload = self._receive(index)
+                if kind == "error":
+                    raise PoolWorkerError(payload)
+        finally:
+            for index in indices:
+                self._idle.put(index)
+
+    def unload(self) -> None:
+        for conn, proc in zip(self._conns, self._procs):
+            if conn is None:
+                continue
+            try:
+                conn.send(("stop", None))
+            except OSError:
+                pass
+            proc.join(timeout=10)
+            if proc.is_alive():
+                proc.terminate()
+            conn.close()
+
+        for shm in self._shms:
+            shm.close()
+            shm.unlink()
+
+        self._procs, self._conns, self._shms = [], [], []
+        self._idle = queue.Queue()
+        if self.model is not None:
+            self.model.unload()
+            self.model = None
+        self._loaded = False
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "model": self.name,
+            "workers": self.workers,
+            "idle_workers": self._idle.qsize(),
+            "threads_per_worker": self.threads_per_worker,
+            "pids": [p.pid for p in self._procs if p is not None],
+            "shm_size_mb": self.shm_size // 1024 // 1024,
+        }
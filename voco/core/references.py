@@ -0,0 +1,239 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Optional, Union
+
+AudioSource = Union[str, Path, bytes]
+
+
+class VoiceNotFoundError(Exception):
+    pass
+
+
+@dataclass
+class ReferencePrompt:
+    key: str
+    codes: Any
+    text: str
+
+
+class ReferenceStore:
+    def __init__(
+        self,
+        namespace: str,
+        cache_dir: str = "~/.voco/references",
+        persist: bool = False,
+        loader: Optional[Callable[[Any], Any]] = None,
+        max_entries: Optional[int] = None,
+        max_disk_mb: Optional[int] = 256,
+    ) -> None:
+        # The namespace should identify the codec, since codes from another codec are not valid
+        self.namespace = namespace
+        self.cache_dir = Path(cache_dir).expanduser() / namespace
+        self.persist = persist
+        self.loader = loader
+        self.max_entries = max_entries
+        self.max_disk_size = max_disk_mb * 1024 * 1024 if max_disk_mb is not None else None
+        self._lock = threading.Lock()
+
+        # Least recently used first; named voices are never evicted
+        self._prompts: OrderedDict[str, ReferencePrompt] = OrderedDict()
+        self._voices: dict[str, str] = {}
+        self._path_keys: OrderedDict[tuple[str, int, int, str], str] = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._encodes = 0
+
+        if persist:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def make_key(self, audio: AudioSource, text: str) -> str:
+        if isinstance(audio, bytes):
+            digest = hashlib.sha256(audio)
+        else:
+            path = Path(audio).expanduser().resolve()
+            st = path.stat()
+            # Hashing is cheap next to encoding, but skip it while the file is unchanged
+            path_key = (str(path), st.st_mtime_ns, st.st_size, text)
+            with self._lock:
+                if path_key in self._path_keys:
+                    self._path_keys.move_to_end(path_key)
+                    return self._path_keys[path_key]
+
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+
+        digest.update(b"\0")
+        digest.update(text.encode())
+        key = digest.hexdigest()
+
+        if not isinstance(audio, bytes):
+            with self._lock:
+                self._path_keys[path_key] = key
+                if self.max_entries is not None and len(self._path_keys) > self.max_entries:
+                    self._path_keys.popitem(last=False)
+        return key
+
+    def _add(self, prompt: ReferencePrompt) -> None:
+        # Called with the lock held
+        self._prompts[prompt.key] = prompt
+        if self.max_entries is None:
+            return
+
+        pinned = set(self._voices.values())
+        for key in list(self._prompts):
+            if len(self._prompts) <= self.max_entries:
+                break
+            # Evicted prompts are reloaded from disk when persisted, or encoded again
+            if key not in pinned and key != prompt.key:
+                del self._prompts[key]
+
+    def _get_cache_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.npy"
+
+    def _load(self, key: str) -> Optional[Any]:
+        cache_path = self._get_cache_path(key)
+        if not self.persist or not cache_path.exists():
+            return None
+
+        import numpy as np
+
+        try:
+            codes = np.load(cache_path)
+            # The modification time orders files for pruning, so mark this one as recently used
+            os.utime(cache_path)
+        except FileNotFoundError:
+            # Pruned by another store sharing the directory
+            return None
+        return self.loader(codes) if self.loader is not None else codes
+
+    def _save(self, key: str, codes: Any) -> None:
+        import numpy as np
+
+        if hasattr(codes, "cpu"):
+            codes = codes.detach().cpu().numpy()
+
+        cache_path = self._get_cache_path(key)
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.asarray(codes))
+        os.replace(tmp_path, cache_path)
+        self._prune_disk()
+
+    def _prune_disk(self) -> None:
+        # Other processes may share the directory, so files can vanish while pruning
+        if self.max_disk_size is None:
+            return
+        files = []
+        for file in self.cache_dir.glob("*.npy"):
+            try:
+                st = file.stat()
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, file))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, file in sorted(files):
+            if total <= self.max_disk_size:
+                break
+            file.unlink(missing_ok=True)
+            total -= size
+
+    def get(self, audio: AudioSource, text: str) -> Optional[ReferencePrompt]:
+        return self._lookup(self.make_key(audio, text), text)
+
+    def _lookup(self, key: str, text: str) -> Optional[ReferencePrompt]:
+        with self._lock:
+            if key in self._prompts:
+                self._hits += 1
+                self._prompts.move_to_end(key)
+                return self._prompts[key]
+
+        codes = self._load(key)
+        with self._lock:
+            if codes is None:
+                self._misses += 1
+                return None
+
+            self._hits += 1
+            prompt = ReferencePrompt(key=key, codes=codes, text=text)
+            self._add(prompt)
+            return prompt
+
+    def get_or_encode(
+        self,
+        audio: AudioSource,
+        text: str,
+        encode: Callable[[AudioSource], Any],
+    ) -> ReferencePrompt:
+        key = self.make_key(audio, text)
+        prompt = self._lookup(key, text)
+        if prompt is not None:
+            return prompt
+
+        # Encoded outside the lock; concurrent misses for one reference may both encode it
+        codes = encode(audio)
+        if self.persist:
+            self._save(key, codes)
+
+        prompt = ReferencePrompt(key=key, codes=codes, text=text)
+        with self._lock:
+            self._encodes += 1
+            self._add(prompt)
+        return prompt
+
+    def register_voice(
+        self,
+        name: str,
+        audio: AudioSource,
+        text: str,
+        encode: Callable[[AudioSource], Any],
+    ) -> ReferencePrompt:
+        prompt = self.get_or_encode(audio, text, encode)
+        with self._lock:
+            self._voices[name] = prompt.key
+            # Pinned again in case it was evicted while other references were added
+            self._prompts[prompt.key] = prompt
+        return prompt
+
+    def get_voice(self, name: str) -> ReferencePrompt:
+        with self._lock:
+            if name not in self._voices:
+                available = ", ".join(self._voices.keys()) or "none"
+                raise VoiceNotFoundError(
+                    f"Voice '{name}' is not registered. Available voices: {available}"
+                )
+            return self._prompts[self._voices[name]]
+
+    def list_voices(self) -> list[str]:
+        return list(self._voices.keys())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._prompts.clear()
+            self._voices.clear()
+            self._path_keys.clear()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "namespace": self.namespace,
+                "entries": len(self._prompts),
+                "max_entries": self.max_entries,
+                "voices": len(self._voices),
+                "hits": self._hits,
+                "misses": self._misses,
+                "encodes": self._encodes,
+                "persist": self.persist,
+            }
+
+    def __len__(self) -> int:
+        return len(self._prompts)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._voices
@@ -1,7 +1,8 @@
 from typing import Any
 
 from .base_model import BaseAudioModel
-from .device import get_device, get_dtype
+from .device import get_device
+from .plugin_loader import available_plugins, load_all_plugins, load_plugin
 
 _MODEL_REGISTRY: dict[str, type[BaseAudioModel]] = {}
 
@@ -35,6 +36,13 @@ def get_registered_models() -> dict[str, type[BaseAudioModel]]:
     return _MODEL_REGISTRY.copy()
 
 
+def get_available_models() -> list[str]:
+    # Registered models plus installed plugins that have not been imported yet
+    names = list(_MODEL_REGISTRY.keys())
+    names.extend(name for name in available_plugins() if name not in _MODEL_REGISTRY)
+    return names
+
+
 def is_registered(name: str) -> bool:
     return name in _MODEL_REGISTRY
 
@@ -46,15 +54,20 @@ def load(
     auto_load: bool = True,
     **kwargs: Any,
 ) -> BaseAudioModel:
+    if name not in _MODEL_REGISTRY and not load_plugin(name):
+        # A plugin may register models under names other than its entry point
+        load_all_plugins()
     if name not in _MODEL_REGISTRY:
-        available = ", ".join(_MODEL_REGISTRY.keys()) or "none"
+        available = ", ".join(get_available_models()) or "none"
         raise ModelNotFoundError(
             f"Model '{name}' not found in registry. Available models: {available}"
         )
     model_cls = _MODEL_REGISTRY[name]
     device = get_device(device)
-    dtype = get_dtype(dtype)
-    model = model_cls(device=device, dtype=dtype, **kwargs)
+    if dtype:
+        kwargs["dtype"] = dtype
+    # Without a dtype, each driver uses its own default precision
+    model = model_cls(device=device, **kwargs)
     if auto_load:
         model.load()
     return model
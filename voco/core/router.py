@@ -1,8 +1,28 @@
-from typing import Any, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Iterator, Optional, Union
 
+from . import instrumentation
+from .audio import AudioChunk
 from .base_model import BaseAudioModel
 from .cache import VocoCache
+from .pool import ModelPool
 from .registry import load as registry_load
+from .warmup import (
+    FAILED,
+    LOADING,
+    READY,
+    WARMING,
+    WarmupError,
+    WarmupManifest,
+    WarmupModel,
+    WarmupStatus,
+    load_manifest,
+    run_prompt,
+)
+from .weights import get_weight_store
 
 
 class ModelNotLoadedError(Exception):
@@ -17,6 +37,10 @@ class AudioRouter:
     ) -> None:
         self._models: dict[str, BaseAudioModel] = {}
         self._cache: Optional[VocoCache] = None
+        self._lock = threading.Lock()
+        # Aliases whose model is still loading, reserved so a second load fails fast
+        self._loading: set[str] = set()
+        self._warmup_status: dict[str, WarmupStatus] = {}
 
         if cache:
             config = cache_config or {}
@@ -32,17 +56,30 @@ class AudioRouter:
         alias: str | None = None,
         device: str | None = None,
         dtype: str | None = None,
+        workers: int | None = None,
         **kwargs: Any,
     ) -> BaseAudioModel:
         if alias is None:
             alias = name
-        if alias in self._models:
-            raise ValueError(
-                f"Alias '{alias}' is already in use. "
-                f"Use unload('{alias}') first or choose a different alias."
-            )
-        model = registry_load(name=name, device=device, dtype=dtype, auto_load=True, **kwargs)
-        self._models[alias] = model
+        with self._lock:
+            if alias in self._models or alias in self._loading:
+                raise ValueError(
+                    f"Alias '{alias}' is already in use. "
+                    f"Use unload('{alias}') first or choose a different alias."
+                )
+            self._loading.add(alias)
+        try:
+            if workers:
+                # Serve from forked worker processes that share the parent's weights
+                model = ModelPool(name, workers=workers, device=device, dtype=dtype, **kwargs)
+                model.load()
+            else:
+                model = registry_load(name=name, device=device, dtype=dtype, auto_load=True, **kwargs)
+            with self._lock:
+                self._models[alias] = model
+        finally:
+            with self._lock:
+                self._loading.discard(alias)
         return model
 
     def infer(self, alias: str, *args: Any, **kwargs: Any) -> Any:
@@ -52,23 +89,73 @@ class AudioRouter:
                 f"Model alias '{alias}' not found. Available aliases: {available}"
             )
 
+        start = time.perf_counter()
         use_cache = kwargs.pop("cache", True)
+        # Applied after the cache, so one cached entry serves every output rate
+        sample_rate = kwargs.pop("sample_rate", None)
         text = kwargs.get("text", "")
 
+        cache_params = {k: v for k, v in kwargs.items() if k != "text"}
         if self._cache and use_cache and text:
-            cache_params = {k: v for k, v in kwargs.items() if k != "text"}
-            cached = self._cache.get(alias, text, **cache_params)
-            if cached:
-                return cached
+            with instrumentation.span("cache_lookup", model=alias):
+                chunk = self._cache.get_chunk(alias, text, **cache_params)
+                cached = None if chunk is not None else self._cache.get(alias, text, **cache_params)
+            if chunk is not None or cached:
+                instrumentation.count("cache_hits", model=alias)
+                result = iter([chunk]) if chunk is not None else cached
+                return self._finish(alias, self._convert_rate(result, sample_rate), start)
+            instrumentation.count("cache_misses", model=alias)
+
+        with instrumentation.tags(model=alias):
+            result = self._models[alias].generate(*args, **kwargs)
 
-        result = self._models[alias].generate(*args, **kwargs)
+        if self._cache and use_cache and text:
+            if isinstance(result, bytes):
+                self._cache.put(alias, text, result, **cache_params)
+            elif hasattr(result, "__next__"):
+                result = self._cache_stream(alias, text, cache_params, result)
 
-        if self._cache and use_cache and text and isinstance(result, bytes):
-            cache_params = {k: v for k, v in kwargs.items() if k != "text"}
-            self._cache.put(alias, text, result, **cache_params)
+        return self._finish(alias, self._convert_rate(result, sample_rate), start)
 
+    def _finish(self, alias: str, result: Any, start: float) -> Any:
+        if not instrumentation.enabled():
+            return result
+        if hasattr(result, "__next__"):
+            # Time to first chunk and real-time factor are measured as the caller consumes it
+            return instrumentation.measure_stream(result, start, model=alias)
+        instrumentation.record("request", time.perf_counter() - start, model=alias)
         return result
 
+    def _convert_rate(self, result: Any, sample_rate: Optional[int]) -> Any:
+        if sample_rate is None:
+            return result
+
+        from ..utils.audio_utils import resample_stream
+
+        if isinstance(result, bytes):
+            chunk = AudioChunk.from_wav(result)
+            if chunk.sample_rate == sample_rate:
+                return result
+            return AudioChunk.concat(resample_stream([chunk], sample_rate)).to_wav()
+        if hasattr(result, "__next__"):
+            return resample_stream(result, sample_rate)
+        return result
+
+    def _cache_stream(
+        self, alias: str, text: str, cache_params: dict[str, Any], result: Iterator[Any]
+    ) -> Iterator[Any]:
+        # Chunks are passed through as they arrive and stored once the stream completes
+        chunks = []
+        cacheable = True
+        for item in result:
+            if isinstance(item, AudioChunk):
+                chunks.append(item)
+            else:
+                cacheable = False
+            yield item
+        if cacheable and chunks:
+            self._cache.put_chunks(alias, text, chunks, **cache_params)
+
     def get_model(self, alias: str) -> BaseAudioModel:
         if alias not in self._models:
             raise ModelNotLoadedError(f"Model alias '{alias}' not found")
@@ -79,11 +166,13 @@ class AudioRouter:
             raise ModelNotLoadedError(f"Model alias '{alias}' not found")
         self._models[alias].unload()
         del self._models[alias]
+        self._warmup_status.pop(alias, None)
 
     def unload_all(self) -> None:
         for model in self._models.values():
             model.unload()
         self._models.clear()
+        self._warmup_status.clear()
 
     def list_loaded(self) -> dict[str, BaseAudioModel]:
         return self._models.copy()
@@ -91,6 +180,76 @@ class AudioRouter:
     def is_loaded(self, alias: str) -> bool:
         return alias in self._models
 
+    def weight_stats(self) -> dict[str, Any]:
+        return get_weight_store().stats()
+
+    def warmup(
+        self,
+        manifest: Union[WarmupManifest, dict[str, Any], str, Path],
+        max_workers: Optional[int] = None,
+        wait: bool = True,
+        raise_on_error: bool = False,
+    ) -> dict[str, WarmupStatus]:
+        manifest = load_manifest(manifest)
+        for entry in manifest.models:
+            self._warmup_status[entry.alias] = WarmupStatus(alias=entry.alias, name=entry.name)
+
+        def run() -> None:
+            workers = max_workers or max(len(manifest.models), 1)
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="voco-warmup") as pool:
+                list(pool.map(self._warmup_model, manifest.models))
+
+        if not wait:
+            threading.Thread(target=run, name="voco-warmup", daemon=True).start()
+            return {e.alias: self._warmup_status[e.alias] for e in manifest.models}
+
+        run()
+        statuses = {e.alias: self._warmup_status[e.alias] for e in manifest.models}
+        failed = [s for s in statuses.values() if s.state == FAILED]
+        if failed and raise_on_error:
+            details = "; ".join(f"{s.alias}: {s.error}" for s in failed)
+            raise WarmupError(f"Warmup failed for {len(failed)} model(s): {details}")
+        return statuses
+
+    def _warmup_model(self, entry: WarmupModel) -> None:
+        status = self._warmup_status[entry.alias]
+        status.started_at = time.time()
+        try:
+            status.state = LOADING
+            start = time.perf_counter()
+            if entry.alias not in self._models:
+                self.load(
+                    entry.name,
+                    alias=entry.alias,
+                    device=entry.device,
+                    dtype=entry.dtype,
+                    **entry.kwargs,
+                )
+            status.load_seconds = round(time.perf_counter() - start, 3)
+
+            status.state = WARMING
+            start = time.perf_counter()
+            self._models[entry.alias].warmup(voices=entry.voices)
+            for prompt in entry.prompts:
+                run_prompt(self.infer(entry.alias, cache=False, **prompt))
+                status.prompts_run += 1
+            status.warmup_seconds = round(time.perf_counter() - start, 3)
+
+            status.state = READY
+        except Exception as e:
+            status.state = FAILED
+            status.error = f"{type(e).__name__}: {e}"
+        finally:
+            status.finished_at = time.time()
+
+    def readiness(self) -> dict[str, Any]:
+        models = {alias: status.to_dict() for alias, status in self._warmup_status.items()}
+        return {
+            # Nothing warmed up yet is not ready
+            "ready": bool(models) and all(status["state"] == READY for status in models.values()),
+            "models": models,
+        }
+
     def __len__(self) -> int:
         return len(self._models)
 
@@ -0,0 +1,98 @@
+import json
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Optional, Union
+
+PENDING = "pending"
+LOADING = "loading"
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
+
+
+class WarmupError(Exception):
+    pass
+
+
+@dataclass
+class WarmupModel:
+    name: str
+    alias: Optional[str] = None
+    device: Optional[str] = None
+    dtype: Optional[str] = None
+    kwargs: dict[str, Any] = field(default_factory=dict)
+    voices: Union[list[Any], dict[str, Any]] = field(default_factory=list)
+    prompts: list[dict[str, Any]] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        if self.alias is None:
+            self.alias = self.name
+        # A bare string is shorthand for {"text": ...}
+        self.prompts = [{"text": p} if isinstance(p, str) else dict(p) for p in self.prompts]
+
+
+@dataclass
+class WarmupManifest:
+    models: list[WarmupModel] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "WarmupManifest":
+        models = []
+        for entry in data.get("models", []):
+            if isinstance(entry, str):
+                entry = {"name": entry}
+            known = {k: v for k, v in entry.items() if k in WarmupModel.__dataclass_fields__}
+            # Anything else is passed through to the model constructor
+            extra = {k: v for k, v in entry.items() if k not in WarmupModel.__dataclass_fields__}
+            known["kwargs"] = {**extra, **known.get("kwargs", {})}
+            models.append(WarmupModel(**known))
+
+        aliases = [m.alias for m in models]
+        duplicates = {a for a in aliases if aliases.count(a) > 1}
+        if duplicates:
+            names = ", ".join(sorted(duplicates))
+            raise ValueError(f"Duplicate aliases in warmup manifest: {names}")
+
+        return cls(models=models)
+
+    @classmethod
+    def from_file(cls, path: Union[str, Path]) -> "WarmupManifest":
+        with open(Path(path).expanduser(), "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+@dataclass
+class WarmupStatus:
+    alias: str
+    name: str
+    state: str = PENDING
+    load_seconds: Optional[float] = None
+    warmup_seconds: Optional[float] = None
+    prompts_run: int = 0
+    error: Optional[str] = None
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == READY
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+def run_prompt(result: Any) -> None:
+    # Generators only do work when consumed
+    if hasattr(result, "__next__"):
+        for _ in result:
+            pass
+
+
+def load_manifest(
+    manifest: Union[WarmupManifest, dict[str, Any], str, Path],
+) -> WarmupManifest:
+    if isinstance(manifest, WarmupManifest):
+        return manifest
+    if isinstance(manifest, dict):
+        return WarmupManifest.from_dict(manifest)
+    return WarmupManifest.from_file(manifest)
@@ -0,0 +1,278 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional, Union
+
+# Same on-disk layout as safetensors: an 8-byte little-endian header size, a JSON
+# header with dtype/shape/data_offsets per tensor, then the raw tensor bytes
+_DTYPE_NAMES = {
+    "float64": "F64",
+    "float32": "F32",
+    "float16": "F16",
+    "bfloat16": "BF16",
+    "int64": "I64",
+    "int32": "I32",
+    "int16": "I16",
+    "int8": "I8",
+    "uint8": "U8",
+    "bool": "BOOL",
+}
+
+# Nested checkpoints ({"module": state_dict}) are flattened with this separator,
+# which never appears in parameter names
+NESTED_SEPARATOR = "/"
+
+HEADER_ALIGNMENT = 64
+
+
+def _torch_dtype(name: str) -> Any:
+    import torch
+
+    for torch_name, st_name in _DTYPE_NAMES.items():
+        if st_name == name:
+            return getattr(torch, torch_name)
+    raise ValueError(f"Unsupported tensor dtype in weight file: {name}")
+
+
+def _dtype_name(dtype: Any) -> str:
+    name = str(dtype).replace("torch.", "")
+    if name not in _DTYPE_NAMES:
+        raise ValueError(f"Unsupported tensor dtype: {dtype}")
+    return _DTYPE_NAMES[name]
+
+
+def current_rss() -> int:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        # Peak rather than current RSS, but still shows growth between two points
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+def flatten_state_dict(state_dict: dict[str, Any], prefix: str = "") -> dict[str, Any]:
+    flat = {}
+    for key, value in state_dict.items():
+        if isinstance(value, dict):
+            flat.update(flatten_state_dict(value, f"{prefix}{key}{NESTED_SEPARATOR}"))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def unflatten_state_dict(flat: dict[str, Any]) -> dict[str, Any]:
+    nested: dict[str, Any] = {}
+    for key, value in flat.items():
+        parts = key.split(NESTED_SEPARATOR)
+        node = nested
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return nested
+
+
+def save_weights(
+    tensors: dict[str, Any],
+    path: Union[str, Path],
+    metadata: Optional[dict[str, str]] = None,
+) -> None:
+    import torch
+
+    path = Path(path)
+    flat = flatten_state_dict(tensors)
+
+    # Largest element size first keeps every tensor aligned to its own element size
+    names = sorted(flat, key=lambda k: (-flat[k].element_size(), k))
+
+    header: dict[str, Any] = {}
+    offset = 0
+    for name in names:
+        tensor = flat[name]
+        nbytes = tensor.numel() * tensor.element_size()
+        header[name] = {
+            "dtype": _dtype_name(tensor.dtype),
+            "shape": list(tensor.shape),
+            "data_offsets": [offset, offset + nbytes],
+        }
+        offset += nbytes
+
+    meta = dict(metadata or {})
+    if any(NESTED_SEPARATOR in name for name in names):
+        meta["voco_nested"] = "1"
+    if meta:
+        header["__metadata__"] = meta
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    # Pad with spaces so the data section starts on an aligned boundary
+    padding = -(8 + len(header_bytes)) % HEADER_ALIGNMENT
+    header_bytes += b" " * padding
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Per-thread temp name: parallel loads of the same checkpoint, in this process or another,
+    # must not write into each other's file. The last rename wins with a complete file
+    tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(struct.pack("<Q", len(header_bytes)))
+            f.write(header_bytes)
+            for name in names:
+                tensor = flat[name].detach().contiguous().cpu()
+                # Reinterpret as bytes so dtypes numpy lacks (bfloat16) are written as-is
+                f.write(tensor.view(-1).view(torch.uint8).numpy().tobytes())
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    os.replace(tmp_path, path)
+
+
+def load_weights(path: Union[str, Path], device: str = "cpu") -> dict[str, Any]:
+    import torch
+
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+        # Private copy-on-write mapping: pages come from the page cache and are only
+        # duplicated if a tensor is modified in place
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    metadata = header.pop("__metadata__", {})
+    data_start = 8 + header_size
+
+    tensors = {}
+    for name, info in header.items():
+        dtype = _torch_dtype(info["dtype"])
+        start, end = info["data_offsets"]
+        if end == start:
+            tensor = torch.empty(info["shape"], dtype=dtype)
+        else:
+            tensor = torch.frombuffer(
+                mapped,
+                dtype=dtype,
+                count=(end - start) // dtype.itemsize,
+                offset=data_start + start,
+            ).view(info["shape"])
+        tensors[name] = tensor.to(device) if device != "cpu" else tensor
+
+    if metadata.get("voco_nested") == "1":
+        return unflatten_state_dict(tensors)
+    return tensors
+
+
+class WeightStore:
+    def __init__(self, cache_dir: str = "~/.voco/weights") -> None:
+        self.cache_dir = Path(cache_dir).expanduser()
+        self._stats: dict[str, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def fingerprint(self, source: Union[str, Path], dtype: Optional[str] = None) -> str:
+        path = Path(source).expanduser().resolve()
+        st = path.stat()
+        key_str = f"{path}::{st.st_size}::{st.st_mtime_ns}::{dtype}"
+        return hashlib.sha256(key_str.encode()).hexdigest()[:16]
+
+    def _get_cache_path(self, source: Union[str, Path], dtype: Optional[str]) -> Path:
+        stem = Path(source).name.split(".")[0]
+        return self.cache_dir / f"{stem}-{self.fingerprint(source, dtype)}.safetensors"
+
+    def convert(
+        self,
+        source: Union[str, Path],
+        dtype: Optional[str] = None,
+        transform: Optional[Callable[[dict[str, Any]], dict[str, Any]]] = None,
+    ) -> Path:
+        cache_path = self._get_cache_path(source, dtype)
+        if cache_path.exists():
+            return cache_path
+
+        import torch
+
+        state_dict = torch.load(source, map_location="cpu", mmap=True, weights_only=True)
+        if transform is not None:
+            state_dict = transform(state_dict)
+
+        flat = flatten_state_dict(state_dict)
+        if dtype is not None:
+            target = getattr(torch, dtype)
+            flat = {
+                k: v.to(target) if v.is_floating_point() else v for k, v in flat.items()
+            }
+
+        save_weights(
+            flat,
+            cache_path,
+            metadata={"source": str(Path(source).expanduser().resolve())},
+        )
+        return cache_path
+
+    def load(
+        self,
+        source: Union[str, Path],
+        name: Optional[str] = None,
+        dtype: Optional[str] = None,
+        transform: Optional[Callable[[dict[str, Any]], dict[str, Any]]] = None,
+    ) -> dict[str, Any]:
+        # Pair with load_state_dict(..., assign=True) so parameters keep pointing at
+        # the mapping instead of being copied into freshly allocated storage
+        name = name or Path(source).name
+        with self.track(name) as record:
+            cache_path = self._get_cache_path(source, dtype)
+            record["converted"] = not cache_path.exists()
+            cache_path = self.convert(source, dtype=dtype, transform=transform)
+            record["path"] = str(cache_path)
+            return load_weights(cache_path)
+
+    @contextmanager
+    def track(self, name: str) -> Iterator[dict[str, Any]]:
+        record: dict[str, Any] = {}
+        rss_before = current_rss()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["load_seconds"] = round(time.perf_counter() - start, 3)
+            record["rss_delta_mb"] = round((current_rss() - rss_before) / 1024 / 1024, 1)
+            with self._lock:
+                self._stats[name] = record
+
+    def clear(self) -> None:
+        if not self.cache_dir.exists():
+            return
+        for file in self.cache_dir.glob("*.safetensors"):
+            file.unlink()
+
+    def stats(self) -> dict[str, Any]:
+        total_size = 0
+        total_files = 0
+        if self.cache_dir.exists():
+            for file in self.cache_dir.glob("*.safetensors"):
+                total_size += file.stat().st_size
+                total_files += 1
+
+        with self._lock:
+            loads = {name: dict(record) for name, record in self._stats.items()}
+
+        return {
+            "cache_size_mb": round(total_size / 1024 / 1024, 2),
+            "cached_files": total_files,
+            "rss_mb": round(current_rss() / 1024 / 1024, 1),
+            "loads": loads,
+        }
+
+
+_default_store: Optional[WeightStore] = None
+
+
+def get_weight_store() -> WeightStore:
+    global _default_store
+    if _default_store is None:
+        _default_store = WeightStore(os.environ.get("VOCO_WEIGHTS_DIR", "~/.voco/weights"))
+    return _default_store
@@ -0,0 +1,433 @@
+import struct
+from functools import lru_cache
+from math import gcd
+from typing import Any, Iterable, Iterator, Optional
+
+from voco.core import instrumentation
+from voco.core.audio import AudioChunk, ChunkStream, wav_header
+
+# Placeholder RIFF/data sizes for a WAV stream whose length is not known up front
+WAV_STREAM_SIZE = 0xFFFFFFFF
+
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+# Encoder lookahead in 48 kHz samples, which players skip at the start of the stream
+OPUS_PRE_SKIP = 312
+
+KAISER_BETA = 8.6
+# Outputs computed per vectorised step, which bounds the size of the gathered windows
+RESAMPLE_BLOCK = 8192
+
+
+def to_float32(chunk: AudioChunk) -> Any:
+    import numpy as np
+
+    audio = chunk.numpy()
+    if audio.dtype == np.float32:
+        return audio
+    if audio.dtype.kind == "f":
+        return audio.astype(np.float32)
+    if audio.dtype == np.uint8:
+        return (audio.astype(np.float32) - 128) / 128
+    return audio.astype(np.float32) / float(np.iinfo(audio.dtype).max + 1)
+
+
+def to_pcm16(audio: Any) -> Any:
+    import numpy as np
+
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2")
+
+
+def mulaw_encode(audio: Any) -> Any:
+    # G.711 μ-law on 14-bit samples: bias, find the segment, keep 4 mantissa bits
+    import numpy as np
+
+    pcm = to_pcm16(audio).astype(np.int32) >> 2
+    mask = np.where(pcm < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(pcm), 8159) + 0x21
+    segment = np.floor(np.log2(magnitude)).astype(np.int32) - 5
+    mantissa = (magnitude >> (segment + 1)) & 0x0F
+    code = np.where(segment > 7, 0x7F, (segment << 4) | mantissa)
+    return (code ^ mask).astype(np.uint8)
+
+
+@lru_cache(maxsize=32)
+def polyphase_bank(up: int, down: int, num_zeros: int = 16, rolloff: float = 0.945) -> Any:
+    """Kaiser-windowed sinc taps for every output phase of an up/down resampler.
+
+    Row p holds the taps applied to input samples base-H .. base+H for an output that
+    falls p/up of the way past input sample `base`.
+    """
+    import numpy as np
+
+    # Cutoff relative to the input Nyquist, lowered when downsampling to avoid aliasing
+    cutoff = min(1.0, up / down) * rolloff
+    half_width = num_zeros / cutoff
+    taps = int(np.ceil(half_width))
+
+    phases = np.arange(up)[:, None] / up
+    offsets = np.arange(-taps, taps + 1)[None, :]
+    distance = phases - offsets
+    window = np.i0(KAISER_BETA * np.sqrt(np.clip(1 - (distance / half_width) ** 2, 0, None)))
+    bank = cutoff * np.sinc(cutoff * distance) * window / np.i0(KAISER_BETA)
+    bank[np.abs(distance) >= half_width] = 0
+
+    bank = bank.astype(np.float32)
+    bank.flags.writeable = False
+    return bank
+
+
+class Resampler:
+    """Polyphase resampler that keeps state between chunks.
+
+    Feeding a signal in pieces and calling flush() gives exactly the same samples as
+    resampling it in one call.
+    """
+
+    def __init__(self, orig_sr: int, target_sr: int, num_zeros: int = 16) -> None:
+        import numpy as np
+
+        g = gcd(orig_sr, target_sr)
+        self.orig_sr = orig_sr
+        self.target_sr = target_sr
+        self.up = target_sr // g
+        self.down = orig_sr // g
+        self.bank = polyphase_bank(self.up, self.down, num_zeros)
+        self.taps = self.bank.shape[1] // 2
+        self.reset()
+        self._np = np
+
+    def reset(self) -> None:
+        import numpy as np
+
+        # Zeros stand in for the samples before the start of the stream
+        self._buffer = np.zeros(self.taps, dtype=np.float32)
+        self._buffer_start = -self.taps
+        self._received = 0
+        self._produced = 0
+
+    def _produce(self, end: int) -> Any:
+        np = self._np
+        outputs = []
+        kernel = np.arange(-self.taps, self.taps + 1)
+        for block in range(self._produced, end, RESAMPLE_BLOCK):
+            n = np.arange(block, min(block + RESAMPLE_BLOCK, end))
+            base, phase = np.divmod(n * self.down, self.up)
+            windows = self._buffer[(base - self._buffer_start)[:, None] + kernel]
+            outputs.append(np.einsum("nk,nk->n", windows, self.bank[phase]))
+        self._produced = max(end, self._produced)
+
+        # Drop input that no later output can reach
+        keep_from = (self._produced * self.down) // self.up - self.taps
+        if keep_from > self._buffer_start:
+            self._buffer = self._buffer[keep_from - self._buffer_start :]
+            self._buffer_start = keep_from
+
+        return np.concatenate(outputs) if outputs else np.zeros(0, dtype=np.float32)
+
+    def __call__(self, audio: Any) -> Any:
+        np = self._np
+        audio = np.asarray(audio, dtype=np.float32)
+        if self.up == self.down:
+            return audio
+
+        self._buffer = np.concatenate([self._buffer, audio])
+        self._received += len(audio)
+        # An output needs `taps` input samples of lookahead before it can be computed
+        ready = self._received - self.taps
+        end = -(-ready * self.up // self.down) if ready > 0 else 0
+        return self._produce(end)
+
+    def flush(self) -> Any:
+        np = self._np
+        if self.up == self.down:
+            return np.zeros(0, dtype=np.float32)
+
+        total = -(-self._received * self.up // self.down)
+        self._buffer = np.concatenate([self._buffer, np.zeros(self.taps, dtype=np.float32)])
+        tail = self._produce(total)
+        self.reset()
+        return tail
+
+
+def resample(audio: Any, orig_sr: int, target_sr: int) -> Any:
+    if orig_sr == target_sr:
+        return audio
+    resampler = Resampler(orig_sr, target_sr)
+    import numpy as np
+
+    return np.concatenate([resampler(audio), resampler.flush()])
+
+
+def resample_stream(chunks: Iterable[AudioChunk], target_sr: int) -> Iterator[AudioChunk]:
+    """Resample a stream of chunks, carrying filter state across chunk boundaries"""
+    resampler = None
+    stream = None
+    last = None
+    for chunk in chunks:
+        if chunk.sample_rate == target_sr and resampler is None:
+            yield chunk
+            continue
+        if resampler is None:
+            resampler = Resampler(chunk.sample_rate, target_sr)
+            stream = ChunkStream(target_sr)
+        last = chunk
+        audio = resampler(to_float32(chunk) if chunk.channels == 1 else to_float32(chunk).mean(1))
+        yield stream.chunk(audio, text=chunk.text, **chunk.metadata)
+
+    if resampler is not None:
+        tail = resampler.flush()
+        if len(tail):
+            yield stream.chunk(tail, text=None, **last.metadata)
+
+
+class StreamEncoder:
+    content_type = "application/octet-stream"
+
+    def __init__(self, sample_rate: Optional[int] = None) -> None:
+        self.sample_rate = sample_rate
+        self._resampler: Optional[Resampler] = None
+
+    def _prepare(self, chunk: AudioChunk) -> Any:
+        audio = to_float32(chunk)
+        if chunk.channels > 1:
+            audio = audio.mean(axis=1)
+        if self.sample_rate is None:
+            self.sample_rate = chunk.sample_rate
+        if chunk.sample_rate != self.sample_rate:
+            if self._resampler is None or self._resampler.orig_sr != chunk.sample_rate:
+                self._resampler = Resampler(chunk.sample_rate, self.sample_rate)
+            audio = self._resampler(audio)
+        return audio
+
+    def _encode_audio(self, audio: Any) -> bytes:
+        raise NotImplementedError
+
+    def encode(self, chunk: AudioChunk) -> bytes:
+        return self._encode_audio(self._prepare(chunk))
+
+    def flush(self) -> bytes:
+        # The resampler holds back a few samples of lookahead until the stream ends
+        if self._resampler is None:
+            return b""
+        tail = self._resampler.flush()
+        return self._encode_audio(tail) if len(tail) else b""
+
+    def stream(self, chunks: Iterable[AudioChunk]) -> Iterator[bytes]:
+        for chunk in chunks:
+            with instrumentation.span("encode", encoder=type(self).__name__):
+                data = self.encode(chunk)
+            if data:
+                yield data
+        tail = self.flush()
+        if tail:
+            yield tail
+
+
+class PCM16Encoder(StreamEncoder):
+    content_type = "audio/L16"
+
+    def encode(self, chunk: AudioChunk) -> bytes:
+        if chunk.dtype == "int16" and chunk.channels == 1 and chunk.sample_rate == (
+            self.sample_rate or chunk.sample_rate
+        ):
+            self.sample_rate = chunk.sample_rate
+            return chunk.tobytes()
+        return super().encode(chunk)
+
+    def _encode_audio(self, audio: Any) -> bytes:
+        return to_pcm16(audio).tobytes()
+
+
+class WavEncoder(StreamEncoder):
+    content_type = "audio/wav"
+
+    def __init__(self, sample_rate: Optional[int] = None, sample_format: str = "int16") -> None:
+        super().__init__(sample_rate)
+        if sample_format not in ("int16", "float32"):
+            raise ValueError(f"Unsupported WAV sample format: {sample_format}")
+        self.sample_format = sample_format
+        self._header_sent = False
+
+    def _encode_audio(self, audio: Any) -> bytes:
+        data = to_pcm16(audio).tobytes() if self.sample_format == "int16" else audio.tobytes()
+        if self._header_sent:
+            return data
+
+        self._header_sent = True
+        # Sizes are unknown while streaming; players read until the connection closes
+        header = bytearray(wav_header(self.sample_rate, self.sample_format, 1, 0))
+        header[4:8] = struct.pack("<I", WAV_STREAM_SIZE)
+        header[40:44] = struct.pack("<I", WAV_STREAM_SIZE)
+        return bytes(header) + data
+
+
+class MulawEncoder(StreamEncoder):
+    content_type = "audio/basic"
+
+    def __init__(self, sample_rate: int = 8000) -> None:
+        super().__init__(sample_rate)
+
+    def _encode_audio(self, audio: Any) -> bytes:
+        return mulaw_encode(audio).tobytes()
+
+
+def _ogg_crc_table() -> list[int]:
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+_OGG_CRC_TABLE = _ogg_crc_table()
+
+
+def ogg_crc(data: bytes) -> int:
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _OGG_CRC_TABLE[((crc >> 24) ^ byte) & 0xFF]
+    return crc
+
+
+class OggWriter:
+    def __init__(self, serial: int = 0x766F636F) -> None:
+        self.serial = serial
+        self.sequence = 0
+
+    def page(
+        self, packets: list[bytes], granule: int, first: bool = False, last: bool = False
+    ) -> bytes:
+        lacing = bytearray()
+        for packet in packets:
+            lacing += b"\xff" * (len(packet) // 255) + bytes([len(packet) % 255])
+        header_type = (0x02 if first else 0) | (0x04 if last else 0)
+        header = struct.pack(
+            "<4sBBqIIIB",
+            b"OggS", 0, header_type, granule, self.serial, self.sequence, 0, len(lacing),
+        )
+        page = bytearray(header + lacing + b"".join(packets))
+        page[22:26] = struct.pack("<I", ogg_crc(bytes(page)))
+        self.sequence += 1
+        return bytes(page)
+
+
+class OpusEncoder(StreamEncoder):
+    content_type = "audio/ogg"
+
+    def __init__(
+        self,
+        sample_rate: int = 48000,
+        bitrate: Optional[int] = None,
+        frame_ms: int = 20,
+        container: str = "ogg",
+        application: str = "audio",
+    ) -> None:
+        if sample_rate not in OPUS_SAMPLE_RATES:
+            raise ValueError(f"Opus supports sample rates {OPUS_SAMPLE_RATES}, got {sample_rate}")
+        if container not in ("ogg", "raw"):
+            raise ValueError(f"Unsupported Opus container: {container}")
+        try:
+            import opuslib
+        except ImportError as e:
+            raise ImportError(
+                "Failed to import `opuslib`. "
+                "Please install it with:\n"
+                "    pip install opuslib"
+            ) from e
+
+        super().__init__(sample_rate)
+        self.container = container
+        self.frame_size = sample_rate * frame_ms // 1000
+        self.content_type = "audio/ogg" if container == "ogg" else "audio/opus"
+
+        app = opuslib.APPLICATION_VOIP if application == "voip" else opuslib.APPLICATION_AUDIO
+        self._encoder = opuslib.Encoder(sample_rate, 1, app)
+        if bitrate is not None:
+            self._encoder.bitrate = bitrate
+
+        self._pending = None
+        self._ogg = OggWriter()
+        self._granule = 0
+        self._started = False
+
+    def _headers(self) -> bytes:
+        head = b"OpusHead" + struct.pack("<BBHIhB", 1, 1, OPUS_PRE_SKIP, self.sample_rate, 0, 0)
+        vendor = b"voco"
+        tags = b"OpusTags" + struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", 0)
+        return self._ogg.page([head], 0, first=True) + self._ogg.page([tags], 0)
+
+    def _encode_frames(self, audio: Any, last: bool = False) -> bytes:
+        import numpy as np
+
+        if self._pending is not None:
+            audio = np.concatenate([self._pending, audio])
+        if last and len(audio) % self.frame_size:
+            # Pad the final partial frame with silence
+            audio = np.pad(audio, (0, self.frame_size - len(audio) % self.frame_size))
+
+        usable = len(audio) - len(audio) % self.frame_size
+        self._pending = audio[usable:]
+        pcm = to_pcm16(audio[:usable])
+
+        packets = [
+            self._encoder.encode(pcm[i : i + self.frame_size].tobytes(), self.frame_size)
+            for i in range(0, usable, self.frame_size)
+        ]
+        if self.container == "raw":
+            # Length-prefixed packets, since raw Opus has no framing of its own
+            return b"".join(struct.pack(">I", len(p)) + p for p in packets)
+
+        out = b""
+        if not self._started:
+            self._started = True
+            out += self._headers()
+        # Granule positions always count 48 kHz samples
+        samples_48k = self.frame_size * 48000 // self.sample_rate
+        page: list[bytes] = []
+        segments = 0
+        for packet in packets:
+            needed = len(packet) // 255 + 1
+            if page and segments + needed > 255:
+                out += self._ogg.page(page, self._granule)
+                page, segments = [], 0
+            page.append(packet)
+            segments += needed
+            self._granule += samples_48k
+        if page or last:
+            out += self._ogg.page(page, self._granule, last=last)
+        return out
+
+    def _encode_audio(self, audio: Any) -> bytes:
+        return self._encode_frames(audio)
+
+    def flush(self) -> bytes:
+        import numpy as np
+
+        tail = self._resampler.flush() if self._resampler is not None else None
+        if tail is None or not len(tail):
+            tail = np.zeros(0, dtype=np.float32)
+        return self._encode_frames(tail, last=True)
+
+
+ENCODERS = {
+    "pcm16": PCM16Encoder,
+    "wav": WavEncoder,
+    "mulaw": MulawEncoder,
+    "opus": OpusEncoder,
+}
+
+
+def get_encoder(format: str, **kwargs: Any) -> StreamEncoder:
+    if format not in ENCODERS:
+        available = ", ".join(ENCODERS)
+        raise ValueError(f"Unknown audio format '{format}'. Available formats: {available}")
+    return ENCODERS[format](**kwargs)
+
+
+def encode_stream(
+    chunks: Iterable[AudioChunk], format: str = "wav", **kwargs: Any
+) -> Iterator[bytes]:
+    """Encode chunks from AudioRouter.infer as they arrive, without buffering the whole result"""
+    return get_encoder(format, **kwargs).stream(chunks)